@@ -1 +1 @@
-from .app import FlaskApplication
+from .app import create_app
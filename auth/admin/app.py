@@ -1,9 +1,11 @@
-from flask import Blueprint, render_template, request, current_app, flash, redirect, url_for
+from flask import Blueprint, abort, render_template, request, current_app, flash, redirect, send_from_directory, url_for
 from flask_login import current_user, login_required
 from auth.models import *
 from auth.admin.forms import *
 from auth.shared import EveAPI, SharedInfo
 from auth.decorators import needs_permission, alliance_required
+from auth.profiling import list_profiles, load_profile
+import os
 
 # Create and configure app
 Application = Blueprint('admin', __name__, template_folder='templates/admin', static_folder='static')
@@ -44,7 +46,7 @@ def index():
     alliance = Alliance.query.filter_by(id=current_app.config["ALLIANCE_ID"]).first()
 
     return render_template('admin/index.html', permissions=permissions, add_role_form=addRoleForm,
-                           role_forms=roleForms, corporations=alliance.corporations, corp_auth_url=EveAPI["corp_preston"].get_authorize_url())
+                           role_forms=roleForms, corporations=alliance.corporations.all(), corp_auth_url=EveAPI["corp_preston"].get_authorize_url())
 
 
 @Application.route('/sync/')
@@ -78,11 +80,74 @@ def sync():
                 current_app.logger.info("Sync failed.")
                 return redirect(url_for('admin.index'))
 
+    # Make sure every character follows the alliance of its corporation
+    SharedInfo['util'].refresh_character_alliances()
+
     current_app.logger.info("Sync completed successfully.")
     flash('Sync completed successfully.', 'success')
     return redirect(url_for('admin.index'))
 
 
+@Application.route('/profiles/')
+@login_required
+@alliance_required()
+@needs_permission('admin', 'Admin Profiles')
+def profiles():
+    """Lists the stored request profiles. Requests are profiled when an admin adds
+    the X-Profile header or the _profile=1 query argument.
+
+    Args:
+        None
+
+    Returns:
+        str: rendered template 'admin/profiles.html'.
+    """
+
+    return render_template('admin/profiles.html', profiles=list_profiles(current_app.config.get('PROFILE_DIRECTORY', 'profiles')))
+
+
+@Application.route('/profiles/<name>')
+@login_required
+@alliance_required()
+@needs_permission('admin', 'Admin Profiles')
+def view_profile(name):
+    """Shows the CPU and memory report of a stored request profile.
+
+    Args:
+        name (str): Name of the profile.
+
+    Returns:
+        str: rendered template 'admin/profile.html'.
+    """
+
+    profile = load_profile(current_app.config.get('PROFILE_DIRECTORY', 'profiles'), name)
+    if profile is None:
+        abort(404)
+
+    return render_template('admin/profile.html', name=name, profile=profile)
+
+
+@Application.route('/profiles/<name>/download')
+@login_required
+@alliance_required()
+@needs_permission('admin', 'Admin Profiles')
+def download_profile(name):
+    """Downloads a stored request profile, to open it in pstats or snakeviz.
+
+    Args:
+        name (str): Name of the profile.
+
+    Returns:
+        Response: the .prof file of the profile.
+    """
+
+    directory = current_app.config.get('PROFILE_DIRECTORY', 'profiles')
+    if load_profile(directory, name) is None:
+        abort(404)
+
+    return send_from_directory(os.path.abspath(directory), name + '.prof', as_attachment=True)
+
+
 def create_edit_role_forms(permissions, create_permissions):
     """Creates the edit role forms with the correct permissions.
 
@@ -99,10 +164,11 @@ def create_edit_role_forms(permissions, create_permissions):
         roleForm = EditRoleForm()
         roleForm.name = role.name
         if create_permissions:
+            rolePermissions = set(role.permissions)
             for permission in permissions:
                 permForm = PermissionForm()
                 permForm.permissionIndex = permission.id
-                permForm.has_permission = permission in role.permissions
+                permForm.has_permission = permission in rolePermissions
                 roleForm.permissions.append_entry(permForm)
         roleForms.append(roleForm)
     return roleForms
@@ -174,6 +240,7 @@ def edit_role_from_form(permissions, role_forms, role_name):
                         role.permissions.remove(permission)
                         removedPermissionNames.append(permission.name)
 
+            role.invalidate_permissions()
             Database.session.commit()
             flash('Succesfully edited role {} by adding the following permissions: "{}" and by removing the following permissions: "{}".'.format(
                 role.name, ", ".join(addedPermissionNames), ", ".join(removedPermissionNames)), 'success')
@@ -220,18 +287,17 @@ def sync_database_membership():
 
     current_app.logger.info("Syncing database membership ...")
 
-    # Loop over all characters in the database
-    for character in Character.query.all():
-        # Get character information
-        characterPayload = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(str(character.id)))
-        characterJson = characterPayload.json()
+    # Get the corporation of every character in the database in bulk
+    characterIds = [characterId for characterId, in Database.session.query(Character.id)]
+    statusCode, affiliations = SharedInfo['util'].get_character_affiliations(characterIds)
 
-        if characterPayload.status_code != 200:
-            current_app.logger.error('sync_database_membership > Sync failed with error {}: {}'.format(str(characterPayload.status_code, characterJson['error'])))
-            current_app.logger.info('Database membership sync failed.')
-            return characterPayload.status_code
+    if statusCode != 200:
+        current_app.logger.error('sync_database_membership > Sync failed with error {}.'.format(str(statusCode)))
+        current_app.logger.info('Database membership sync failed.')
+        return statusCode
 
-        SharedInfo['util'].update_character_corporation(character, characterJson['corporation_id'])
+    # Update all characters that changed corporation in one transaction
+    SharedInfo['util'].create_characters(characterIds, affiliations=affiliations)
 
     current_app.logger.info("Successfully synced database membership.")
     return 200
@@ -249,9 +315,12 @@ def sync_corp_membership(corporation):
 
     current_app.logger.info("Syncing {} membership ...".format(corporation.name))
 
-    # Update access token
-    EveAPI["corp_preston"].refresh_token = corporation.refresh_token
-    corporation.access_token = EveAPI["corp_preston"]._get_access_from_refresh()[0]
+    # Update access token, with a preston of this sync only since other threads use the shared one
+    preston = EveAPI.create("corp_preston")
+    preston.refresh_token = corporation.refresh_token
+    corporation.access_token = preston._get_access_from_refresh()[0]
+    # Commit right away, a pending change would hold the write lock during the ESI requests below
+    Database.session.commit()
 
     # Get members in corp
     membersPayload = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/members/?datasource=tranquility&token={}".format(
@@ -259,18 +328,12 @@ def sync_corp_membership(corporation):
     membersJson = membersPayload.json()
 
     if membersPayload.status_code != 200:
-        current_app.logger.error('sync_corp_membership > Sync failed with error {}: {}'.format(str(membersPayload.status_code, membersJson['error'])))
+        current_app.logger.error('sync_corp_membership > Sync failed with error {}: {}'.format(str(membersPayload.status_code), membersJson.get('error')))
         current_app.logger.info('Corp membership sync failed.')
         return membersPayload.status_code
 
-    # Loop over all corp members
-    for member in membersJson:
-        # Check if character already exists in database
-        character = Character.query.filter_by(id=member).first()
-
-        # If not, create it
-        if not character:
-            character = SharedInfo['util'].create_character(member)
+    # Create all corp members that are not in the database yet in one transaction
+    SharedInfo['util'].create_characters(membersJson)
 
     current_app.logger.info("Successfully synced {} membership.".format(corporation.name))
     return 200
@@ -1,14 +1,24 @@
-import logging
 from datetime import timedelta
 
-from flask import Flask, render_template, redirect, request, url_for, flash
+from flask import Flask, Response, abort, current_app, render_template, redirect, request, session, url_for, flash
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
+from flask_migrate import Migrate
 from auth.shared import Database, SharedInfo, EveAPI
 from auth.admin.app import Application as admin_blueprint
+from auth.assets import install_assets
+from auth.conditional import install_conditional_responses
 from auth.corp_management.app import Application as corp_management_blueprint
 from auth.hr import Application as hr_blueprint
 from auth.esi_parser import Application as esi_parser_blueprint
+from auth.logs import install_logging
+from auth.metrics import install_metrics, render_metrics
 from auth.models import *
+from auth.page_cache import install_page_cache, render_cached_template
+from auth.principal import load_principal, store_changed_principal
+from auth.profiling import install_profiling
+from auth.query_stats import install_query_stats
+from auth.sqlite import SerializedWriter, set_sqlite_pragmas
+from auth.templating import install_template_cache
 from auth.util import Util
 
 import praw
@@ -16,109 +26,166 @@ from preston import Preston
 
 # -- Initialisation -- #
 
-
-# Create and configure app
-FlaskApplication = Flask(__name__)
-FlaskApplication.permanent_session_lifetime = timedelta(days=14)
-FlaskApplication.config.from_pyfile('config.cfg')
-SharedInfo['alliance_id'] = FlaskApplication.config['ALLIANCE_ID']
-SharedInfo['user_agent'] = 'Apate Auth App ({})'.format(FlaskApplication.config['USER_AGENT_EMAIL'])
-
-# Database connection
-Database.app = FlaskApplication
-Database.init_app(FlaskApplication)
+# Scopes of the full ESI authentication applicants give.
+FullAuthScopes = "esi-calendar.read_calendar_events.v1 esi-location.read_location.v1 esi-location.read_ship_type.v1 esi-mail.read_mail.v1 esi-skills.read_skills.v1 esi-skills.read_skillqueue.v1 esi-wallet.read_character_wallet.v1 esi-clones.read_clones.v1 esi-characters.read_contacts.v1 esi-universe.read_structures.v1 esi-bookmarks.read_character_bookmarks.v1 esi-killmails.read_killmails.v1 esi-assets.read_assets.v1 esi-planets.manage_planets.v1 esi-fleets.read_fleet.v1 esi-fittings.read_fittings.v1 esi-markets.structure_markets.v1 esi-characters.read_loyalty.v1 esi-characters.read_opportunities.v1 esi-characters.read_chat_channels.v1 esi-characters.read_medals.v1 esi-characters.read_standings.v1 esi-characters.read_agents_research.v1 esi-industry.read_character_jobs.v1 esi-markets.read_character_orders.v1 esi-characters.read_blueprints.v1 esi-characters.read_corporation_roles.v1 esi-location.read_online.v1 esi-contracts.read_character_contracts.v1 esi-clones.read_implants.v1 esi-characters.read_fatigue.v1 esi-characters.read_notifications.v1 esi-industry.read_character_mining.v1 esi-characters.read_titles.v1 esi-characters.read_fw_stats.v1 esi-characterstats.read.v1"
 
 # User management
-LoginManager = LoginManager(FlaskApplication)
+LoginManager = LoginManager()
 LoginManager.login_message = ''
 LoginManager.login_view = 'login'
 
-# Application logging
-FlaskApplication.logger.setLevel(FlaskApplication.config['LOGGING_LEVEL'])
-LogFormat = logging.Formatter(style='{', fmt='{asctime} [{levelname}] {message}', datefmt='%Y-%m-%d %H:%M:%S')
-
-FileHandler = logging.FileHandler('log.txt')
-FileHandler.setFormatter(LogFormat)
-FileHandler.setLevel(FlaskApplication.config['LOGGING_LEVEL'])
-FlaskApplication.logger.addHandler(FileHandler)
-
-ConsoleHandler = logging.StreamHandler()
-ConsoleHandler.setFormatter(LogFormat)
-ConsoleHandler.setLevel(FlaskApplication.config['LOGGING_LEVEL'])
-FlaskApplication.logger.addHandler(ConsoleHandler)
-
-# EVE  API connection
-EveAPI["default_user_preston"] = Preston(
-    user_agent=EveAPI['user_agent'],
-    client_id=FlaskApplication.config['EVE_DEFAULT_USER_CLIENT'],
-    client_secret=FlaskApplication.config['EVE_DEFAULT_USER_SECRET'],
-    callback_url=FlaskApplication.config['BASE_URL'] + '/eve/user/default/callback'
-)
-
-EveAPI["corp_preston"] = Preston(
-    user_agent=EveAPI['user_agent'],
-    client_id=FlaskApplication.config['CORP_CLIENT_ID'],
-    client_secret=FlaskApplication.config['CORP_CLIENT_SECRET'],
-    callback_url=FlaskApplication.config['BASE_URL'] + "/corp_management/eve/corp/callback",
-    scope="esi-corporations.read_corporation_membership.v1"
-)
-
-EveAPI["full_auth_preston"] = Preston(
-    user_agent=EveAPI['user_agent'],
-    client_id=FlaskApplication.config['EVE_FULL_AUTH_CLIENT_ID'],
-    client_secret=FlaskApplication.config['EVE_FULL_AUTH_SECRET'],
-    callback_url=FlaskApplication.config['BASE_URL'] + "/eve/user/auth/callback",
-    scope="esi-calendar.read_calendar_events.v1 esi-location.read_location.v1 esi-location.read_ship_type.v1 esi-mail.read_mail.v1 esi-skills.read_skills.v1 esi-skills.read_skillqueue.v1 esi-wallet.read_character_wallet.v1 esi-clones.read_clones.v1 esi-characters.read_contacts.v1 esi-universe.read_structures.v1 esi-bookmarks.read_character_bookmarks.v1 esi-killmails.read_killmails.v1 esi-assets.read_assets.v1 esi-planets.manage_planets.v1 esi-fleets.read_fleet.v1 esi-fittings.read_fittings.v1 esi-markets.structure_markets.v1 esi-characters.read_loyalty.v1 esi-characters.read_opportunities.v1 esi-characters.read_chat_channels.v1 esi-characters.read_medals.v1 esi-characters.read_standings.v1 esi-characters.read_agents_research.v1 esi-industry.read_character_jobs.v1 esi-markets.read_character_orders.v1 esi-characters.read_blueprints.v1 esi-characters.read_corporation_roles.v1 esi-location.read_online.v1 esi-contracts.read_character_contracts.v1 esi-clones.read_implants.v1 esi-characters.read_fatigue.v1 esi-characters.read_notifications.v1 esi-industry.read_character_mining.v1 esi-characters.read_titles.v1 esi-characters.read_fw_stats.v1 esi-characterstats.read.v1"
-)
-
-# Reddit connection
-SharedInfo['reddit'] = praw.Reddit(
-    client_id=FlaskApplication.config['REDDIT_OAUTH_CLIENT_ID'],
-    client_secret=FlaskApplication.config['REDDIT_OAUTH_SECRET'],
-    redirect_uri=FlaskApplication.config['BASE_URL'] + "/reddit/callback",
-    user_agent=FlaskApplication.config['REDDIT_USER_AGENT']
-)
-
-# Util
-SharedInfo['util'] = Util(
-    FlaskApplication
-)
-
-# Jinja global variables
-FlaskApplication.jinja_env.globals.update(login_url=EveAPI["default_user_preston"].get_authorize_url())
-
-
-# Jinja global functions
-FlaskApplication.jinja_env.globals.update(string_to_datetime=SharedInfo['util'].string_to_datetime)
-FlaskApplication.jinja_env.globals.update(datetime_to_string=SharedInfo['util'].datetime_to_string)
-FlaskApplication.jinja_env.globals.update(age_from_now=SharedInfo['util'].age_from_now)
-
-# Blueprints
-FlaskApplication.register_blueprint(admin_blueprint, url_prefix='/admin')
-FlaskApplication.register_blueprint(corp_management_blueprint, url_prefix='/corp_management')
-FlaskApplication.register_blueprint(hr_blueprint, url_prefix='/hr')
-FlaskApplication.register_blueprint(esi_parser_blueprint, url_prefix='/esi_parser')
-
-FlaskApplication.logger.info('Initialization complete')
+
+def create_app(config_file='config.cfg'):
+    """Creates and configures the application. The ESI and Reddit clients are not created here,
+    every process creates them the first time it uses them.
+
+    Args:
+        config_file (str): Config file, relative to the auth package.
+
+    Returns:
+        Flask: The application.
+    """
+
+    # Create and configure app
+    application = Flask(__name__)
+    application.permanent_session_lifetime = timedelta(days=14)
+    application.config.from_pyfile(config_file)
+    SharedInfo['alliance_id'] = application.config['ALLIANCE_ID']
+    SharedInfo['user_agent'] = 'Apate Auth App ({})'.format(application.config['USER_AGENT_EMAIL'])
+
+    # Database connection
+    Database.app = application
+    Database.init_app(application)
+    Migrate(application, Database)
+
+    # SQLite production mode, for several workers sharing one database file
+    if Database.engine.dialect.name == 'sqlite':
+        set_sqlite_pragmas(Database.engine, application.config.get('SQLITE_WAL', False), application.config.get('SQLITE_BUSY_TIMEOUT', 30))
+        if application.config.get('SQLITE_SERIALIZED_WRITER', False):
+            SharedInfo['writer'] = SerializedWriter(Database.engine)
+
+    # Query count and time of every request
+    install_query_stats(application, Database.engine)
+    install_metrics(application)
+
+    # User management
+    LoginManager.init_app(application)
+    application.after_request(store_changed_principal)
+
+    # Profiling of single requests, for admins
+    install_profiling(application)
+
+    # Application logging, written by a background thread
+    install_logging(application)
+
+    # EVE API and Reddit connections
+    config = application.config
+    EveAPI.set_factory('default_user_preston', lambda: Preston(
+        user_agent=EveAPI['user_agent'],
+        client_id=config['EVE_DEFAULT_USER_CLIENT'],
+        client_secret=config['EVE_DEFAULT_USER_SECRET'],
+        callback_url=config['BASE_URL'] + '/eve/user/default/callback'
+    ))
+
+    EveAPI.set_factory('corp_preston', lambda: Preston(
+        user_agent=EveAPI['user_agent'],
+        client_id=config['CORP_CLIENT_ID'],
+        client_secret=config['CORP_CLIENT_SECRET'],
+        callback_url=config['BASE_URL'] + "/corp_management/eve/corp/callback",
+        scope="esi-corporations.read_corporation_membership.v1"
+    ))
+
+    EveAPI.set_factory('full_auth_preston', lambda: Preston(
+        user_agent=EveAPI['user_agent'],
+        client_id=config['EVE_FULL_AUTH_CLIENT_ID'],
+        client_secret=config['EVE_FULL_AUTH_SECRET'],
+        callback_url=config['BASE_URL'] + "/eve/user/auth/callback",
+        scope=FullAuthScopes
+    ))
+
+    SharedInfo.set_factory('reddit', lambda: praw.Reddit(
+        client_id=config['REDDIT_OAUTH_CLIENT_ID'],
+        client_secret=config['REDDIT_OAUTH_SECRET'],
+        redirect_uri=config['BASE_URL'] + "/reddit/callback",
+        user_agent=config['REDDIT_USER_AGENT']
+    ))
+
+    # Util
+    SharedInfo['util'] = Util(
+        application
+    )
+
+    # Fingerprinted and precompressed static files, if they were built
+    install_assets(application)
+
+    # Rendered pages and fragments, invalidated by changes of their models
+    install_page_cache(application)
+
+    # ETags, 304 Not Modified and gzip for pages
+    install_conditional_responses(application)
+
+    # Compiled templates, shared by the workers
+    install_template_cache(application)
+
+    # Jinja global variables
+    application.context_processor(inject_login_url)
+
+    # Jinja global functions
+    application.jinja_env.globals.update(string_to_datetime=SharedInfo['util'].string_to_datetime)
+    application.jinja_env.globals.update(datetime_to_string=SharedInfo['util'].datetime_to_string)
+    application.jinja_env.globals.update(age_from_now=SharedInfo['util'].age_from_now)
+
+    # Routes
+    application.add_url_rule('/', 'landing', landing)
+    application.add_url_rule('/eve/user/default/callback', 'eve_oauth_callback', eve_oauth_callback)
+    application.add_url_rule('/eve/user/auth/callback', 'eve_oath_full_callback', eve_oath_full_callback)
+    application.add_url_rule('/reddit/callback', 'reddit_oath_callback', reddit_oath_callback)
+    application.add_url_rule('/logout', 'logout', logout)
+    application.add_url_rule('/metrics', 'metrics', metrics)
+    application.add_url_rule('/login', 'login', login)
+    application.register_error_handler(404, error_404)
+    application.register_error_handler(500, error_500)
+
+    # Blueprints
+    application.register_blueprint(admin_blueprint, url_prefix='/admin')
+    application.register_blueprint(corp_management_blueprint, url_prefix='/corp_management')
+    application.register_blueprint(hr_blueprint, url_prefix='/hr')
+    application.register_blueprint(esi_parser_blueprint, url_prefix='/esi_parser')
+
+    application.logger.info('Initialization complete')
+    return application
 # -- End Initialisation -- #
 
 # -- Methods -- #
 
 
+def inject_login_url():
+    """Gives templates the EVE SSO login URL. The URL is only built when a template is rendered,
+    so the SSO client is not created while the application starts.
+
+    Args:
+        None
+
+    Returns:
+        dict: Template context with login_url.
+    """
+    return dict(login_url=EveAPI["default_user_preston"].get_authorize_url())
+
+
 @LoginManager.user_loader
 def load_user(character_id):
-    """Takes a string int and returns a auth.models.Character object for Flask-Login.
+    """Takes a string int and returns the principal of that character for Flask-Login. The principal is
+    cached in the session for PRINCIPAL_CACHE_SECONDS, so most requests don't load the character.
 
     Args:
         character_id (str): character model id
 
     Returns:
-        auth.models.Character: character with that id
+        auth.principal.Principal: principal of the character with that id
     """
-    return Character.query.filter_by(id=int(character_id)).first()
+    return load_principal(int(character_id))
 
 
-@FlaskApplication.route('/')
 def landing():
     """Landing page of the website.
 
@@ -129,13 +196,17 @@ def landing():
         str: redirect to the appropriate url.
     """
 
-    # Find main alliance
-    alliance = Alliance.query.filter_by(id=SharedInfo['alliance_id']).first()
+    def get_context():
+        # Find main alliance
+        return dict(alliance=Alliance.query.filter_by(id=SharedInfo['alliance_id']).first())
 
-    return render_template('landing.html', alliance=alliance)
+    # Every anonymous visitor gets the same page
+    if current_user.is_anonymous:
+        return render_cached_template('landing.html', ['Alliance'], get_context)
+
+    return render_template('landing.html', **get_context())
 
 
-@FlaskApplication.route('/eve/user/default/callback')
 def eve_oauth_callback():
     """Completes the EVE SSO login. Here, auth.models.Characters model
     is created for the user if they doesn't exist and the user is redirected
@@ -149,13 +220,13 @@ def eve_oauth_callback():
         the user is a new user, or the index endpoint if they're already a member.
     """
     if 'error' in request.path:
-        FlaskApplication.logger.error('Error in EVE SSO callback: ' + request.url)
+        current_app.logger.error('Error in EVE SSO callback: ' + request.url)
         flash('There was an error in EVE\'s response', 'danger')
         return redirect(url_for('login'))
     try:
         auth = EveAPI["default_user_preston"].authenticate(request.args['code'])
     except Exception as e:
-        FlaskApplication.logger.error('ESI signing error: ' + str(e))
+        current_app.logger.error('ESI signing error: ' + str(e))
         flash('There was an authentication error signing you in.', 'danger')
         return redirect(url_for('login'))
 
@@ -175,7 +246,7 @@ def eve_oauth_callback():
             SharedInfo['util'].update_character_corporation(character, corporationId)
 
         login_user(character)
-        FlaskApplication.logger.debug('{} logged in with EVE SSO'.format(current_user.name))
+        current_app.logger.debug('{} logged in with EVE SSO'.format(current_user.name))
         flash('Logged in', 'success')
         return redirect(url_for('landing'))
 
@@ -188,7 +259,6 @@ def eve_oauth_callback():
     return redirect(url_for('landing'))
 
 
-@FlaskApplication.route('/eve/user/auth/callback')
 @login_required
 def eve_oath_full_callback():
     """Completes the EVE SSO login for a fully authed user. Here, a user's
@@ -201,13 +271,13 @@ def eve_oath_full_callback():
         str: If nothing went wrong, redirect to the place they came from.
     """
     if 'error' in request.path:
-        FlaskApplication.logger.error('Error in EVE SSO callback: ' + request.url)
+        current_app.logger.error('Error in EVE SSO callback: ' + request.url)
         flash('There was an error in EVE\'s response', 'danger')
         return redirect(url_for('landing'))
     try:
         auth = EveAPI["full_auth_preston"].authenticate(request.args['code'])
     except Exception as e:
-        FlaskApplication.logger.error('ESI signing error: ' + str(e))
+        current_app.logger.error('ESI signing error: ' + str(e))
         flash('There was an authentication error signing you in.', 'danger')
         return redirect(url_for('landing'))
 
@@ -216,21 +286,20 @@ def eve_oath_full_callback():
     characterId = characterInfo['CharacterID']
     if current_user.id != characterId:
         flash("You have to authenticate the character you're applying with!", 'danger')
-        FlaskApplication.logger.info("{} tried to fully authenticate with {}.".format(current_user.name, characterInfo['CharacterName']))
+        current_app.logger.info("{} tried to fully authenticate with {}.".format(current_user.name, characterInfo['CharacterName']))
         return redirect(request.args.get('state'))
 
     current_user.access_token = auth.access_token
     current_user.refresh_token = auth.refresh_token
     Database.session.commit()
 
-    FlaskApplication.logger.info("{} succesfully updated ESI for {} with access token {} and refresh token {}".format(
+    current_app.logger.info("{} succesfully updated ESI for {} with access token {} and refresh token {}".format(
         current_user.name, current_user.name, str(auth.access_token), str(auth.refresh_token)))
     flash('Succesfully provided ESI.', 'success')
 
     return redirect(request.args.get('state'))
 
 
-@FlaskApplication.route('/reddit/callback')
 @login_required
 def reddit_oath_callback():
     """Completes the reddit SSO login for a user.
@@ -242,16 +311,17 @@ def reddit_oath_callback():
     Returns:
         str: If nothing went wrong, redirect to the place they came from.
     """
-    SharedInfo['reddit'].auth.authorize(request.args['code'])
-    current_user.reddit = str(SharedInfo['reddit'].user.me())
+    # Authorizing changes the client, so this request gets its own instead of the shared one
+    reddit = SharedInfo.create('reddit')
+    reddit.auth.authorize(request.args['code'])
+    current_user.reddit = str(reddit.user.me())
     Database.session.commit()
-    FlaskApplication.logger.info("{} succesfully updated Reddit (/u/{})".format(current_user.name, current_user.reddit))
+    current_app.logger.info("{} succesfully updated Reddit (/u/{})".format(current_user.name, current_user.reddit))
     flash("Successfully linked reddit account {}".format(current_user.reddit), 'success')
 
     return redirect(request.args.get('state'))
 
 
-@FlaskApplication.route('/logout')
 def logout():
     """Logs the user out of the site.
 
@@ -264,12 +334,30 @@ def logout():
     if current_user.is_anonymous:
         return redirect(url_for('landing'))
 
-    FlaskApplication.logger.debug('{} logged out'.format(current_user.name if not current_user.is_anonymous else 'unknown user'))
+    current_app.logger.debug('{} logged out'.format(current_user.name if not current_user.is_anonymous else 'unknown user'))
     logout_user()
+    session.pop('principal', None)
     return redirect(url_for('landing'))
 
 
-@FlaskApplication.route('/login')
+def metrics():
+    """Shows the metrics of all workers in the Prometheus text format. Only admins and scrapers
+    on the server itself may see them.
+
+    Args:
+        None
+
+    Returns:
+        str: the metrics
+    """
+    # Requests through the reverse proxy come from localhost too, they carry a forwarding header
+    isLocal = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers and 'X-Real-IP' not in request.headers
+    if not isLocal and not (current_user.is_authenticated and current_user.has_permission('admin')):
+        abort(403)
+
+    return Response(render_metrics(current_app), mimetype='text/plain; version=0.0.4')
+
+
 def login():
     """Directs user to the login page.
 
@@ -282,7 +370,6 @@ def login():
     return redirect(EveAPI["default_user_preston"].get_authorize_url())
 
 
-@FlaskApplication.errorhandler(404)
 def error_404(e):
     """Catches 404 errors in the app and shows the user an error page.
 
@@ -292,13 +379,12 @@ def error_404(e):
     Returns:
         str: rendered template 'error_404.html'
     """
-    FlaskApplication.logger.error('404 error at "{}" by {}: {}'.format(
+    current_app.logger.error('404 error at "{}" by {}: {}'.format(
         request.url, current_user.name if not current_user.is_anonymous else 'unknown user', str(e))
     )
     return render_template('error_404.html')
 
 
-@FlaskApplication.errorhandler(500)
 def error_500(e):
     """Catches 500 errors in the app and shows the user an error page.
 
@@ -308,7 +394,7 @@ def error_500(e):
     Returns:
         str: rendered template 'error_404.html'
     """
-    FlaskApplication.logger.error('500 error at "{}" by {}: {}'.format(
+    current_app.logger.error('500 error at "{}" by {}: {}'.format(
         request.url, current_user.name if not current_user.is_anonymous else 'unknown user', str(e))
     )
     return render_template('error_500.html')
@@ -0,0 +1,297 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from flask import request, send_from_directory
+
+# Optional, without fontTools and brotli the fonts are not converted to WOFF2 and nothing is compressed with brotli
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    font_subset = None
+
+mimetypes.add_type('font/woff2', '.woff2')
+
+# Source files of the static libraries that pages never load.
+SkippedExtensions = ['.less', '.scss', '.styl', '.md']
+
+# Files compressed with gzip and brotli, the other types (images, WOFF fonts) are compressed already.
+CompressedExtensions = ['.css', '.js', '.svg', '.ico', '.ttf', '.otf', '.eot', '.txt', '.json']
+
+# Text fonts that are cut down to Latin characters. Icon fonts keep all their glyphs, they are in the private use area.
+SubsetFontDirectories = ['font/roboto/']
+SubsetUnicodes = 'U+0000-00FF,U+0131,U+0152-0153,U+02BB-02BC,U+02C6,U+02DA,U+02DC,U+2000-206F,U+2074,U+20AC,U+2122,U+2191,U+2193,U+2212,U+2215,U+FEFF,U+FFFD'
+
+# Built files never change, their name changes with their content.
+ImmutableCacheControl = 'public, max-age=31536000, immutable'
+
+CssUrlPattern = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+CssWoffPattern = re.compile(r'''url\((['"]?)([^'")#?]+)\.woff([^'")]*)\1\)\s*format\((['"])woff\4\)''')
+
+
+def get_hashed_name(name, content):
+    """Adds the hash of the content of a file to its name, like css/global.3f2a9c1d04b7.css.
+
+    Args:
+        name (str): Path of the file, relative to the static directory.
+        content (bytes): Content of the file.
+
+    Returns:
+        str: Hashed path.
+    """
+
+    root, extension = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, hashlib.sha256(content).hexdigest()[:12], extension)
+
+
+def convert_font(path, name):
+    """Converts a TrueType or OpenType font to WOFF2, cut down to Latin characters if it is in SubsetFontDirectories.
+
+    Args:
+        path (str): Path of the font file.
+        name (str): Path of the font, relative to the static directory.
+
+    Returns:
+        bytes: The WOFF2 font, None if fontTools or brotli is not installed.
+    """
+
+    if font_subset is None or brotli is None:
+        return None
+
+    outputPath = path + '.woff2.tmp'
+    if any(name.startswith(directory) for directory in SubsetFontDirectories):
+        options = font_subset.Options()
+        options.flavor = 'woff2'
+        font = font_subset.load_font(path, options)
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(unicodes=font_subset.parse_unicodes(SubsetUnicodes))
+        subsetter.subset(font)
+        font_subset.save_font(font, outputPath, options)
+    else:
+        font = TTFont(path)
+        font.flavor = 'woff2'
+        font.save(outputPath)
+
+    with open(outputPath, 'rb') as fontFile:
+        content = fontFile.read()
+    os.remove(outputPath)
+    return content
+
+
+def rewrite_css(name, content, manifest):
+    """Points the url() references of a stylesheet at the hashed files, and offers the WOFF2 version of every
+    WOFF font before the WOFF one.
+
+    Args:
+        name (str): Path of the stylesheet, relative to the static directory.
+        content (bytes): Content of the stylesheet.
+        manifest (dict): Paths of the built files, as original path -> hashed path.
+
+    Returns:
+        bytes: The rewritten stylesheet.
+    """
+
+    directory = posixpath.dirname(name)
+
+    def resolve(reference):
+        return posixpath.normpath(posixpath.join(directory, reference))
+
+    def add_woff2(match):
+        quote, root = match.group(1), match.group(2)
+        if resolve(root + '.woff2') not in manifest:
+            return match.group(0)
+        return 'url({0}{1}.woff2{0}) format({2}woff2{2}), {3}'.format(quote, root, match.group(4), match.group(0))
+
+    def hash_url(match):
+        quote, reference = match.group(1), match.group(2)
+        if reference.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+            return match.group(0)
+        # Query strings and fragments, like the one of SVG fonts, stay as they are
+        path, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+        target = resolve(path)
+        if target not in manifest:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(manifest[target], directory), suffix)
+
+    text = CssWoffPattern.sub(add_woff2, content.decode('utf-8'))
+    return CssUrlPattern.sub(hash_url, text).encode('utf-8')
+
+
+def write_compressed(path, content):
+    """Writes the gzip and brotli versions of a file next to it, if they are smaller.
+
+    Args:
+        path (str): Path of the file.
+        content (bytes): Content of the file.
+
+    Returns:
+        dict: Size of every written version, by encoding.
+    """
+
+    sizes = {}
+    compressors = [('gzip', '.gz', lambda data: gzip.compress(data, 9))]
+    if brotli is not None:
+        compressors.append(('br', '.br', lambda data: brotli.compress(data, quality=11)))
+
+    for encoding, extension, compress in compressors:
+        compressed = compress(content)
+        if len(compressed) < len(content):
+            with open(path + extension, 'wb') as compressedFile:
+                compressedFile.write(compressed)
+            sizes[encoding] = len(compressed)
+    return sizes
+
+
+def build_static_assets(static_directory, asset_directory):
+    """Copies the static files to the asset directory under names with the hash of their content, converts the fonts
+    to WOFF2 and writes gzip and brotli versions of the files that compress. Files of earlier builds are kept, so pages
+    rendered by workers that still run the old build keep loading.
+
+    Args:
+        static_directory (str): Static directory of the application.
+        asset_directory (str): Directory the built files and their manifest are written to.
+
+    Returns:
+        list<dict>: Every built file, with its name, hashed name, size and compressed sizes.
+    """
+
+    sources = {}
+    for directory, directoryNames, fileNames in os.walk(static_directory):
+        for fileName in fileNames:
+            if fileName.startswith('.') or os.path.splitext(fileName)[1] in SkippedExtensions:
+                continue
+            path = os.path.join(directory, fileName)
+            name = os.path.relpath(path, static_directory).replace(os.sep, '/')
+            with open(path, 'rb') as sourceFile:
+                sources[name] = sourceFile.read()
+
+            if os.path.splitext(fileName)[1] in ['.ttf', '.otf']:
+                woff2Name = posixpath.splitext(name)[0] + '.woff2'
+                woff2 = convert_font(path, name)
+                if woff2 is not None and woff2Name not in sources:
+                    sources[woff2Name] = woff2
+
+    # Stylesheets last, they point at the hashed names of the other files
+    manifest = {}
+    built = []
+    for name in sorted(sources, key=lambda name: (name.endswith('.css'), name)):
+        content = sources[name]
+        if name.endswith('.css'):
+            content = rewrite_css(name, content, manifest)
+        manifest[name] = get_hashed_name(name, content)
+
+        path = os.path.join(asset_directory, manifest[name])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as builtFile:
+                builtFile.write(content)
+            os.replace(path + '.tmp', path)
+
+        sizes = {'identity': len(content)}
+        if os.path.splitext(name)[1] in CompressedExtensions:
+            sizes.update(write_compressed(path, content))
+        built.append({'name': name, 'hashed_name': manifest[name], 'sizes': sizes})
+
+    with open(os.path.join(asset_directory, 'manifest.json.tmp'), 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+    os.replace(os.path.join(asset_directory, 'manifest.json.tmp'), os.path.join(asset_directory, 'manifest.json'))
+    return built
+
+
+def load_manifest(asset_directory):
+    """Loads the manifest of the built static files.
+
+    Args:
+        asset_directory (str): Directory of the built files.
+
+    Returns:
+        dict: Original path -> hashed path, None if the files were not built.
+    """
+
+    try:
+        with open(os.path.join(asset_directory, 'manifest.json')) as manifestFile:
+            return json.load(manifestFile)
+    except (OSError, ValueError):
+        return None
+
+
+def send_built_asset(asset_directory, filename):
+    """Sends a built file, compressed with the best encoding the browser accepts, cached forever.
+
+    Args:
+        asset_directory (str): Directory of the built files.
+        filename (str): Hashed path of the file.
+
+    Returns:
+        Response: The file.
+    """
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, extension in [('br', '.br'), ('gzip', '.gz')]:
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(asset_directory, filename + extension)):
+            response = send_from_directory(asset_directory, filename + extension, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(asset_directory, filename, mimetype=mimetype)
+
+    response.headers['Cache-Control'] = ImmutableCacheControl
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def install_assets(application):
+    """Serves the static files built by build_static_assets, if they were built. url_for('static', filename=...)
+    then gives the hashed path of the file, and the file is sent precompressed and cached forever. Static files
+    that are not in the build are served from the static directory as before.
+
+    Args:
+        application (Flask): Application to serve the static files of.
+
+    Returns:
+        None
+    """
+
+    assetDirectory = os.path.join(application.root_path, application.config.get('ASSET_DIRECTORY', 'static_build'))
+    manifest = load_manifest(assetDirectory)
+    if manifest is None:
+        application.logger.info('No built static files in {}, run "python manage.py build_assets" to build them.'.format(assetDirectory))
+        return
+
+    hashedNames = set(manifest.values())
+    send_static_file = application.view_functions['static']
+
+    @application.url_defaults
+    def add_static_hash(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def send_static_asset(filename):
+        if filename in hashedNames:
+            return send_built_asset(assetDirectory, filename)
+        return send_static_file(filename=filename)
+
+    application.view_functions['static'] = send_static_asset
+
+
+def remove_built_assets(asset_directory):
+    """Removes all built static files, of this build and the earlier ones.
+
+    Args:
+        asset_directory (str): Directory of the built files.
+
+    Returns:
+        None
+    """
+
+    if os.path.isdir(asset_directory):
+        shutil.rmtree(asset_directory)
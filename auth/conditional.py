@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import os
+import time
+import zlib
+from flask import Response, current_app, request, session
+from flask_login import current_user
+from auth.page_cache import get_permission_key
+from auth.shared import SharedInfo
+
+# Types of the responses that are compressed, the others (images, fonts, downloads) are compressed already.
+CompressedMimetypes = ['text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript']
+
+# Version of the templates, pages rendered by an earlier deploy never match.
+TemplateVersions = {}
+
+
+def get_template_version(application):
+    """Gets the version of the templates of the running deploy, the newest modification time of a template.
+
+    Args:
+        application (Flask): The application.
+
+    Returns:
+        int: Version of the templates.
+    """
+
+    if application.name not in TemplateVersions:
+        newest = 0
+        for directory, directoryNames, fileNames in os.walk(os.path.join(application.root_path, application.template_folder)):
+            for fileName in fileNames:
+                newest = max(newest, os.stat(os.path.join(directory, fileName)).st_mtime_ns)
+        TemplateVersions[application.name] = newest
+    return TemplateVersions[application.name]
+
+
+def get_version_etag(models):
+    """Computes the ETag of the current page from what it is rendered from: the URL, the user and their permissions,
+    the versions of the models and the templates, and the CSRF secret of the session. It is the same in every worker
+    and can be compared before the page is rendered.
+
+    Args:
+        models (list<str>): Names of the models the page is rendered from.
+
+    Returns:
+        str: The ETag, None if pages can't be versioned because the page cache is off.
+    """
+
+    pageCache = SharedInfo['page_cache']
+    if pageCache is None:
+        return None
+
+    # The CSRF tokens of forms expire, a page stops matching before its tokens do. They are signed with a secret of
+    # the session, a page rendered for another session of the same user never matches either
+    csrfWindow = int(time.time() // ((current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600) / 2))
+    csrfSecret = hashlib.sha256(str(session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))).encode('utf-8')).hexdigest()
+    key = repr((request.full_path, current_user.get_id(), get_permission_key(), pageCache.get_versions(models),
+                get_template_version(current_app), csrfWindow, csrfSecret))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def is_etag_requested(etag):
+    """Checks if the browser already has the page with an ETag, as it was sent or compressed.
+
+    Args:
+        etag (str): ETag of the page.
+
+    Returns:
+        bool: True if the If-None-Match header of the request has the ETag.
+    """
+
+    return request.if_none_match.contains(etag) or request.if_none_match.contains(etag + '-gzip')
+
+
+def make_not_modified_response(etag):
+    """Answers a conditional request for a page the browser has already.
+
+    Args:
+        etag (str): ETag of the page.
+
+    Returns:
+        Response: Empty 304 response.
+    """
+
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def is_conditional_request_possible():
+    """Checks if the current request may be answered with 304 Not Modified. Pages that show flashed messages
+    are always sent, the browser's copy does not have them.
+
+    Args:
+        None
+
+    Returns:
+        bool: True if the request may be answered with 304.
+    """
+
+    return request.method in ['GET', 'HEAD'] and '_flashes' not in session
+
+
+def compress_stream(chunks, level, charset):
+    """Compresses a streamed response with gzip, flushing after every chunk so the browser can show each part
+    of the page as soon as it is rendered.
+
+    Args:
+        chunks (iterable): Chunks of the response, str or bytes.
+        level (int): Compression level.
+        charset (str): Encoding of the str chunks.
+
+    Returns:
+        generator: Compressed chunks.
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        # Closes the rendering of the page (and its request context) when the browser leaves early
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def install_conditional_responses(application):
+    """Gives every HTML page an ETag and answers If-None-Match with 304 Not Modified, and compresses large text
+    responses with gzip. Pages without a version ETag (see decorators.conditional_page) get the hash of their body,
+    they are still rendered but not sent again. Streamed pages have no body to hash, they are only compressed.
+
+    Args:
+        application (Flask): Application to answer the requests of.
+
+    Returns:
+        None
+    """
+
+    minimumSize = application.config.get('GZIP_MIN_BYTES', 1024)
+    level = application.config.get('GZIP_LEVEL', 6)
+
+    @application.after_request
+    def finish_response(response):
+        if response.direct_passthrough or response.status_code != 200:
+            return response
+
+        if response.is_streamed:
+            if response.mimetype in CompressedMimetypes and 'Content-Encoding' not in response.headers:
+                response.vary.add('Accept-Encoding')
+                if request.accept_encodings['gzip']:
+                    response.response = compress_stream(response.response, level, response.charset)
+                    response.headers['Content-Encoding'] = 'gzip'
+            return response
+
+        if response.mimetype == 'text/html' and is_conditional_request_possible():
+            if 'ETag' not in response.headers:
+                response.add_etag()
+            etag = response.get_etag()[0]
+            if is_etag_requested(etag):
+                return make_not_modified_response(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+
+        if response.mimetype not in CompressedMimetypes or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not request.accept_encodings['gzip'] or response.content_length is None or response.content_length < minimumSize:
+            return response
+
+        response.set_data(gzip.compress(response.get_data(), level))
+        response.headers['Content-Encoding'] = 'gzip'
+        etag, isWeak = response.get_etag()
+        if etag:
+            # The compressed body is another representation, it needs another strong ETag
+            response.set_etag(etag + '-gzip', isWeak)
+        return response
@@ -1,6 +1,7 @@
 import functools
-from flask import current_app, flash, redirect
+from flask import current_app, flash, make_response, redirect
 from flask_login import current_user
+from auth.conditional import get_version_etag, is_conditional_request_possible, is_etag_requested, make_not_modified_response
 
 
 def needs_permission(permission_name, page_name):
@@ -43,3 +44,28 @@ def alliance_required():
             return result
         return wrapped
     return decorator
+
+
+def conditional_page(*model_names):
+    """Answers requests for a page the browser has already with 304 Not Modified, without rendering it.
+    The page must only depend on the URL, the user and the given models.
+
+    Args:
+        model_names (str): Names of the models the page is rendered from, see page_cache.CachedModels.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            etag = get_version_etag(model_names) if is_conditional_request_possible() else None
+            if etag is None:
+                return f(*args, **kwargs)
+            if is_etag_requested(etag):
+                return make_not_modified_response(etag)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+
+            return response
+        return wrapped
+    return decorator
@@ -1,6 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, current_app, request, Markup
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import Blueprint, render_template, redirect, url_for, flash, current_app, request, Markup, copy_current_request_context
 from flask_login import current_user, login_required
-from auth.shared import EveAPI, SharedInfo
+from auth.esi_trace import get_trace, run_with_trace, start_trace, trace_section, traced_section
+from auth.metrics import record_cache_lookup
+from auth.shared import AllianceMemberCache, EveAPI, SharedInfo
+from auth.templating import stream_template
 from preston import Preston
 from auth.decorators import needs_permission
 
@@ -8,6 +14,41 @@ from auth.decorators import needs_permission
 Application = Blueprint('esi_parser', __name__, template_folder='templates/esi', static_folder='static')
 
 
+@Application.before_request
+def trace_esi_requests():
+    """Traces the ESI requests of every audit, so admins can see which part of the audit is slow.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+
+    start_trace(request.endpoint, current_app.config.get('ESI_TRACE_MAX_SPANS', 5000))
+
+
+@Application.context_processor
+def inject_esi_trace():
+    """Shows the ESI trace of the audit to admins. The trace is exported when the template includes it, after the
+    requests made by the rest of a streamed page.
+
+    Args:
+        None
+
+    Returns:
+        dict: Template context with get_esi_trace, which returns None for everyone but admins.
+    """
+
+    def get_esi_trace():
+        trace = get_trace()
+        if trace is None or not current_user.is_authenticated or not current_user.has_permission('admin'):
+            return None
+        return trace.to_json()
+
+    return dict(get_esi_trace=get_esi_trace)
+
+
 @Application.route('/', methods=['GET', 'POST'])
 @login_required
 @needs_permission('parse_esi', 'ESI Index')
@@ -64,7 +105,7 @@ def audit_assets(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_assets.html',
@@ -105,7 +146,7 @@ def audit_bookmarks(character_id, client_id, client_secret, refresh_token, scope
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_bookmarks.html',
@@ -146,7 +187,7 @@ def audit_character(character_id, client_id, client_secret, refresh_token, scope
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_character.html',
@@ -187,7 +228,7 @@ def audit_clones(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_clones.html',
@@ -228,14 +269,14 @@ def audit_contacts(character_id, client_id, client_secret, refresh_token, scopes
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     characterContacts = get_contacts(character_id, preston, access_token)
-    if characterContacts is None:
+    if flash_section_error(characterContacts):
         return redirect(url_for('esi_parser.index'))
 
-    return render_template('esi_parser/audit_contacts.html',
+    return stream_template('esi_parser/audit_contacts.html',
                            character_id=character_id, client_id=client_id, client_secret=client_secret, refresh_token=refresh_token, scopes=scopes,
                            character=characterCard, character_contacts=characterContacts)
 
@@ -273,7 +314,7 @@ def audit_contracts(character_id, client_id, client_secret, refresh_token, scope
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_contracts.html',
@@ -314,7 +355,7 @@ def audit_corporation(character_id, client_id, client_secret, refresh_token, sco
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_corporation.html',
@@ -355,7 +396,7 @@ def audit_fw(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_fw.html',
@@ -396,7 +437,7 @@ def audit_fittings(character_id, client_id, client_secret, refresh_token, scopes
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_fittings.html',
@@ -437,7 +478,7 @@ def audit_industry(character_id, client_id, client_secret, refresh_token, scopes
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_industry.html',
@@ -478,7 +519,7 @@ def audit_location(character_id, client_id, client_secret, refresh_token, scopes
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_location.html',
@@ -519,7 +560,7 @@ def audit_lp(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_lp.html',
@@ -560,14 +601,14 @@ def audit_mail(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     characterMails = get_mails(character_id, preston, access_token)
-    if characterMails is None:
+    if flash_section_error(characterMails):
         return redirect(url_for('esi_parser.index'))
 
-    return render_template('esi_parser/audit_mail.html',
+    return stream_template('esi_parser/audit_mail.html',
                            character_id=character_id, client_id=client_id, client_secret=client_secret, refresh_token=refresh_token, scopes=scopes,
                            character=characterCard, character_mails=characterMails)
 
@@ -605,7 +646,7 @@ def audit_market(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_market.html',
@@ -646,7 +687,7 @@ def audit_opportunities(character_id, client_id, client_secret, refresh_token, s
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_opportunities.html',
@@ -687,7 +728,7 @@ def audit_pi(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_pi.html',
@@ -728,7 +769,7 @@ def audit_skills(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_skills.html',
@@ -769,7 +810,7 @@ def audit_wallet(character_id, client_id, client_secret, refresh_token, scopes):
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
     characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
     return render_template('esi_parser/audit_wallet.html',
@@ -809,23 +850,117 @@ def audit_onepage(character_id, client_id, client_secret, refresh_token, scopes)
         flash('Refresh token ({}) could not get an access token.'.format(refresh_token), 'danger')
         current_app.logger.error('{} tried to parse ESI for character with ID {} but the refresh token ({}) was not valid.'.format(current_user.name, character_id, refresh_token))
 
-    characterCard = get_character_card(character_id, preston, access_token)
-    if characterCard is None:
-        return redirect(url_for('esi_parser.index'))
-
-    characterContacts = get_contacts(character_id, preston, access_token)
-    if characterContacts is None:
-        return redirect(url_for('esi_parser.index'))
+    # The sections only need the access token, so they are loaded at the same time and the page takes as long as the slowest
+    get_section = start_sections({
+        'character card': lambda: get_character_card(character_id, preston, access_token),
+        'contacts': lambda: get_contacts(character_id, preston, access_token),
+        'mails': lambda: get_mails(character_id, preston, access_token),
+    })
 
-    characterMails = get_mails(character_id, preston, access_token)
-    if characterMails is None:
+    # The card is the top of the page, the other sections are waited for when the template reaches them
+    characterCard = get_section('character card')
+    if flash_section_error(characterCard):
         return redirect(url_for('esi_parser.index'))
 
-    return render_template('esi_parser/audit_onepage.html',
+    return stream_template('esi_parser/audit_onepage.html',
                            character_id=character_id, client_id=client_id, client_secret=client_secret, refresh_token=refresh_token, scopes=scopes,
-                           character=characterCard, character_contacts=characterContacts, character_mails=characterMails)
+                           character=characterCard, get_section=get_section)
+
+
+def flash_section_error(section):
+    """Flashes the error of a section of an audit, like the character card.
+
+    Args:
+        section (object): What get_character_card, get_contacts or get_mails returned.
+
+    Returns:
+        bool: True if the section failed.
+    """
+
+    if isinstance(section, dict) and 'error' in section:
+        flash(section['error'], 'danger')
+        return True
+    return False
 
 
+def start_sections(sections):
+    """Starts loading independent sections of an audit on their own threads, with the request context and the ESI trace
+    of the request. Every section gets AUDIT_SECTION_TIMEOUT seconds from now, a section that is slower or fails gets
+    an error instead of failing the page, and the threads of slow sections are left to finish in the background.
+    Sections run outside of the request thread, so they return their errors instead of flashing them.
+
+    Args:
+        sections (dict): Name of every section mapped to a function without arguments that loads it. Generators the
+            functions return are run on the thread of the section too.
+
+    Returns:
+        callable: Function that takes the name of a section and waits for it. It returns what the section's function
+            returned, or {'error': message} if the section raised or was too slow.
+    """
+
+    def load_section(load):
+        section = load()
+        if isinstance(section, types.GeneratorType):
+            section = list(section)
+        return section
+
+    deadline = time.perf_counter() + current_app.config.get('AUDIT_SECTION_TIMEOUT', 60)
+    executor = ThreadPoolExecutor(max_workers=len(sections))
+    futures = {}
+    for name, load in sections.items():
+        futures[name] = executor.submit(copy_current_request_context(run_with_trace(load_section)), load)
+    # Don't wait for the threads, the page is built while they run
+    executor.shutdown(wait=False)
+
+    def get_section(name):
+        try:
+            section = futures[name].result(timeout=max(0, deadline - time.perf_counter()))
+        except TimeoutError:
+            current_app.logger.warning('The {} section of an audit timed out.'.format(name))
+            return {'error': 'The {} took too long to load.'.format(name)}
+        except Exception as e:
+            current_app.logger.exception('The {} section of an audit failed: {}'.format(name, str(e)))
+            return {'error': 'There was an error when trying to load the {}.'.format(name)}
+
+        return section
+
+    return get_section
+
+
+@Application.route('/alliance_members/<int:alliance_id>')
+@login_required
+@needs_permission('parse_esi', 'Alliance Members')
+def alliance_members(alliance_id):
+    """Member corporations of an alliance, loaded by the contact audits when an alliance contact is expanded,
+    as they take a request per corporation. Cached for ALLIANCE_MEMBERS_CACHE_SECONDS, failed lookups aren't cached.
+
+    Args:
+        alliance_id (int): ID of the alliance.
+
+    Returns:
+        str: HTML of the member corporations.
+    """
+
+    cached = AllianceMemberCache.get(alliance_id)
+    record_cache_lookup('alliance_members', bool(cached and cached[0] > time.time()))
+    if cached and cached[0] > time.time():
+        alliance, members = cached[1]
+        return render_template('esi_parser/alliance_members.html', alliance=alliance, members=members)
+
+    alliancePayload = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(str(alliance_id)))
+    if alliancePayload.status_code != 200:
+        return render_template('esi_parser/alliance_members.html', members=None), 404
+
+    members = get_alliance_members(alliance_id)
+    if members is None:
+        return render_template('esi_parser/alliance_members.html', members=None), 502
+
+    alliance = alliancePayload.json()
+    AllianceMemberCache[alliance_id] = (time.time() + current_app.config.get('ALLIANCE_MEMBERS_CACHE_SECONDS', 300), (alliance, members))
+    return render_template('esi_parser/alliance_members.html', alliance=alliance, members=members)
+
+
+@traced_section('character card')
 def get_character_card(character_id, preston, access_token):
     """Get all the info for the character card.
 
@@ -835,14 +970,13 @@ def get_character_card(character_id, preston, access_token):
         access_token (str): Access token for the scope-required ESI calls.
 
     Returns:
-        json: Character card information.
+        json: Character card information, {'error': message} on errors.
     """
 
     # Get character.
     characterPayload = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(str(character_id)))
     if characterPayload.status_code != 200:
-        flash('There was an error ({}) when trying to retrieve character with ID {}'.format(str(characterPayload.status_code), str(character_id)), 'danger')
-        return None
+        return {'error': 'There was an error ({}) when trying to retrieve character with ID {}'.format(str(characterPayload.status_code), str(character_id))}
 
     characterJSON = characterPayload.json()
     characterJSON['portrait'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/portrait/?datasource=tranquility".format(str(character_id))).json()
@@ -850,8 +984,7 @@ def get_character_card(character_id, preston, access_token):
     # Get corporation.
     corporationPayload = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(str(characterJSON['corporation_id'])))
     if corporationPayload.status_code != 200:
-        flash('There was an error ({}) when trying to retrieve corporation with ID {}'.format(str(corporationPayload.status_code), str(characterJSON['corporation_id'])), 'danger')
-        return None
+        return {'error': 'There was an error ({}) when trying to retrieve corporation with ID {}'.format(str(corporationPayload.status_code), str(characterJSON['corporation_id']))}
 
     characterJSON['corporation'] = corporationPayload.json()
     characterJSON['corporation']['logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
@@ -861,8 +994,7 @@ def get_character_card(character_id, preston, access_token):
     if 'alliance_id' in characterJSON:
         alliancePayload = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(str(characterJSON['alliance_id'])))
         if alliancePayload.status_code != 200:
-            flash('There was an error ({}) when trying to retrieve alliance with ID {}'.format(str(alliancePayload.status_code), str(characterJSON['alliance_id'])), 'danger')
-            return None
+            return {'error': 'There was an error ({}) when trying to retrieve alliance with ID {}'.format(str(alliancePayload.status_code), str(characterJSON['alliance_id']))}
 
         characterJSON['alliance'] = alliancePayload.json()
         characterJSON['alliance']['logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
@@ -877,8 +1009,7 @@ def get_character_card(character_id, preston, access_token):
     if walletIsk is not None:
         walletIskJSON = walletIsk.json()
         if walletIskJSON is not None and type(walletIskJSON) is not float:
-            flash('There was an error ({}) when trying to retrieve wallet for character.'.format(str(walletIsk.status_code)), 'danger')
-            return None
+            return {'error': 'There was an error ({}) when trying to retrieve wallet for character.'.format(str(walletIsk.status_code))}
         else:
             characterJSON['wallet_isk'] = walletIskJSON
 
@@ -891,14 +1022,14 @@ def get_character_card(character_id, preston, access_token):
     if characterSkills is not None:
         characterSkillsJSON = characterSkills.json()
         if characterSkillsJSON is not None and 'error' in characterSkillsJSON:
-            flash('There was an error ({}) when trying to retrieve skills.'.format(str(characterSkills.status_code)), 'danger')
-            return None
+            return {'error': 'There was an error ({}) when trying to retrieve skills.'.format(str(characterSkills.status_code))}
         else:
             characterJSON['skills'] = characterSkillsJSON
 
     return characterJSON
 
 
+@traced_section('contacts')
 def get_contacts(character_id, preston, access_token):
     """Get all the contacts information.
 
@@ -908,7 +1039,7 @@ def get_contacts(character_id, preston, access_token):
         access_token (str): Access token for the scope-required ESI calls.
 
     Returns:
-        json: Contacts information.
+        generator: Contacts information, expanded while it is iterated (see expand_contacts). {'has_scope': False} without the scope, {'error': message} on errors.
     """
 
     # Get raw contact data.
@@ -921,167 +1052,159 @@ def get_contacts(character_id, preston, access_token):
 
     characterContactsJSON = characterContacts.json()
     if characterContactsJSON is not None and 'error' in characterContactsJSON:
-        flash('There was an error ({}) when trying to retrieve contacts.'.format(str(characterContacts.status_code)), 'danger')
-        return None
+        return {'error': 'There was an error ({}) when trying to retrieve contacts.'.format(str(characterContacts.status_code))}
 
     characterContactLabels = SharedInfo['util'].make_esi_request_with_scope(preston, ['esi-characters.read_contacts.v1'],
                                                                             "https://esi.tech.ccp.is/latest/characters/{}/contacts/labels/?datasource=tranquility&token={}".format(
         str(character_id), access_token))
     characterContactLabelsJSON = characterContactLabels.json()
     if characterContactLabelsJSON is not None and 'error' in characterContactLabelsJSON:
-        flash('There was an error ({}) when trying to retrieve contact labels.'.format(str(characterContactLabels.status_code)), 'danger')
-        return None
+        return {'error': 'There was an error ({}) when trying to retrieve contact labels.'.format(str(characterContactLabels.status_code))}
+
+    return expand_contacts(characterContactsJSON, characterContactLabelsJSON)
 
-    # Link characters, corporations, images and labels to contacts.
-    for contact in characterContactsJSON:
-        # Name.
-        if contact['contact_type'] == 'character':
-            # Get character.
-            character = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(str(contact['contact_id']))).json()
-            contact['character'] = character
-
-            # Get character corp.
-            contact['character']['corporation_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
-                str(character['corporation_id']))).json()['name']
-
-            # Get character corp logo.
-            contact['character']['corporation_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
-                str(character['corporation_id']))).json()['px128x128']
-
-            # Get character alliance if applicable.
-            if 'alliance_id' in character:
-                contact['character']['alliance_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
-                    str(character['alliance_id']))).json()['name']
-
-                # Get character alliance logo.
-                contact['character']['alliance_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
-                    str(character['alliance_id']))).json()['px128x128']
-
-            # Get corporation history.
-            corpHistory = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/corporationhistory/?datasource=tranquility".format(str(contact['contact_id']))).json()
-            for index, corp in enumerate(corpHistory):
-                # Name.
-                corp['name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
-                    str(corp['corporation_id']))).json()['name']
-
-                # Logo.
-                corp['logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
-                    str(corp['corporation_id']))).json()['px128x128']
-
-                # Leave date.
-                if index > 0:
-                    corp['end_date'] = corpHistory[index - 1]['start_date']
-            contact['character']['corporation_history'] = corpHistory
-
-            # Get contact name / image.
-            contact['contact_name'] = character['name']
-            contact['contact_image'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/portrait/?datasource=tranquility".format(
-                str(contact['contact_id']))).json()['px128x128']
-        elif contact['contact_type'] == 'corporation':
-            # Get corporation.
-            corporation = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(str(contact['contact_id']))).json()
-            contact['corporation'] = corporation
-
-            # Get corporation alliance.
-            if 'alliance_id' in corporation:
-                contact['corporation']['alliance_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
-                    str(corporation['alliance_id']))).json()['name']
-
-                # Get corporation alliance logo.
-                contact['corporation']['alliance_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
-                    str(corporation['alliance_id']))).json()['px128x128']
-
-            # Get alliance history.
-            allianceHistory = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/alliancehistory/?datasource=tranquility".format(str(contact['contact_id']))).json()
-            for index, alliance in enumerate(allianceHistory):
-                allianceJSON = None
-
-                if 'alliance_id' in alliance:
-                    allianceJSON = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
-                        str(alliance['alliance_id']))).json()
-
-                    allianceJSON['alliance_id'] = alliance['alliance_id']
-
-                # Name.
-                if allianceJSON:
-                    alliance['name'] = allianceJSON['name']
-                else:
-                    alliance['name'] = "No alliance"
-
-                # Logo.
-                if allianceJSON:
-                    alliance['logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
-                        str(alliance['alliance_id']))).json()['px128x128']
-
-                # Leave date.
-                if index > 0:
-                    alliance['end_date'] = allianceHistory[index - 1]['start_date']
-
-            contact['corporation']['alliance_history'] = allianceHistory
-
-            # Get contact name / image.
-            contact['contact_name'] = corporation['name']
-            contact['contact_image'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
-                str(contact['contact_id']))).json()['px128x128']
-        elif contact['contact_type'] == 'alliance':
-            # Get alliance.
-            alliance = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(str(contact['contact_id']))).json()
-            contact['alliance'] = alliance
-
-            # Exec corp.
-            if 'executor_corporation_id' in alliance:
-                # Name.
-                contact['alliance']['executor_corporation_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
-                    str(alliance['executor_corporation_id']))).json()['name']
-
-                # Logo.
-                contact['alliance']['executor_corporation_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
-                    str(alliance['executor_corporation_id']))).json()['px128x128']
-
-            # Alliance members.
-            allianceMembers = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/corporations/?datasource=tranquility".format(
-                str(contact['contact_id']))).json()
-
-            allianceMemberList = []
-            for member in allianceMembers:
-                # Corporation info.
-                memberJSON = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
-                    str(member))).json()
-
-                # ID.
-                memberJSON['corporation_id'] = member
-
-                # Logo.
-                memberJSON['corporation_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
-                    str(member))).json()['px128x128']
-
-                # Get corp.
-                allianceMemberList.append(memberJSON)
-
-            contact['alliance']['members'] = allianceMemberList
-
-            contact['contact_name'] = alliance['name']
-            contact['contact_image'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
-                str(contact['contact_id']))).json()['px128x128']
-        elif contact['contact_type'] == 'faction':
-            contact['contact_name'] = "FACTION NAMES NOT IMPLEMENTED"
-            contact['contact_image'] = "#"
-
-        # Labels.
-        if 'label_id' in contact:
-            for label in characterContactLabelsJSON:
-                if label['label_id'] == contact['label_id']:
-                    contact['label_name'] = label['label_name']
-
-    # Sort contacts by name.
-    characterContactsJSON = sorted(characterContactsJSON, key=lambda k: k['contact_name'])
-
-    # Sort contacts by standings.
-    characterContactsJSON = sorted(characterContactsJSON, key=lambda k: k['standing'], reverse=True)
-
-    return characterContactsJSON
 
+def expand_contacts(contacts, labels):
+    """Links characters, corporations, images and labels to contacts. The template runs it when it reaches the contacts,
+    so a streamed page already shows the character card while these requests are made.
 
+    Args:
+        contacts (list): Contacts of the character.
+        labels (list): Contact labels of the character.
+
+    Returns:
+        generator: The contacts, sorted by standing and name.
+    """
+
+    with trace_section('contacts'):
+        for contact in contacts:
+            # Name.
+            if contact['contact_type'] == 'character':
+                # Get character.
+                character = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(str(contact['contact_id']))).json()
+                contact['character'] = character
+
+                # Get character corp.
+                contact['character']['corporation_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
+                    str(character['corporation_id']))).json()['name']
+
+                # Get character corp logo.
+                contact['character']['corporation_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
+                    str(character['corporation_id']))).json()['px128x128']
+
+                # Get character alliance if applicable.
+                if 'alliance_id' in character:
+                    contact['character']['alliance_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
+                        str(character['alliance_id']))).json()['name']
+
+                    # Get character alliance logo.
+                    contact['character']['alliance_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
+                        str(character['alliance_id']))).json()['px128x128']
+
+                # Get corporation history.
+                corpHistory = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/corporationhistory/?datasource=tranquility".format(str(contact['contact_id']))).json()
+                for index, corp in enumerate(corpHistory):
+                    # Name.
+                    corp['name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
+                        str(corp['corporation_id']))).json()['name']
+
+                    # Logo.
+                    corp['logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
+                        str(corp['corporation_id']))).json()['px128x128']
+
+                    # Leave date.
+                    if index > 0:
+                        corp['end_date'] = corpHistory[index - 1]['start_date']
+                contact['character']['corporation_history'] = corpHistory
+
+                # Get contact name / image.
+                contact['contact_name'] = character['name']
+                contact['contact_image'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/portrait/?datasource=tranquility".format(
+                    str(contact['contact_id']))).json()['px128x128']
+            elif contact['contact_type'] == 'corporation':
+                # Get corporation.
+                corporation = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(str(contact['contact_id']))).json()
+                contact['corporation'] = corporation
+
+                # Get corporation alliance.
+                if 'alliance_id' in corporation:
+                    contact['corporation']['alliance_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
+                        str(corporation['alliance_id']))).json()['name']
+
+                    # Get corporation alliance logo.
+                    contact['corporation']['alliance_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
+                        str(corporation['alliance_id']))).json()['px128x128']
+
+                # Get alliance history.
+                allianceHistory = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/alliancehistory/?datasource=tranquility".format(str(contact['contact_id']))).json()
+                for index, alliance in enumerate(allianceHistory):
+                    allianceJSON = None
+
+                    if 'alliance_id' in alliance:
+                        allianceJSON = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
+                            str(alliance['alliance_id']))).json()
+
+                        allianceJSON['alliance_id'] = alliance['alliance_id']
+
+                    # Name.
+                    if allianceJSON:
+                        alliance['name'] = allianceJSON['name']
+                    else:
+                        alliance['name'] = "No alliance"
+
+                    # Logo.
+                    if allianceJSON:
+                        alliance['logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
+                            str(alliance['alliance_id']))).json()['px128x128']
+
+                    # Leave date.
+                    if index > 0:
+                        alliance['end_date'] = allianceHistory[index - 1]['start_date']
+
+                contact['corporation']['alliance_history'] = allianceHistory
+
+                # Get contact name / image.
+                contact['contact_name'] = corporation['name']
+                contact['contact_image'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
+                    str(contact['contact_id']))).json()['px128x128']
+            elif contact['contact_type'] == 'alliance':
+                # Get alliance.
+                alliance = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(str(contact['contact_id']))).json()
+                contact['alliance'] = alliance
+
+                # Exec corp.
+                if 'executor_corporation_id' in alliance:
+                    # Name.
+                    contact['alliance']['executor_corporation_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
+                        str(alliance['executor_corporation_id']))).json()['name']
+
+                    # Logo.
+                    contact['alliance']['executor_corporation_logo'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(
+                        str(alliance['executor_corporation_id']))).json()['px128x128']
+
+                contact['contact_name'] = alliance['name']
+                contact['contact_image'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/icons/?datasource=tranquility".format(
+                    str(contact['contact_id']))).json()['px128x128']
+            elif contact['contact_type'] == 'faction':
+                contact['contact_name'] = "FACTION NAMES NOT IMPLEMENTED"
+                contact['contact_image'] = "#"
+
+            # Labels.
+            if 'label_id' in contact:
+                for label in labels:
+                    if label['label_id'] == contact['label_id']:
+                        contact['label_name'] = label['label_name']
+
+        # Sort contacts by name.
+        contacts = sorted(contacts, key=lambda k: k['contact_name'])
+
+        # Sort contacts by standings.
+        contacts = sorted(contacts, key=lambda k: k['standing'], reverse=True)
+
+    yield from contacts
+
+
+@traced_section('mails')
 def get_mails(character_id, preston, access_token):
     """Get all the mail information.
 
@@ -1091,7 +1214,7 @@ def get_mails(character_id, preston, access_token):
         access_token (str): Access token for the scope-required ESI calls.
 
     Returns:
-        json: Mail information.
+        generator: Mail information, expanded while it is iterated (see expand_mails). {'has_scope': False} without the scope, {'error': message} on errors.
     """
 
     # Get mail endpoint.
@@ -1105,8 +1228,7 @@ def get_mails(character_id, preston, access_token):
     characterMailsJSON = characterMails.json()
 
     if characterMailsJSON is not None and 'error' in characterMailsJSON:
-        flash('There was an error ({}) when trying to retrieve mails.'.format(str(characterMails.status_code)), 'danger')
-        return None
+        return {'error': 'There was an error ({}) when trying to retrieve mails.'.format(str(characterMails.status_code))}
 
     # Get mailing lists.
     characterMailingLists = SharedInfo['util'].make_esi_request_with_scope(preston, ['esi-mail.read_mail.v1'],
@@ -1115,45 +1237,109 @@ def get_mails(character_id, preston, access_token):
     characterMailingListsJSON = characterMailingLists.json()
 
     if characterMailingListsJSON is not None and 'error' in characterMailingListsJSON:
-        flash('There was an error ({}) when trying to retrieve mail labels.'.format(str(characterMailingLists.status_code)), 'danger')
+        return {'error': 'There was an error ({}) when trying to retrieve mail labels.'.format(str(characterMailingLists.status_code))}
+
+    return expand_mails(characterMailsJSON, characterMailingListsJSON, character_id, preston, access_token)
+
+
+def expand_mails(mails, mailing_lists, character_id, preston, access_token):
+    """Adds the body, sender and recipient names to mails, one mail at a time, so a streamed page sends every mail
+    as soon as its requests are done.
+
+    Args:
+        mails (list): Mails of the character.
+        mailing_lists (list): Mailing lists of the character.
+        character_id (int): ID of the character.
+        preston (preston): Preston object to make scope-required ESI calls.
+        access_token (str): Access token for the scope-required ESI calls.
+
+    Returns:
+        generator: The mails, each one after its requests are done.
+    """
+
+    for mail in mails:
+        with trace_section('mails'):
+            mail['mail'] = SharedInfo['util'].make_esi_request_with_scope(preston, ['esi-mail.read_mail.v1'],
+                                                                          "https://esi.tech.ccp.is/latest/characters/{}/mail/{}/?datasource=tranquility&token={}".format(
+                str(character_id), str(mail['mail_id']), access_token)).json()
+
+            # Convert body to be easily showed in html, but first save raw body.
+            mail['mail']['raw_body'] = mail['mail']['body']
+            mailBody = mail['mail']['body'].replace('<br>', '\n')
+            mailBody = SharedInfo['util'].remove_html_tags(mailBody)
+            mail['mail']['body'] = Markup(mailBody.replace('\n', '<br>'))
+
+            # Get sender name.
+            mail['mail']['from_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(
+                str(mail['mail']['from']))).json()['name']
+
+            # Get recipients.
+            for recipient in mail['mail']['recipients']:
+                recipient['recipient_name'] = recipient['recipient_id']
+
+                # Determine type.
+                if recipient['recipient_type'] == 'character':
+                    # Get character name.
+                    recipient['recipient_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(
+                        str(recipient['recipient_id']))).json()['name']
+                elif recipient['recipient_type'] == 'corporation':
+                    # Get corporation name.
+                    recipient['recipient_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
+                        str(recipient['recipient_id']))).json()['name']
+                elif recipient['recipient_type'] == 'alliance':
+                    # Get alliance name.
+                    recipient['recipient_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
+                        str(recipient['recipient_id']))).json()['name']
+                elif recipient['recipient_type'] == 'mailing_list':
+                    # Get mailing list name.
+                    for mailingList in mailing_lists:
+                        if mailingList['mailing_list_id'] == recipient['recipient_id']:
+                            recipient['recipient_name'] = "{} [ML]".format(mailingList['name'])
+
+        yield mail
+
+
+@traced_section('alliance members')
+def get_alliance_members(alliance_id):
+    """Get the member corporations of an alliance, with their logos.
+
+    Args:
+        alliance_id (int): ID of the alliance.
+
+    Returns:
+        list: Member corporations, None if the members could not be retrieved.
+    """
+
+    allianceMembers = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/corporations/?datasource=tranquility".format(str(alliance_id)))
+    if allianceMembers.status_code != 200:
         return None
 
-    for mail in characterMailsJSON:
-        mail['mail'] = SharedInfo['util'].make_esi_request_with_scope(preston, ['esi-mail.read_mail.v1'],
-                                                                      "https://esi.tech.ccp.is/latest/characters/{}/mail/{}/?datasource=tranquility&token={}".format(
-            str(character_id), str(mail['mail_id']), access_token)).json()
-
-        # Convert body to be easily showed in html, but first save raw body.
-        mail['mail']['raw_body'] = mail['mail']['body']
-        mailBody = mail['mail']['body'].replace('<br>', '\n')
-        mailBody = SharedInfo['util'].remove_html_tags(mailBody)
-        mail['mail']['body'] = Markup(mailBody.replace('\n', '<br>'))
-
-        # Get sender name.
-        mail['mail']['from_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(
-            str(mail['mail']['from']))).json()['name']
-
-        # Get recipients.
-        for recipient in mail['mail']['recipients']:
-            recipient['recipient_name'] = recipient['recipient_id']
-
-            # Determine type.
-            if recipient['recipient_type'] == 'character':
-                # Get character name.
-                recipient['recipient_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/characters/{}/?datasource=tranquility".format(
-                    str(recipient['recipient_id']))).json()['name']
-            elif recipient['recipient_type'] == 'corporation':
-                # Get corporation name.
-                recipient['recipient_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(
-                    str(recipient['recipient_id']))).json()['name']
-            elif recipient['recipient_type'] == 'alliance':
-                # Get alliance name.
-                recipient['recipient_name'] = SharedInfo['util'].make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/?datasource=tranquility".format(
-                    str(recipient['recipient_id']))).json()['name']
-            elif recipient['recipient_type'] == 'mailing_list':
-                # Get mailing list name.
-                for mailingList in characterMailingListsJSON:
-                    if mailingList['mailing_list_id'] == recipient['recipient_id']:
-                        recipient['recipient_name'] = "{} [ML]".format(mailingList['name'])
-
-    return characterMailsJSON
+    # Two requests per corporation, made concurrently
+    corporationLinks = {}
+    for member in allianceMembers.json():
+        corporationLinks[member] = ("https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(str(member)),
+                                    "https://esi.tech.ccp.is/latest/corporations/{}/icons/?datasource=tranquility".format(str(member)))
+    responses = SharedInfo['util'].make_esi_requests([link for links in corporationLinks.values() for link in links])
+
+    allianceMemberList = []
+    for member, (corporationLink, logoLink) in corporationLinks.items():
+        corporation, logo = responses[corporationLink], responses[logoLink]
+
+        # Corporation info.
+        if corporation is not None and corporation.status_code == 200:
+            memberJSON = corporation.json()
+        else:
+            memberJSON = {'name': 'Unknown corporation ({})'.format(str(member))}
+
+        # ID.
+        memberJSON['corporation_id'] = member
+
+        # Logo.
+        if logo is not None and logo.status_code == 200:
+            memberJSON['corporation_logo'] = logo.json()['px128x128']
+        else:
+            memberJSON['corporation_logo'] = '#'
+
+        allianceMemberList.append(memberJSON)
+
+    return allianceMemberList
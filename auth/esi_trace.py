@@ -0,0 +1,242 @@
+import functools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
+from auth.metrics import get_esi_route
+
+# Trace of the threads that make ESI requests for a request, set by run_with_trace.
+TraceOverride = threading.local()
+
+
+class EsiTrace:
+    """ESI requests made while handling one request, as spans with their timing, grouped in the sections of the page
+    that made them. Spans can be added from several threads.
+    """
+
+    def __init__(self, name, max_spans=5000):
+        self.Name = name
+        self.MaxSpans = max_spans
+        self.Start = time.perf_counter()
+        self.StartTime = time.time()
+        self.Spans = []
+        self.DroppedSpans = 0
+        self.Sections = {}
+        self.Lock = threading.Lock()
+
+    def get_section(self):
+        """Gets the section the current thread is in.
+
+        Args:
+            None
+
+        Returns:
+            str: Names of the open sections joined by ' > ', empty if there is none.
+        """
+
+        return ' > '.join(self.Sections.get(threading.get_ident(), []))
+
+    def push_section(self, name):
+        """Opens a section in the current thread, inside the sections that are already open.
+
+        Args:
+            name (str): Name of the section.
+
+        Returns:
+            None
+        """
+
+        self.Sections.setdefault(threading.get_ident(), []).append(name)
+
+    def pop_section(self):
+        """Closes the innermost open section of the current thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self.Sections[threading.get_ident()].pop()
+
+    def add_span(self, request_link, response, start, seconds, cache):
+        """Records one ESI request.
+
+        Args:
+            request_link (str): Request link sent to ESI.
+            response (response): ESI response object, None if the request failed.
+            start (float): time.perf_counter() when the request started.
+            seconds (float): Duration of the request.
+            cache (str): 'hit' or 'miss' if the request could be served from the ESI cache, 'none' if it couldn't.
+
+        Returns:
+            None
+        """
+
+        span = {
+            'route': get_esi_route(request_link),
+            # Access tokens are part of the links of authenticated requests
+            'url': re.sub(r'token=[^&]*', 'token=<hidden>', request_link),
+            'status': response.status_code if response is not None else None,
+            'bytes': len(response.content) if response is not None else 0,
+            'start_ms': round((start - self.Start) * 1000, 1),
+            'duration_ms': round(seconds * 1000, 1),
+            'cache': cache,
+            'section': self.get_section(),
+        }
+
+        with self.Lock:
+            if len(self.Spans) < self.MaxSpans:
+                self.Spans.append(span)
+            else:
+                self.DroppedSpans += 1
+
+    def get_summary(self):
+        """Sums the spans per section and per route template, slowest first.
+
+        Args:
+            None
+
+        Returns:
+            dict: Totals with the keys 'sections' and 'routes', lists of dicts with the keys 'name', 'calls', 'cache_hits',
+                'bytes', 'total_ms' and 'max_ms'.
+        """
+
+        with self.Lock:
+            spans = list(self.Spans)
+
+        summary = {}
+        for groupKey, spanKey in [('sections', 'section'), ('routes', 'route')]:
+            groups = {}
+            for span in spans:
+                group = groups.setdefault(span[spanKey] or '(none)', {'name': span[spanKey] or '(none)', 'calls': 0, 'cache_hits': 0, 'bytes': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                group['calls'] += 1
+                group['cache_hits'] += span['cache'] == 'hit'
+                group['bytes'] += span['bytes']
+                group['total_ms'] += span['duration_ms']
+                group['max_ms'] = max(group['max_ms'], span['duration_ms'])
+            summary[groupKey] = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+        return summary
+
+    def to_json(self):
+        """Exports the trace.
+
+        Args:
+            None
+
+        Returns:
+            dict: The trace with its spans and summary, JSON serializable.
+        """
+
+        with self.Lock:
+            spans = list(self.Spans)
+
+        return {
+            'name': self.Name,
+            'started': self.StartTime,
+            'duration_ms': round((time.perf_counter() - self.Start) * 1000, 1),
+            'dropped_spans': self.DroppedSpans,
+            'summary': self.get_summary(),
+            'spans': spans,
+        }
+
+
+def start_trace(name, max_spans=5000):
+    """Starts tracing the ESI requests of the current request.
+
+    Args:
+        name (str): Name of the trace, like the endpoint of the request.
+        max_spans (int): Maximum amount of spans kept.
+
+    Returns:
+        EsiTrace: The started trace.
+    """
+
+    g.esi_trace = EsiTrace(name, max_spans)
+    return g.esi_trace
+
+
+def get_trace():
+    """Gets the ESI trace of the current request.
+
+    Args:
+        None
+
+    Returns:
+        EsiTrace: The trace, None if the request isn't traced.
+    """
+
+    trace = getattr(TraceOverride, 'trace', None)
+    if trace is None and has_app_context():
+        trace = g.get('esi_trace')
+    return trace
+
+
+@contextmanager
+def trace_section(name):
+    """Groups the ESI requests made in the with block under a section of the trace.
+
+    Args:
+        name (str): Name of the section.
+
+    Returns:
+        None
+    """
+
+    trace = get_trace()
+    if trace is None:
+        yield
+        return
+
+    trace.push_section(name)
+    try:
+        yield
+    finally:
+        trace.pop_section()
+
+
+def traced_section(name):
+    """Groups the ESI requests made by the decorated function under a section of the trace.
+
+    Args:
+        name (str): Name of the section.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            with trace_section(name):
+                return f(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def run_with_trace(function):
+    """Wraps a function that is run on another thread, so the ESI requests it makes are added to the trace of the
+    current request, in the section that is open now.
+
+    Args:
+        function (callable): Function to wrap.
+
+    Returns:
+        callable: The wrapped function.
+    """
+
+    trace = get_trace()
+    if trace is None:
+        return function
+    section = trace.get_section()
+
+    @functools.wraps(function)
+    def wrapped(*args, **kwargs):
+        TraceOverride.trace = trace
+        if section:
+            trace.push_section(section)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if section:
+                trace.pop_section()
+            TraceOverride.trace = None
+    return wrapped
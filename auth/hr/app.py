@@ -1,16 +1,32 @@
-from flask import Blueprint, render_template, current_app, flash, url_for, redirect, request
+from flask import Blueprint, render_template, current_app, flash, url_for, redirect, request, jsonify
 from flask_login import login_required, current_user
 from auth.models import Application as ApplicationModel, Corporation, Alliance, Character, Role
 from auth.shared import Database, EveAPI, SharedInfo
-from auth.decorators import needs_permission, alliance_required
+from auth.decorators import needs_permission, alliance_required, conditional_page
 from auth.hr.forms import *
+from auth.hr.members import MemberSortKeys, get_member_page, search_mains
+from auth.hr.applications import ApplicationSortKeys, get_application_page, get_application_counts, invalidate_application_counts
 from datetime import datetime
-from sqlalchemy import func
 
 # Create and configure app
 Application = Blueprint('hr', __name__, template_folder='templates/hr', static_folder='static')
 
 
+@Application.app_context_processor
+def inject_application_counts():
+    """Lets every template show the application counts of the current user's corporation.
+    The counts are only looked up when a template calls application_counts().
+
+    Args:
+        None
+
+    Returns:
+        dict: Template context with application_counts.
+    """
+
+    return dict(application_counts=lambda: get_application_counts(current_user.get_corp_id()))
+
+
 @Application.route('/')
 @login_required
 def index():
@@ -27,10 +43,11 @@ def index():
     if current_user.application:
         return redirect(url_for('hr.view_application', application_id=current_user.application.id))
 
-    # Get all corporations that are open for recruitment.
-    openCorporations = [corp for corp in Alliance.query.filter_by(id=current_app.config["ALLIANCE_ID"]).first().corporations if corp.recruitment_open]
+    # Get all corporations that are open for recruitment, only when the list isn't cached.
+    def get_open_corporations():
+        return [corp for corp in Alliance.query.filter_by(id=current_app.config["ALLIANCE_ID"]).first().corporations if corp.recruitment_open]
 
-    return render_template('hr/index.html', open_corporations=openCorporations)
+    return render_template('hr/index.html', get_open_corporations=get_open_corporations)
 
 
 @Application.route('/apply/<int:corporation_id>')
@@ -85,6 +102,7 @@ def apply(corporation_id):
     application = ApplicationModel(corporation)
     current_user.application = application
     Database.session.commit()
+    invalidate_application_counts(corporation.id)
 
     flash("Successfully applied to {}.".format(corporation.name), 'success')
     current_app.logger.info('{} applied to {}.'.format(current_user.name, corporation.name))
@@ -136,7 +154,7 @@ def application_help(corporation_id):
 @alliance_required()
 @needs_permission('read_applications', 'View Corporation Applications')
 def view_corp_applications():
-    """Views all the applications to the current corp.
+    """Views the applications to the current corp, one page at a time.
 
     Args:
         None
@@ -145,16 +163,31 @@ def view_corp_applications():
         str: redirect to the appropriate url.
     """
 
-    return render_template('hr/view_corp_applications.html', corporation=current_user.get_corp(),
-        client_id=EveAPI['full_auth_preston'].client_id, client_secret=EveAPI['full_auth_preston'].client_secret, scopes=EveAPI['full_auth_preston'].scope)
+    # Sort order and the cursor of the previous page
+    sort = request.args.get('sort', 'timestamp')
+    if sort not in ApplicationSortKeys:
+        sort = 'timestamp'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    after = request.args.get('after')
+
+    corporation = current_user.get_corp()
+    try:
+        applications, nextAfter = get_application_page(corporation, sort, order == 'desc', after)
+    except ValueError:
+        flash("The page link is invalid, showing the first page.", 'danger')
+        return redirect(url_for('hr.view_corp_applications', sort=sort, order=order))
+
+    return render_template('hr/view_corp_applications.html', corporation=corporation, applications=applications, sort=sort, order=order,
+        is_first_page=after is None, next_after=nextAfter, client_id=EveAPI['full_auth_preston'].client_id, client_secret=EveAPI['full_auth_preston'].client_secret, scopes=EveAPI['full_auth_preston'].scope)
 
 
 @Application.route('/view_corp_members')
 @login_required
 @alliance_required()
 @needs_permission('read_membership', 'View Corporation Members')
+@conditional_page('Character', 'Corporation', 'Application', 'Role')
 def view_corp_members():
-    """Views all the members from the current corp.
+    """Views the members from the current corp, one page at a time.
 
     Args:
         None
@@ -163,7 +196,22 @@ def view_corp_members():
         str: redirect to the appropriate url.
     """
 
-    return render_template('hr/view_corp_members.html', corporation=current_user.get_corp())
+    # Sort order and the cursor of the previous page
+    sort = request.args.get('sort', 'name')
+    if sort not in MemberSortKeys:
+        sort = 'name'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    after = request.args.get('after')
+
+    corporation = current_user.get_corp()
+    try:
+        rows, nextAfter = get_member_page(corporation, sort, order == 'desc', after)
+    except ValueError:
+        flash("The page link is invalid, showing the first page.", 'danger')
+        return redirect(url_for('hr.view_corp_members', sort=sort, order=order))
+
+    return render_template('hr/view_corp_members.html', corporation=corporation, rows=rows, sort=sort, order=order,
+                           is_first_page=after is None, next_after=nextAfter)
 
 
 @Application.route('/view_application/<int:application_id>', methods=['GET', 'POST'])
@@ -214,8 +262,7 @@ def view_application(application_id):
         if 'btn' not in request.form:
             if 'notes' in request.form and editApplicationForm.validate_on_submit():
                 oldNote = application.character.notes
-                application.character.notes = editApplicationForm.notes.data
-                Database.session.commit()
+                SharedInfo['util'].update_row(application.character, {'notes': editApplicationForm.notes.data})
                 flash("Successfully updated note.", "success")
                 current_app.logger.info("{} updated {}'s note from '{}' to '{}'.".format(current_user.name, application.character.name, oldNote, editApplicationForm.notes.data))
                 return redirect(url_for('hr.view_application', application_id=application.id))
@@ -239,6 +286,7 @@ def view_application(application_id):
 
             Database.session.delete(application)
             Database.session.commit()
+            invalidate_application_counts(application.corporation_id)
 
             flash("Successfully removed application of {} to {}.".format(characterName, corpName), 'success')
             current_app.logger.info("{} removed application of {} to {} with reason '{}'.".format(current_user.name, characterName, corpName, rejectionReason))
@@ -248,13 +296,14 @@ def view_application(application_id):
 
             Database.session.delete(application)
             Database.session.commit()
+            invalidate_application_counts(application.corporation_id)
 
             flash("Successfully removed application of {} to {}.".format(characterName, corpName), 'success')
             current_app.logger.info("{} removed application of {} to {}.".format(current_user.name, characterName, corpName))
         elif request.form['btn'] == "UpdateApplication":
-            application.ready_accepted = not application.ready_accepted
+            SharedInfo['util'].update_row(application, {'ready_accepted': not application.ready_accepted})
             newStatus = "Ready to be accepted" if application.ready_accepted else "Being processed"
-            Database.session.commit()
+            invalidate_application_counts(application.corporation_id)
             flash("Successfully set {} application status to {}.".format(application.character.name, newStatus), 'success')
             current_app.logger.info("{} edited status of {} application to {}".format(current_user.name, application.character.name, newStatus))
             return redirect(url_for('hr.view_application', application_id=application.id))
@@ -270,6 +319,7 @@ def view_application(application_id):
 @login_required
 @alliance_required()
 @needs_permission('read_membership', 'View Member')
+@conditional_page('Character', 'Corporation', 'Alliance', 'Application', 'Role')
 def view_member(member_id):
     """Views a member with ID.
 
@@ -283,7 +333,6 @@ def view_member(member_id):
     # Get character and roles.
     character = Character.query.filter_by(id=member_id).first()
     roles = Role.query.all()
-    mains = [main for main in Character.query.order_by(func.lower(Character.name)).all() if main.is_in_alliance]
 
     # Check if character exists.
     if not character:
@@ -300,8 +349,7 @@ def view_member(member_id):
         # Check if notes have been updated.
         if 'notes' in request.form and editNoteForm.validate_on_submit():
             oldNote = character.notes
-            character.notes = editNoteForm.notes.data
-            Database.session.commit()
+            SharedInfo['util'].update_row(character, {'notes': editNoteForm.notes.data})
             flash("Successfully updated note.", "success")
             current_app.logger.info("{} updated {}'s note from '{}' to '{}'.".format(current_user.name, character.name, oldNote, editNoteForm.notes.data))
         # Check the formtype.
@@ -311,12 +359,14 @@ def view_member(member_id):
             # If the user had the role, remove it.
             if role in character.roles:
                 character.roles.remove(role)
+                character.invalidate_permissions()
                 Database.session.commit()
                 flash('Succesfully removed {} role from {}.'.format(role.name, character.name), 'success')
                 current_app.logger.info('{} removed {} role from {}.'.format(current_user.name, role.name, character.name))
             # If the user didn't have the role, add it.
             else:
                 character.roles.append(role)
+                character.invalidate_permissions()
                 Database.session.commit()
                 flash('Succesfully added {} role to {}.'.format(role.name, character.name), 'success')
                 current_app.logger.info('{} added {} role to {}.'.format(current_user.name, role.name, character.name))
@@ -330,19 +380,43 @@ def view_member(member_id):
                 return redirect(url_for('hr.view_member', member_id=character.id))
 
             oldMain = character.get_main().name
-            character.main_id = request.form['MainID']
-            Database.session.commit()
+            SharedInfo['util'].update_row(character, {'main_id': main.id})
             flash('Successfully updated main from {} to {}.'.format(oldMain, character.get_main().name), 'success')
             current_app.logger.info("{} updated {}'s main from {} to {}".format(current_user.name, character.name, oldMain, character.get_main().name))
         # Check if deletion has been triggered.
         elif 'FormType' in request.form and request.form['FormType'] == "RemoveApplication" and current_user.has_permission('corp_manager'):
+            applicationCorporationId = character.application.corporation_id if character.application else None
             Database.session.delete(character)
             Database.session.commit()
+            if applicationCorporationId is not None:
+                invalidate_application_counts(applicationCorporationId)
             flash('Sucessfully removed {}.'.format(character.name), 'success')
             current_app.logger.info("{} removed {} from the database.".format(current_user.name, character.name))
             return redirect(url_for('hr.index'))
 
         return redirect(url_for('hr.view_member', member_id=character.id))
 
-    return render_template('hr/view_member.html', character=character, roles=roles, note_form=editNoteForm, alts=alts, mains=mains,
+    return render_template('hr/view_member.html', character=character, roles=roles, note_form=editNoteForm, alts=alts,
                            client_id=EveAPI['full_auth_preston'].client_id, client_secret=EveAPI['full_auth_preston'].client_secret, scopes=EveAPI['full_auth_preston'].scope)
+
+
+@Application.route('/search_mains')
+@login_required
+@alliance_required()
+@needs_permission('edit_member', 'Search Mains')
+def search_mains_json():
+    """Searches the alliance characters that can be picked as main, by the start of their name.
+
+    Args:
+        None
+
+    Returns:
+        json: Characters on the page, and the after cursor of the next page or null on the last page.
+    """
+
+    try:
+        characters, nextAfter = search_mains(request.args.get('q', ''), request.args.get('after'))
+    except ValueError:
+        return jsonify(error='Invalid after cursor.'), 400
+
+    return jsonify(characters=[{'id': characterId, 'name': name} for characterId, name in characters], next_after=nextAfter)
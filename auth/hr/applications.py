@@ -0,0 +1,74 @@
+import time
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from auth.metrics import record_cache_lookup
+from auth.models import Application
+from auth.shared import ApplicationCountCache, Database, SharedInfo
+
+# Amount of applications shown on one page of the application queue.
+ApplicationPageSize = 50
+
+# Sort orders of the application queue, the application ID is always added as the last key.
+ApplicationSortKeys = {
+    'timestamp': [Application.timestamp],
+    'status': [Application.ready_accepted, Application.timestamp],
+}
+
+
+def get_application_page(corporation, sort='timestamp', descending=False, after=None, page_size=ApplicationPageSize):
+    """Gets one page of the application queue of a corporation, with the characters of the applications loaded in the same query.
+
+    Args:
+        corporation (Corporation): Corporation to list the applications of.
+        sort (str): Key of ApplicationSortKeys to sort on.
+        descending (bool): Sort descending if true.
+        after (str): Cursor of the previous page, None for the first page.
+        page_size (int): Maximum amount of applications on the page.
+
+    Returns:
+        tuple(list<Application>, str): Applications on the page and the cursor to pass as after to get the next page,
+            None if this is the last page.
+    """
+
+    query = corporation.applications.options(joinedload(Application.character))
+    return SharedInfo['util'].get_keyset_page(query, ApplicationSortKeys[sort] + [Application.id], after, descending, page_size)
+
+
+def get_application_counts(corporation_id):
+    """Counts the applications to a corporation that are being processed and that are ready to be accepted.
+    The counts are cached for APPLICATION_COUNT_CACHE_SECONDS, changes made by this worker invalidate them right away.
+
+    Args:
+        corporation_id (int): ID of the corporation.
+
+    Returns:
+        dict: Amount of applications per status, with the keys 'pending' and 'ready_accepted'.
+    """
+
+    cached = ApplicationCountCache.get(corporation_id)
+    record_cache_lookup('application_counts', bool(cached and cached[0] > time.time()))
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    counts = {'pending': 0, 'ready_accepted': 0}
+    for readyAccepted, count in Database.session.query(Application.ready_accepted, func.count(Application.id)) \
+            .filter(Application.corporation_id == corporation_id).group_by(Application.ready_accepted):
+        counts['ready_accepted' if readyAccepted else 'pending'] += count
+
+    ApplicationCountCache[corporation_id] = (time.time() + current_app.config.get('APPLICATION_COUNT_CACHE_SECONDS', 60), counts)
+    return counts
+
+
+def invalidate_application_counts(corporation_id):
+    """Drops the cached application counts of a corporation. Must be called whenever an application to it is added,
+    removed or changes status.
+
+    Args:
+        corporation_id (int): ID of the corporation.
+
+    Returns:
+        None
+    """
+
+    ApplicationCountCache.pop(corporation_id, None)
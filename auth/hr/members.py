@@ -0,0 +1,145 @@
+import sys
+from collections import namedtuple
+from sqlalchemy import case, func
+from auth.models import Character, Corporation, Permission, permissionConnection, roleConnection
+from auth.shared import Database, SharedInfo
+
+# Amount of members shown on one page of the member list.
+MemberPageSize = 100
+
+# Sort orders of the member list. The character ID is always added as the last key so the order is
+# unique, which keyset pagination needs to never skip or repeat a member between pages.
+MemberSortKeys = {
+    'name': [func.lower(Character.name)],
+    'reddit': [func.coalesce(func.lower(Character.reddit), ''), func.lower(Character.name)],
+    'type': [case([(Character.main_id == Character.id, 0)], else_=1), func.lower(Character.name)],
+}
+
+# Amount of characters returned by one main search.
+MainSearchPageSize = 20
+
+# Sort order of the main search, which ix_Characters_alliance_id_name_lower already has.
+MainSearchKeys = [func.lower(Character.name), Character.id]
+
+# One row of the member list.
+MemberRow = namedtuple('MemberRow', ['character', 'main', 'errors'])
+
+
+def get_member_page(corporation, sort='name', descending=False, after=None, page_size=MemberPageSize):
+    """Builds one page of the member list of a corporation, with the main and errors of every member.
+    Uses the same amount of queries no matter how many members the corporation or the page has.
+
+    Args:
+        corporation (Corporation): Corporation to list the members of.
+        sort (str): Key of MemberSortKeys to sort on.
+        descending (bool): Sort descending if true.
+        after (str): Cursor of the previous page, None for the first page.
+        page_size (int): Maximum amount of members on the page.
+
+    Returns:
+        tuple(list<MemberRow>, str): Rows of the page and the cursor to pass as after to get the next page,
+            None if this is the last page.
+    """
+
+    characters, nextAfter = SharedInfo['util'].get_keyset_page(corporation.characters, MemberSortKeys[sort] + [Character.id],
+                                                               after, descending, page_size)
+
+    # Look up the mains of all alts at once, the mains on the page are their own main
+    mains = {character.id: character for character in characters if character.id == character.main_id}
+    altMainIds = {character.main_id for character in characters if character.main_id not in mains}
+    if altMainIds:
+        mains.update({main.id: main for main in Character.query.filter(Character.id.in_(altMainIds))})
+
+    alliedMainIds = get_allied_character_ids(mains.values())
+
+    rows = []
+    for character in characters:
+        main = mains.get(character.main_id)
+        errors = character.get_errors(main, main.id in alliedMainIds) if main else character.get_errors()
+        rows.append(MemberRow(character, main, errors))
+
+    return rows, nextAfter
+
+
+def get_main_search_query(prefix):
+    """Builds the query for the alliance characters whose name starts with a prefix, ignoring case.
+    The prefix is turned into a range on the lowercase name, so ix_Characters_alliance_id_name_lower
+    both finds and orders the characters.
+
+    Args:
+        prefix (str): Start of the name, an empty prefix matches every alliance character.
+
+    Returns:
+        Query: Query for the ID and name of the characters.
+    """
+
+    lowerName = func.lower(Character.name)
+    query = Database.session.query(Character.id, Character.name).filter(Character.alliance_id == SharedInfo['alliance_id'])
+
+    prefix = prefix.lower()
+    if prefix:
+        query = query.filter(lowerName >= prefix)
+
+        # Names below the prefix with its last character incremented, the highest code point can't be incremented
+        # so it is dropped, which leaves no upper bound for a prefix of only that code point
+        upperPrefix = prefix.rstrip(chr(sys.maxunicode))
+        if upperPrefix:
+            nextCodePoint = ord(upperPrefix[-1]) + 1
+            # Surrogates can't be stored as text, the next character after them is U+E000
+            if 0xD800 <= nextCodePoint <= 0xDFFF:
+                nextCodePoint = 0xE000
+            query = query.filter(lowerName < upperPrefix[:-1] + chr(nextCodePoint))
+
+    return query
+
+
+def search_mains(prefix, after=None, page_size=MainSearchPageSize):
+    """Finds one page of the alliance characters whose name starts with a prefix, ignoring case.
+
+    Args:
+        prefix (str): Start of the name.
+        after (str): Cursor of the previous page, None for the first page.
+        page_size (int): Maximum amount of characters on the page.
+
+    Returns:
+        tuple(list<tuple(int, str)>, str): ID and name of the characters on the page and the cursor to pass
+            as after to get the next page, None if this is the last page.
+    """
+
+    return SharedInfo['util'].get_keyset_page(get_main_search_query(prefix), MainSearchKeys, after, page_size=page_size)
+
+
+def get_allied_character_ids(characters):
+    """Checks which characters are in the alliance, the same way Character.is_in_alliance does,
+    but with at most two queries for all characters together.
+
+    Args:
+        characters (list<Character>): Characters to check.
+
+    Returns:
+        set<int>: IDs of the characters that are in the alliance.
+    """
+
+    alliedIds = set()
+    adminCandidates = []
+    for character in characters:
+        if character.alliance_id == SharedInfo['alliance_id']:
+            alliedIds.add(character.id)
+        elif character.admin_corp_id is not None and character.admin_corp_id != character.corp_id:
+            adminCandidates.append(character)
+
+    if not adminCandidates:
+        return alliedIds
+
+    # Admins viewing the site as an alliance corporation count as members too
+    allianceCorporationIds = {corporationId for corporationId, in Database.session.query(Corporation.id).filter(
+        Corporation.alliance_id == SharedInfo['alliance_id'])}
+    adminCandidateIds = {character.id for character in adminCandidates if character.admin_corp_id in allianceCorporationIds}
+    if adminCandidateIds:
+        alliedIds.update(characterId for characterId, in Database.session.query(roleConnection.c.character_id)
+                         .join(permissionConnection, permissionConnection.c.role_id == roleConnection.c.role_id)
+                         .join(Permission, Permission.id == permissionConnection.c.permission_id)
+                         .filter(roleConnection.c.character_id.in_(adminCandidateIds), func.lower(Permission.name) == 'admin').distinct())
+
+    return alliedIds
+
@@ -0,0 +1,140 @@
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only one of every rate records whose message starts with one of the sampled prefixes,
+    for debug lines that are written on every ESI call. Records above the sampled level always pass.
+    """
+
+    def __init__(self, rates, level=logging.DEBUG):
+        super().__init__()
+        self.Rates = rates
+        self.Level = level
+        self.Counts = {prefix: 0 for prefix in rates}
+
+    def filter(self, record):
+        if record.levelno > self.Level or not isinstance(record.msg, str):
+            return True
+
+        for prefix, rate in self.Rates.items():
+            if record.msg.startswith(prefix):
+                # Losing a count to a race between threads only changes which record is kept
+                self.Counts[prefix] += 1
+                return rate <= 1 or self.Counts[prefix] % rate == 1
+        return True
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+def _gzip_rotator(source, destination):
+    with open(source, 'rb') as sourceFile, gzip.open(destination, 'wb') as destinationFile:
+        shutil.copyfileobj(sourceFile, destinationFile)
+    os.remove(source)
+
+
+def create_file_handler(path, max_bytes=10 * 1024 * 1024, backup_count=10, when=''):
+    """Creates a file handler that rotates the log file and compresses the rotated files with gzip.
+
+    Args:
+        path (str): Path of the log file, {pid} is replaced by the process ID.
+        max_bytes (int): Size the file is rotated at, if it is rotated by size.
+        backup_count (int): Amount of rotated files that are kept.
+        when (str): Interval of time based rotation, like 'midnight' or 'H', rotates by size if empty.
+
+    Returns:
+        logging.Handler: The file handler.
+    """
+
+    path = path.format(pid=str(os.getpid()))
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count, delay=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+class ProcessQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler with a listener thread per process. The queue, the listener and its handlers are created by the
+    first record a process logs, so an application created before gunicorn forks its workers (preload_app) still
+    writes the log of every worker, with the process ID of the worker in the name of its file.
+    """
+
+    def __init__(self, create_handlers):
+        super().__init__(queue.Queue())
+        self.CreateHandlers = create_handlers
+        self.Listener = None
+        self.Pid = None
+        # Write what is still queued before the process exits
+        atexit.register(self.stop_listener)
+
+    def enqueue(self, record):
+        # Called with the lock of the handler held, so only one thread starts the listener
+        if self.Pid != os.getpid():
+            self.start_listener()
+        super().enqueue(record)
+
+    def start_listener(self):
+        """Starts the listener of the current process, the thread of the process that forked it doesn't run in it.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self.queue = queue.Queue()
+        self.Listener = logging.handlers.QueueListener(self.queue, *self.CreateHandlers(), respect_handler_level=True)
+        self.Listener.start()
+        self.Pid = os.getpid()
+
+    def stop_listener(self):
+        if self.Listener is not None and self.Pid == os.getpid():
+            self.Listener.stop()
+
+
+def install_logging(application):
+    """Sends the log of the application through a queue to a listener thread, which writes it to the console and
+    the rotating log file. Request threads only put records on the queue, they never wait for the disk.
+    The debug lines of every ESI request are sampled, only one in ESI_LOG_SAMPLE_RATE is kept.
+
+    Args:
+        application (Flask): Application to configure the logger of.
+
+    Returns:
+        ProcessQueueHandler: The handler, its listener is started by the first record of every process and stopped when the process exits.
+    """
+
+    level = application.config['LOGGING_LEVEL']
+    logFormat = logging.Formatter(style='{', fmt='{asctime} [{levelname}] {message}', datefmt='%Y-%m-%d %H:%M:%S')
+
+    def create_handlers():
+        fileHandler = create_file_handler(application.config.get('LOG_FILE', 'log.txt'), application.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                                          application.config.get('LOG_BACKUP_COUNT', 10), application.config.get('LOG_ROTATE_WHEN', ''))
+        consoleHandler = logging.StreamHandler()
+        for handler in [fileHandler, consoleHandler]:
+            handler.setFormatter(logFormat)
+            handler.setLevel(level)
+        return [fileHandler, consoleHandler]
+
+    queueHandler = ProcessQueueHandler(create_handlers)
+    queueHandler.setLevel(level)
+    sampleRate = application.config.get('ESI_LOG_SAMPLE_RATE', 10)
+    queueHandler.addFilter(SamplingFilter({
+        'make_esi_request > Making ESI request': sampleRate,
+        'make_esi_post_request > Making ESI request': sampleRate,
+    }))
+
+    application.logger.setLevel(level)
+    application.logger.addHandler(queueHandler)
+    return queueHandler
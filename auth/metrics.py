@@ -0,0 +1,338 @@
+import atexit
+import json
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+from flask import g, request
+
+# Upper bounds in seconds of the latency histogram buckets.
+LatencyBuckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms of one worker. Values are kept per label set, and can be written to a
+    file so the /metrics endpoint of any worker can add up the values of all workers.
+    """
+
+    def __init__(self):
+        self.Lock = threading.Lock()
+        self.Descriptions = {}
+        self.Values = {}
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        """Declares a metric.
+
+        Args:
+            name (str): Name of the metric.
+            metric_type (str): 'counter', 'gauge' or 'histogram'.
+            help_text (str): Description shown in the metrics output.
+            buckets (list<float>): Upper bounds of the buckets of a histogram.
+
+        Returns:
+            None
+        """
+
+        self.Descriptions[name] = {'type': metric_type, 'help': help_text, 'buckets': buckets or LatencyBuckets}
+        self.Values.setdefault(name, {})
+
+    def increment(self, name, labels=None, amount=1):
+        """Adds to a counter.
+
+        Args:
+            name (str): Name of the counter.
+            labels (dict): Labels of the value.
+            amount (float): Amount to add.
+
+        Returns:
+            None
+        """
+
+        key = _label_key(labels)
+        with self.Lock:
+            values = self.Values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name, value, labels=None):
+        """Sets a gauge. The time it is set at is kept, so the newest value of all workers can be shown.
+
+        Args:
+            name (str): Name of the gauge.
+            value (float): New value.
+            labels (dict): Labels of the value.
+
+        Returns:
+            None
+        """
+
+        with self.Lock:
+            self.Values[name][_label_key(labels)] = [value, time.time()]
+
+    def observe(self, name, value, labels=None):
+        """Adds an observation to a histogram.
+
+        Args:
+            name (str): Name of the histogram.
+            value (float): Observed value.
+            labels (dict): Labels of the value.
+
+        Returns:
+            None
+        """
+
+        buckets = self.Descriptions[name]['buckets']
+        key = _label_key(labels)
+        with self.Lock:
+            histogram = self.Values[name].get(key)
+            if histogram is None:
+                histogram = self.Values[name][key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            # Counts are per bucket here, they are made cumulative when rendered
+            index = next((index for index, bound in enumerate(buckets) if value <= bound), len(buckets))
+            histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def get_samples(self):
+        """Copies the current values.
+
+        Args:
+            None
+
+        Returns:
+            dict: Values per metric name, JSON serializable.
+        """
+
+        with self.Lock:
+            return json.loads(json.dumps(self.Values))
+
+    def write(self, directory):
+        """Writes the values of this worker to its file in the metrics directory.
+
+        Args:
+            directory (str): Metrics directory shared by the workers.
+
+        Returns:
+            None
+        """
+
+        path = os.path.join(directory, 'metrics.{}.json'.format(str(os.getpid())))
+        with open(path + '.tmp', 'w') as metricsFile:
+            json.dump(self.get_samples(), metricsFile)
+        # Readers never see a half written file
+        os.replace(path + '.tmp', path)
+
+    def read_all(self, directory):
+        """Adds up the values of all workers that wrote to the metrics directory. Counters and histograms are summed,
+        for gauges the newest value is used.
+
+        Args:
+            directory (str): Metrics directory shared by the workers.
+
+        Returns:
+            dict: Values per metric name.
+        """
+
+        self.write(directory)
+        merged = {name: {} for name in self.Descriptions}
+        for fileName in os.listdir(directory):
+            if not (fileName.startswith('metrics.') and fileName.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, fileName)) as metricsFile:
+                    samples = json.load(metricsFile)
+            except (OSError, ValueError):
+                continue
+
+            for name, values in samples.items():
+                if name not in merged:
+                    continue
+                metricType = self.Descriptions[name]['type']
+                for key, value in values.items():
+                    current = merged[name].get(key)
+                    if current is None:
+                        merged[name][key] = value
+                    elif metricType == 'counter':
+                        merged[name][key] = current + value
+                    elif metricType == 'gauge':
+                        merged[name][key] = max(current, value, key=lambda gauge: gauge[1])
+                    else:
+                        merged[name][key] = {'buckets': [a + b for a, b in zip(current['buckets'], value['buckets'])],
+                                             'sum': current['sum'] + value['sum'], 'count': current['count'] + value['count']}
+        return merged
+
+    def render(self, samples):
+        """Renders values in the Prometheus text format.
+
+        Args:
+            samples (dict): Values per metric name, from get_samples or read_all.
+
+        Returns:
+            str: The metrics text.
+        """
+
+        lines = []
+        for name in sorted(self.Descriptions):
+            description = self.Descriptions[name]
+            lines.append('# HELP {} {}'.format(name, description['help']))
+            lines.append('# TYPE {} {}'.format(name, description['type']))
+            for key, value in sorted(samples.get(name, {}).items()):
+                labels = json.loads(key)
+                if description['type'] == 'counter':
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+                elif description['type'] == 'gauge':
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value[0])))
+                else:
+                    cumulative = 0
+                    for bound, count in zip(description['buckets'] + [math.inf], value['buckets']):
+                        cumulative += count
+                        bucketLabels = dict(labels, le='+Inf' if bound == math.inf else repr(bound))
+                        lines.append('{}_bucket{} {}'.format(name, _format_labels(bucketLabels), str(cumulative)))
+                    lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(value['sum'])))
+                    lines.append('{}_count{} {}'.format(name, _format_labels(labels), str(value['count'])))
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return json.dumps(labels or {}, sort_keys=True)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def _format_value(value):
+    return repr(float(value))
+
+
+def get_esi_route(request_link):
+    """Gets the route template of an ESI request link, with the IDs replaced, so requests to the same endpoint share their metrics.
+
+    Args:
+        request_link (str): Request link sent to ESI.
+
+    Returns:
+        str: Route template, like /latest/characters/{id}/.
+    """
+
+    return re.sub(r'/\d+(?=/|$)', '/{id}', urlparse(request_link).path)
+
+
+Metrics = MetricsRegistry()
+Metrics.describe('auth_request_seconds', 'histogram', 'Time spent handling requests, per endpoint.')
+Metrics.describe('auth_esi_request_seconds', 'histogram', 'Latency of ESI requests, per route template and status.')
+Metrics.describe('auth_esi_error_limit_remain', 'gauge', 'Errors left in the current ESI error limit window.')
+Metrics.describe('auth_esi_error_limit_reset_seconds', 'gauge', 'Seconds until the ESI error limit window resets.')
+Metrics.describe('auth_db_query_seconds', 'histogram', 'Time spent in database queries, per statement type.')
+Metrics.describe('auth_cache_requests_total', 'counter', 'Cache lookups, per cache and result (hit or miss).')
+
+
+def record_esi_response(request_link, response, seconds):
+    """Records the latency of an ESI request and the error limit ESI reported.
+
+    Args:
+        request_link (str): Request link sent to ESI.
+        response (response): ESI response object, None if the request failed.
+        seconds (float): Duration of the request.
+
+    Returns:
+        None
+    """
+
+    status = str(response.status_code) if response is not None else 'error'
+    Metrics.observe('auth_esi_request_seconds', seconds, {'route': get_esi_route(request_link), 'status': status})
+
+    if response is not None:
+        if 'X-Esi-Error-Limit-Remain' in response.headers:
+            Metrics.set('auth_esi_error_limit_remain', float(response.headers['X-Esi-Error-Limit-Remain']))
+        if 'X-Esi-Error-Limit-Reset' in response.headers:
+            Metrics.set('auth_esi_error_limit_reset_seconds', float(response.headers['X-Esi-Error-Limit-Reset']))
+
+
+def record_cache_lookup(cache, hit):
+    """Counts a cache lookup, for the hit ratio of the cache.
+
+    Args:
+        cache (str): Name of the cache.
+        hit (bool): True if the value was found in the cache.
+
+    Returns:
+        None
+    """
+
+    Metrics.increment('auth_cache_requests_total', {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+def install_metrics(application):
+    """Records the latency of every request, and when METRICS_DIRECTORY is set writes the metrics of this worker
+    to it every METRICS_WRITE_SECONDS, so the /metrics endpoint can show the totals of all workers.
+
+    Args:
+        application (Flask): Application to record the requests of.
+
+    Returns:
+        None
+    """
+
+    @application.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+
+    @application.after_request
+    def record_request_latency(response):
+        if 'request_start_time' not in g:
+            return response
+
+        start = g.request_start_time
+        labels = {'endpoint': request.endpoint or 'none', 'method': request.method, 'status': str(response.status_code)}
+        if response.is_streamed:
+            # The page is rendered while it is sent, the request ends when the response is closed
+            response.call_on_close(lambda: Metrics.observe('auth_request_seconds', time.perf_counter() - start, labels))
+        else:
+            Metrics.observe('auth_request_seconds', time.perf_counter() - start, labels)
+        return response
+
+    directory = application.config.get('METRICS_DIRECTORY')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+
+    def write_periodically():
+        while True:
+            time.sleep(application.config.get('METRICS_WRITE_SECONDS', 10))
+            try:
+                Metrics.write(directory)
+            except OSError as e:
+                application.logger.warning('Could not write metrics to {}: {}'.format(directory, str(e)))
+
+    writerLock = threading.Lock()
+    writerProcesses = set()
+
+    @application.before_request
+    def start_metrics_writer():
+        # Started by the first request of every worker, a thread started before gunicorn forks doesn't run in the workers
+        if os.getpid() in writerProcesses:
+            return
+        with writerLock:
+            if os.getpid() not in writerProcesses:
+                threading.Thread(target=write_periodically, name='MetricsWriter', daemon=True).start()
+                atexit.register(Metrics.write, directory)
+                writerProcesses.add(os.getpid())
+
+
+def render_metrics(application):
+    """Renders the metrics of all workers, or of this worker if there is no METRICS_DIRECTORY.
+
+    Args:
+        application (Flask): The application.
+
+    Returns:
+        str: The metrics in the Prometheus text format.
+    """
+
+    directory = application.config.get('METRICS_DIRECTORY')
+    return Metrics.render(Metrics.read_all(directory) if directory else Metrics.get_samples())
@@ -1,34 +1,55 @@
-from .shared import Database, SharedInfo
+from .metrics import record_cache_lookup
+from .shared import Database, SharedInfo, PermissionCache
 from datetime import datetime
+from sqlalchemy import func
+import uuid
 
 # -- Connections -- #
 permissionConnection = Database.Table(
     'PermissionConnection',
     Database.Column('role_id', Database.Integer, Database.ForeignKey('Roles.id')),
-    Database.Column('permission_id', Database.Integer, Database.ForeignKey('Permissions.id')))
+    Database.Column('permission_id', Database.Integer, Database.ForeignKey('Permissions.id'), index=True),
+    Database.Index('uq_PermissionConnection_role_id_permission_id', 'role_id', 'permission_id', unique=True))
 
 roleConnection = Database.Table(
     'RolesConnection',
     Database.Column('character_id', Database.Integer, Database.ForeignKey('Characters.id')),
-    Database.Column('role_id', Database.Integer, Database.ForeignKey('Roles.id')))
+    Database.Column('role_id', Database.Integer, Database.ForeignKey('Roles.id'), index=True),
+    Database.Index('uq_RolesConnection_character_id_role_id', 'character_id', 'role_id', unique=True))
 # -- End Connections -- #
 
 # -- Classes -- #
 
 
+def _new_permission_version():
+    """Creates a new permission version. Versions are random, so a character that is removed
+    and created again never matches a permission set that was cached for the old character.
+
+    Args:
+        None
+
+    Returns:
+        str: New permission version.
+    """
+    return uuid.uuid4().hex
+
+
 class Character(Database.Model):
     __tablename__ = 'Characters'
     id = Database.Column(Database.Integer, primary_key=True)
     name = Database.Column(Database.String)
-    main_id = Database.Column(Database.Integer)
+    main_id = Database.Column(Database.Integer, index=True)
     corporation = Database.relationship('Corporation', backref='Characters')
-    corp_id = Database.Column(Database.Integer, Database.ForeignKey('Corporations.id'))
+    corp_id = Database.Column(Database.Integer, Database.ForeignKey('Corporations.id'), index=True)
+    # Alliance of the character's corporation, kept in sync so membership can be filtered in SQL
+    alliance_id = Database.Column(Database.Integer, index=True)
     admin_corp_id = Database.Column(Database.Integer)
     access_token = Database.Column(Database.String)
     refresh_token = Database.Column(Database.String)
     reddit = Database.Column(Database.String)
     portrait = Database.Column(Database.String)
     notes = Database.Column(Database.String)
+    permission_version = Database.Column(Database.String, nullable=False, default=_new_permission_version)
     application = Database.relationship('Application', uselist=False, cascade="all, delete-orphan")
 
     def __init__(self, id, name, main_id, portrait):
@@ -37,6 +58,7 @@ class Character(Database.Model):
         self.main_id = main_id
         self.portrait = portrait
         self.notes = ""
+        self.permission_version = _new_permission_version()
 
     @property
     def is_authenticated(self):
@@ -54,14 +76,16 @@ class Character(Database.Model):
         return str(self.id)
 
     def get_corp(self):
-        if self.has_permission("admin"):
-            corp = Corporation.query.filter_by(id=self.admin_corp_id).first()
+        # Admins can view the site as another corporation
+        if self.admin_corp_id is not None and self.admin_corp_id != self.corp_id and self.has_permission("admin"):
+            corp = Corporation.query.get(self.admin_corp_id)
             if corp:
                 return corp
-            else:
-                return Corporation.query.filter_by(id=self.corp_id).first()
-        else:
-            return Corporation.query.filter_by(id=self.corp_id).first()
+        return self.corporation
+
+    def get_corp_id(self):
+        corp = self.get_corp()
+        return corp.id if corp else None
 
     def get_alts(self):
         return [alt for alt in Character.query.filter_by(main_id=self.id) if alt.main_id != alt.id]
@@ -69,16 +93,34 @@ class Character(Database.Model):
     def get_main(self):
         return Character.query.filter_by(id=self.main_id).first()
 
+    def get_permissions(self):
+        # Use the cached permission set if it was computed for the current permission version
+        cached = PermissionCache.get(self.id)
+        record_cache_lookup('permissions', bool(cached and cached[0] == self.permission_version))
+        if cached and cached[0] == self.permission_version:
+            return cached[1]
+
+        permissions = frozenset(name.lower() for name, in self.get_permission_names_query())
+
+        PermissionCache[self.id] = (self.permission_version, permissions)
+        return permissions
+
+    def get_permission_names_query(self):
+        # Get the permissions of all roles with a single join
+        return Database.session.query(Permission.name) \
+            .join(permissionConnection, permissionConnection.c.permission_id == Permission.id) \
+            .join(roleConnection, roleConnection.c.role_id == permissionConnection.c.role_id) \
+            .filter(roleConnection.c.character_id == self.id).distinct()
+
     def has_permission(self, permission_name):
-        # Loop over roles to see if any of the roles have the correct permission
-        for role in self.roles:
-            if role.has_permission(permission_name):
-                return True
+        return permission_name.lower() in self.get_permissions()
 
-        # If nothing was found, return false
-        return False
+    def invalidate_permissions(self):
+        # Must be called whenever the roles of the character change
+        self.permission_version = _new_permission_version()
 
-    def get_errors(self):
+    def get_errors(self, main=None, main_in_alliance=None):
+        # Pages listing many characters pass the main and its alliance status they looked up in bulk
         errors = []
 
         if self.access_token is None or self.refresh_token is None:
@@ -87,14 +129,26 @@ class Character(Database.Model):
         if self.reddit is None:
             errors.append("No reddit account provided.")
 
-        if not self.get_main().is_in_alliance:
-            errors.append("Main {} is not a member of this alliance.".format(self.get_main().name))
+        if main is None:
+            main = self.get_main()
+        if main is None:
+            errors.append("Main could not be found.")
+            return errors
+        if main_in_alliance is None:
+            main_in_alliance = main.is_in_alliance
+
+        if not main_in_alliance:
+            errors.append("Main {} is not a member of this alliance.".format(main.name))
 
         return errors
 
     @property
     def is_in_alliance(self):
-        return self.get_corp().alliance_id == SharedInfo['alliance_id']
+        # Admins viewing the site as another corporation are members if that corporation is
+        if self.admin_corp_id is not None and self.admin_corp_id != self.corp_id:
+            corp = self.get_corp()
+            return corp is not None and corp.alliance_id == SharedInfo['alliance_id']
+        return self.alliance_id == SharedInfo['alliance_id']
 
     @property
     def is_main(self):
@@ -104,6 +158,10 @@ class Character(Database.Model):
         return '<Character-{}>'.format(self.name)
 
 
+# Backs the case insensitive prefix search on the names of alliance characters
+Database.Index('ix_Characters_alliance_id_name_lower', Character.alliance_id, func.lower(Character.name))
+
+
 class Alliance(Database.Model):
     __tablename__ = 'Alliances'
     id = Database.Column(Database.Integer, primary_key=True)
@@ -156,7 +214,7 @@ class Corporation(Database.Model):
 class Permission(Database.Model):
     __tablename__ = 'Permissions'
     id = Database.Column(Database.Integer, primary_key=True)
-    name = Database.Column(Database.String, nullable=False)
+    name = Database.Column(Database.String, nullable=False, unique=True, index=True)
     roles = Database.relationship('Role', secondary=permissionConnection, backref=Database.backref('permissions', lazy='dynamic'))
 
     def __init__(self, name):
@@ -179,20 +237,31 @@ class Role(Database.Model):
         return '<Role-{}>'.format(self.name)
 
     def has_permission(self, permission_name):
-        # Get permission list
-        permissionNames = [permission.name.lower() for permission in self.permissions]
-        return permission_name.lower() in permissionNames
+        return self.permissions.filter(func.lower(Permission.name) == permission_name.lower()).count() > 0
+
+    def get_character_ids_query(self):
+        return Database.session.query(roleConnection.c.character_id).filter(roleConnection.c.role_id == self.id)
+
+    def invalidate_permissions(self):
+        # Must be called whenever the permissions of the role change, or before the role is removed
+        Character.query.filter(Character.id.in_(self.get_character_ids_query())).update(
+            {Character.permission_version: _new_permission_version()}, synchronize_session=False)
 
 
 class Application(Database.Model):
     __tablename__ = 'Applications'
     id = Database.Column(Database.Integer, primary_key=True)
     timestamp = Database.Column(Database.DateTime)
-    character_id = Database.Column(Database.Integer, Database.ForeignKey(Character.id))
+    character_id = Database.Column(Database.Integer, Database.ForeignKey(Character.id), index=True)
     character = Database.relationship("Character", backref="Applications")
-    corporation_id = Database.Column(Database.Integer, Database.ForeignKey(Corporation.id), nullable=False)
+    corporation_id = Database.Column(Database.Integer, Database.ForeignKey(Corporation.id), nullable=False, index=True)
     corporation = Database.relationship('Corporation', backref='Applications')
-    ready_accepted = Database.Column(Database.Boolean)
+    ready_accepted = Database.Column(Database.Boolean, nullable=False, default=False)
+    # Back the application queue of a corporation in both of its sort orders and the application counters
+    __table_args__ = (
+        Database.Index('ix_Applications_corporation_id_timestamp', 'corporation_id', 'timestamp'),
+        Database.Index('ix_Applications_corporation_id_ready_accepted_timestamp', 'corporation_id', 'ready_accepted', 'timestamp'),
+    )
 
     def __init__(self, corporation):
         self.timestamp = datetime.utcnow()
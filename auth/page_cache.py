@@ -0,0 +1,265 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import render_template, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event
+from auth.metrics import record_cache_lookup
+from auth.shared import Database, SharedInfo
+
+# Models whose changes invalidate the cached pages and fragments that depend on them.
+CachedModels = ['Character', 'Corporation', 'Alliance', 'Role', 'Application']
+
+
+class PageCache:
+    """Rendered pages and fragments of one worker, least recently used first. Every entry is stored under the
+    versions of the models it was rendered from. The versions are shared by the workers through one file per model
+    that holds a random token, a commit that changes a model writes a new token, so every worker renders the pages
+    of that model again and the outdated entries are dropped as the least recently used.
+    """
+
+    def __init__(self, directory, size=1000, seconds=300):
+        self.Directory = directory
+        self.Size = size
+        self.Seconds = seconds
+        self.Entries = OrderedDict()
+        self.Lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_versions(self, models):
+        """Gets the current versions of models, the same in every worker.
+
+        Args:
+            models (list<str>): Names of the models.
+
+        Returns:
+            tuple: Versions of the models.
+        """
+
+        versions = []
+        for model in models:
+            try:
+                with open(os.path.join(self.Directory, model + '.version')) as versionFile:
+                    versions.append(versionFile.read())
+            except OSError:
+                versions.append('')
+        return tuple(versions)
+
+    def invalidate(self, models):
+        """Gives models a new version, in all workers.
+
+        Args:
+            models (iterable<str>): Names of the changed models.
+
+        Returns:
+            None
+        """
+
+        for model in models:
+            temporaryPath = None
+            try:
+                descriptor, temporaryPath = tempfile.mkstemp(dir=self.Directory, prefix='.tmp-')
+                with os.fdopen(descriptor, 'w') as versionFile:
+                    versionFile.write(uuid.uuid4().hex)
+                os.chmod(temporaryPath, 0o644)
+                # Moved in place, so a worker never reads a version that is still being written
+                os.replace(temporaryPath, os.path.join(self.Directory, model + '.version'))
+            except OSError:
+                # The other workers see the change when their entries expire
+                if temporaryPath is not None and os.path.exists(temporaryPath):
+                    try:
+                        os.remove(temporaryPath)
+                    except OSError:
+                        pass
+
+    def get_or_render(self, cache, key, models, render):
+        """Gets a cached page or fragment, rendering and storing it if it is not cached for the current model versions.
+
+        Args:
+            cache (str): Kind of entry, 'page' or 'fragment', for the metrics.
+            key (tuple): Key of the entry, without the model versions.
+            models (list<str>): Names of the models the entry is rendered from.
+            render (callable): Function without arguments that renders the entry.
+
+        Returns:
+            str: The rendered entry.
+        """
+
+        key = (cache,) + key + (self.get_versions(models),)
+        with self.Lock:
+            entry = self.Entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self.Entries[key]
+                entry = None
+            if entry is not None:
+                self.Entries.move_to_end(key)
+        record_cache_lookup(cache, entry is not None)
+        if entry is not None:
+            return entry[1]
+
+        value = str(render())
+        with self.Lock:
+            self.Entries[key] = (time.time() + self.Seconds, value)
+            while len(self.Entries) > self.Size:
+                self.Entries.popitem(last=False)
+        return value
+
+
+def get_permission_key():
+    """Gets the permission set of the current user, cached pages and fragments are shared by the users that have the same one.
+
+    Args:
+        None
+
+    Returns:
+        tuple: Sorted permission names, empty for anonymous users.
+    """
+
+    if current_user.is_anonymous:
+        return ()
+    return tuple(sorted(current_user.get_permissions()))
+
+
+def render_cached_template(template_name, models, get_context, vary=()):
+    """Renders a template like render_template, or gets it from the page cache. Pages with flashed messages are
+    never cached, and the context is only built when the page is rendered.
+
+    Args:
+        template_name (str): Template to render.
+        models (list<str>): Names of the models the page is rendered from.
+        get_context (callable): Function without arguments that returns the template context.
+        vary (tuple): Other values the page depends on.
+
+    Returns:
+        str: The rendered page.
+    """
+
+    pageCache = SharedInfo['page_cache']
+    if pageCache is None or '_flashes' in session:
+        return render_template(template_name, **get_context())
+
+    return pageCache.get_or_render('page', (template_name, get_permission_key(), tuple(vary)), models,
+                                   lambda: render_template(template_name, **get_context()))
+
+
+def cached_fragment(name, models, *vary, caller=None):
+    """Template function that caches the body of a call block:
+    {% call cached_fragment('name', ['Corporation'], other, values) %}...{% endcall %}
+
+    Args:
+        name (str): Name of the fragment.
+        models (list<str>): Names of the models the fragment is rendered from.
+        vary (list): Other values the fragment depends on.
+        caller (callable): Body of the call block, given by Jinja.
+
+    Returns:
+        Markup: The rendered fragment.
+    """
+
+    pageCache = SharedInfo['page_cache']
+    if pageCache is None:
+        return caller()
+    return Markup(pageCache.get_or_render('fragment', (name, get_permission_key(), vary), models, caller))
+
+
+def invalidate_page_cache(models):
+    """Drops the cached pages and fragments of changed models, for changes made outside of the session.
+
+    Args:
+        models (iterable<str>): Names of the changed models.
+
+    Returns:
+        None
+    """
+
+    if SharedInfo['page_cache'] is not None:
+        SharedInfo['page_cache'].invalidate([model for model in models if model in CachedModels])
+
+
+def record_changed_models(session, flush_context):
+    """Remembers the cached models that a flush changed until the session commits. Listens to after_flush.
+
+    Args:
+        session (Session): Session that flushed.
+        flush_context (UOWTransaction): State of the flush.
+
+    Returns:
+        None
+    """
+
+    changedModels = session.info.setdefault('page_cache_changes', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if type(instance).__name__ in CachedModels:
+            changedModels.add(type(instance).__name__)
+
+
+def record_bulk_changed_models(query_context):
+    """Remembers the model of a bulk update or delete until the session commits, as those don't go through a flush.
+    Listens to after_bulk_update and after_bulk_delete.
+
+    Args:
+        query_context (BulkUD): The bulk update or delete.
+
+    Returns:
+        None
+    """
+
+    query_context.session.info.setdefault('page_cache_changes', set()).add(query_context.mapper.class_.__name__)
+
+
+def invalidate_changed_models(session):
+    """Drops the cached pages and fragments of the models the committed transaction changed. Listens to after_commit.
+
+    Args:
+        session (Session): Session that committed.
+
+    Returns:
+        None
+    """
+
+    invalidate_page_cache(session.info.pop('page_cache_changes', ()))
+
+
+def forget_changed_models(session):
+    """Forgets the changed models of a transaction that was rolled back, nothing it changed was stored.
+    Listens to after_rollback.
+
+    Args:
+        session (Session): Session that rolled back.
+
+    Returns:
+        None
+    """
+
+    session.info.pop('page_cache_changes', None)
+
+
+def install_page_cache(application):
+    """Caches rendered pages and fragments in memory for PAGE_CACHE_SECONDS, invalidated by the commits that change
+    the models they are rendered from. Templates get cached_fragment, which renders its block without caching when
+    PAGE_CACHE_DIRECTORY is empty.
+
+    Args:
+        application (Flask): Application to cache the pages of.
+
+    Returns:
+        None
+    """
+
+    application.jinja_env.globals.update(cached_fragment=cached_fragment)
+
+    directory = application.config.get('PAGE_CACHE_DIRECTORY', 'page_cache')
+    if not directory:
+        return
+    SharedInfo['page_cache'] = PageCache(os.path.join(application.root_path, directory),
+                                         application.config.get('PAGE_CACHE_SIZE', 1000), application.config.get('PAGE_CACHE_SECONDS', 300))
+
+    for eventName, listener in [('after_flush', record_changed_models), ('after_bulk_update', record_bulk_changed_models),
+                                ('after_bulk_delete', record_bulk_changed_models), ('after_commit', invalidate_changed_models),
+                                ('after_rollback', forget_changed_models)]:
+        if not event.contains(Database.session, eventName, listener):
+            event.listen(Database.session, eventName, listener)
@@ -0,0 +1,177 @@
+import time
+from flask import current_app, g, session
+from sqlalchemy import inspect
+from auth.metrics import record_cache_lookup
+from auth.models import Character
+from auth.shared import PermissionCache, SharedInfo
+
+# Character columns copied into the principal, they are read without loading the character.
+PrincipalFields = ['id', 'name', 'main_id', 'corp_id', 'admin_corp_id', 'alliance_id', 'permission_version']
+
+
+class Principal:
+    """The logged in character as cached in the session. Answers the questions almost every request asks, like the name,
+    the permissions and the alliance membership of the character, without the database. Everything else is read from
+    or written to the Character row, which is loaded the first time it is needed. Once the request changed the
+    character, all answers come from the row.
+    """
+
+    def __init__(self, data):
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_character', None)
+        object.__setattr__(self, '_changed', False)
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    @property
+    def is_in_alliance(self):
+        if self._changed:
+            return self._character.is_in_alliance
+        return self._data['in_alliance']
+
+    def get_id(self):
+        return str(self._data['id'])
+
+    def get_corp_id(self):
+        if self._changed:
+            return self._character.get_corp_id()
+        return self._data['corp_view_id']
+
+    def get_permissions(self):
+        if self._changed:
+            return self._character.get_permissions()
+        return frozenset(self._data['permissions'])
+
+    def has_permission(self, permission_name):
+        if self._changed:
+            return self._character.has_permission(permission_name)
+        return permission_name.lower() in self._data['permissions']
+
+    def get_character(self):
+        # Load the row once per request, it ends up in the identity map like any other query
+        if self._character is None:
+            object.__setattr__(self, '_character', Character.query.get(self._data['id']))
+            g.principal = self
+        return self._character
+
+    def __getattr__(self, name):
+        if name in PrincipalFields and not self._changed:
+            return self._data[name]
+        return getattr(self.get_character(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_character(), name, value)
+        object.__setattr__(self, '_changed', True)
+
+    def __str__(self):
+        return '<Character-{}>'.format(self._data['name'])
+
+
+def get_character_version():
+    """Gets the version of the characters, shared by the workers through the page cache. Every commit that changes
+    or deletes characters, their roles or the permissions of their roles gives the characters a new version.
+
+    Args:
+        None
+
+    Returns:
+        tuple: Version of the characters, None if the page cache is off and changes can't be seen.
+    """
+
+    if SharedInfo['page_cache'] is None:
+        return None
+    return SharedInfo['page_cache'].get_versions(['Character'])
+
+
+def create_principal_data(character):
+    """Copies what the principal caches from a character.
+
+    Args:
+        character (Character): Character to cache.
+
+    Returns:
+        dict: Session data of the principal.
+    """
+
+    data = {field: getattr(character, field) for field in PrincipalFields}
+    data['permissions'] = sorted(character.get_permissions())
+    data['in_alliance'] = character.is_in_alliance
+    data['corp_view_id'] = character.get_corp_id()
+    data['character_version'] = get_character_version()
+    data['expires'] = time.time() + current_app.config.get('PRINCIPAL_CACHE_SECONDS', 60)
+    return data
+
+
+def load_principal(character_id):
+    """Gets the principal of the logged in character. The principal in the session is used while it has not expired
+    and no character changed since it was made. After that the character is loaded to check it still exists and to
+    refresh the principal, and its permissions are only looked up again if the permission version changed.
+
+    Args:
+        character_id (int): ID of the logged in character.
+
+    Returns:
+        Principal: The principal, None if the character doesn't exist anymore.
+    """
+
+    data = session.get('principal')
+    characterVersion = get_character_version()
+    # Without the page cache changes made by other workers can't be seen, the character is loaded on every request
+    isCached = bool(data and data['id'] == character_id and data['expires'] > time.time() and characterVersion is not None
+                    and list(data.get('character_version') or ()) == list(characterVersion))
+    record_cache_lookup('principal', isCached)
+    if isCached:
+        return Principal(data)
+
+    character = Character.query.get(character_id)
+    if character is None:
+        session.pop('principal', None)
+        return None
+
+    if data and data['id'] == character_id and data['permission_version'] == character.permission_version:
+        # The permissions didn't change, reuse them instead of looking them up
+        cached = PermissionCache.get(character.id)
+        if not cached or cached[0] != character.permission_version:
+            PermissionCache[character.id] = (character.permission_version, frozenset(data['permissions']))
+
+    session['principal'] = create_principal_data(character)
+    principal = Principal(session['principal'])
+    object.__setattr__(principal, '_character', character)
+    g.principal = principal
+    return principal
+
+
+def store_changed_principal(response):
+    """Refreshes the principal in the session if the request loaded the character and changed it,
+    so changes to the logged in character are visible on the next request.
+
+    Args:
+        response (Response): Response of the request.
+
+    Returns:
+        Response: The same response.
+    """
+
+    principal = g.get('principal')
+    if principal is None or principal._character is None:
+        return response
+
+    state = inspect(principal._character)
+    if state.deleted or state.was_deleted or state.detached:
+        session.pop('principal', None)
+        return response
+
+    data = create_principal_data(principal._character)
+    if any(data[key] != principal._data.get(key) for key in data if key != 'expires'):
+        session['principal'] = data
+    return response
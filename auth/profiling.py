@@ -0,0 +1,196 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from flask import g, request
+from flask_login import current_user
+
+# Only one request is profiled at a time, a second profiler can't run next to the first.
+ProfileLock = threading.Lock()
+
+# URL arguments that are never written to a profile, the audit pages have secrets in their URLs.
+HiddenViewArguments = ['client_secret', 'refresh_token']
+
+# Names of stored profiles, so a name from a URL can't point outside the profile directory.
+ProfileNamePattern = re.compile(r'^[\w.-]+$')
+
+
+def is_profile_requested():
+    """Checks if the current request asks to be profiled, with the X-Profile header or the _profile query argument,
+    and is made by an admin.
+
+    Args:
+        None
+
+    Returns:
+        bool: True if the request should be profiled.
+    """
+
+    if not request.headers.get('X-Profile') and not request.args.get('_profile'):
+        return False
+    return current_user.is_authenticated and current_user.has_permission('admin')
+
+
+def install_profiling(application):
+    """Lets admins profile single requests. A profiled request runs under cProfile and tracemalloc, and the CPU profile
+    is stored in PROFILE_DIRECTORY with a report and the metadata of the request. Only the request thread is profiled,
+    work done on other threads, like concurrent ESI requests, shows up as waiting.
+
+    Args:
+        application (Flask): Application to profile the requests of.
+
+    Returns:
+        None
+    """
+
+    @application.before_request
+    def start_profile():
+        if not is_profile_requested():
+            return
+        if not ProfileLock.acquire(blocking=False):
+            application.logger.warning('Not profiling {}, another request is being profiled.'.format(request.endpoint))
+            return
+
+        g.profile_start = time.perf_counter()
+        g.profile_started_tracemalloc = not tracemalloc.is_tracing()
+        if g.profile_started_tracemalloc:
+            tracemalloc.start(application.config.get('PROFILE_TRACEMALLOC_FRAMES', 10))
+        g.profile_memory_before = tracemalloc.take_snapshot()
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+    @application.after_request
+    def record_profile_status(response):
+        if 'profile' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @application.teardown_request
+    def stop_profile(exception):
+        if 'profile' not in g:
+            return
+
+        try:
+            g.profile.disable()
+            seconds = time.perf_counter() - g.profile_start
+            memoryAfter = tracemalloc.take_snapshot()
+            memoryCurrent, memoryPeak = tracemalloc.get_traced_memory()
+            if g.profile_started_tracemalloc:
+                tracemalloc.stop()
+
+            name = save_profile(application.config.get('PROFILE_DIRECTORY', 'profiles'), g.profile, {
+                'endpoint': request.endpoint,
+                'method': request.method,
+                'path': get_profile_path(),
+                'status': g.get('profile_status', 500),
+                'user': current_user.name,
+                'timestamp': time.time(),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'seconds': seconds,
+                'memory_peak': memoryPeak,
+            }, memoryAfter.compare_to(g.profile_memory_before, 'lineno'), application.config.get('PROFILE_KEEP', 50))
+            application.logger.info('{} profiled {} in {}.'.format(current_user.name, request.endpoint, name))
+        finally:
+            ProfileLock.release()
+
+
+def get_profile_path():
+    """Gets the path of the current request with the secrets in it hidden.
+
+    Args:
+        None
+
+    Returns:
+        str: Path of the request.
+    """
+
+    path = request.path
+    for argument in HiddenViewArguments:
+        value = (request.view_args or {}).get(argument)
+        if value:
+            path = path.replace(str(value), '<{}>'.format(argument))
+    return path
+
+
+def save_profile(directory, profile, metadata, memory_differences, keep):
+    """Stores a CPU profile with its report and the metadata of the request, and removes the oldest profiles
+    so at most keep are stored.
+
+    Args:
+        directory (str): Profile directory.
+        profile (cProfile.Profile): Finished profile.
+        metadata (dict): Request metadata.
+        memory_differences (list<tracemalloc.StatisticDiff>): Memory allocated per line during the request, largest first.
+        keep (int): Amount of profiles to keep.
+
+    Returns:
+        str: Name of the stored profile.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), str(os.getpid()), re.sub(r'[^\w.]', '_', metadata['endpoint'] or 'none'))
+
+    profile.dump_stats(os.path.join(directory, name + '.prof'))
+
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(60)
+    metadata['cpu_report'] = report.getvalue()
+    metadata['memory_report'] = [str(difference) for difference in memory_differences[:30]]
+    with open(os.path.join(directory, name + '.json'), 'w') as metadataFile:
+        json.dump(metadata, metadataFile)
+
+    for oldName in [profileName for profileName, profileMetadata in list_profiles(directory)][keep:]:
+        for extension in ['.prof', '.json']:
+            try:
+                os.remove(os.path.join(directory, oldName + extension))
+            except OSError:
+                pass
+
+    return name
+
+
+def list_profiles(directory):
+    """Lists the stored profiles, newest first.
+
+    Args:
+        directory (str): Profile directory.
+
+    Returns:
+        list<tuple(str, dict)>: Names and metadata of the profiles.
+    """
+
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for fileName in os.listdir(directory):
+        if fileName.endswith('.json'):
+            metadata = load_profile(directory, fileName[:-len('.json')])
+            if metadata is not None:
+                profiles.append((fileName[:-len('.json')], metadata))
+    return sorted(profiles, key=lambda profile: profile[1]['timestamp'], reverse=True)
+
+
+def load_profile(directory, name):
+    """Loads the metadata and reports of a stored profile.
+
+    Args:
+        directory (str): Profile directory.
+        name (str): Name of the profile.
+
+    Returns:
+        dict: Metadata of the profile, None if there is no such profile.
+    """
+
+    if not ProfileNamePattern.match(name):
+        return None
+    try:
+        with open(os.path.join(directory, name + '.json')) as metadataFile:
+            return json.load(metadataFile)
+    except (OSError, ValueError):
+        return None
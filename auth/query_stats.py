@@ -0,0 +1,141 @@
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from auth.metrics import Metrics
+
+# Amount of slowest statements kept per request.
+SlowestStatementCount = 5
+
+# Per thread query counters opened by query_budget, a list so budgets can be nested.
+BudgetCounters = threading.local()
+
+
+class QueryStats:
+    """Queries made while handling one request: their count, total time and the slowest statements."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []
+
+    def add(self, statement, seconds):
+        """Records one query.
+
+        Args:
+            statement (str): SQL of the query.
+            seconds (float): Time the query took.
+
+        Returns:
+            None
+        """
+
+        self.count += 1
+        self.seconds += seconds
+        # Min-heap on the duration, so the fastest of the kept statements is dropped first
+        if len(self.slowest) < SlowestStatementCount:
+            heapq.heappush(self.slowest, (seconds, self.count, statement))
+        else:
+            heapq.heappushpop(self.slowest, (seconds, self.count, statement))
+
+    def get_slowest(self):
+        """Gets the slowest statements, slowest first.
+
+        Args:
+            None
+
+        Returns:
+            list<tuple(float, str)>: Duration and SQL of the statements.
+        """
+
+        return [(seconds, statement) for seconds, index, statement in sorted(self.slowest, reverse=True)]
+
+
+def install_query_stats(application, engine):
+    """Records the queries of every request. A summary is logged after every request, as a warning with the slowest
+    statements when the request made more than QUERY_COUNT_WARNING queries or spent more than QUERY_TIME_WARNING seconds
+    in the database. In debug mode the count and time are also sent in the X-Query-Count and X-Query-Time headers.
+
+    Args:
+        application (Flask): Application to record the requests of.
+        engine (Engine): Engine to record the queries of.
+
+    Returns:
+        None
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - connection.info['query_start_times'].pop()
+        Metrics.observe('auth_db_query_seconds', seconds, {'statement': statement.split(None, 1)[0].lower()})
+
+        for counter in getattr(BudgetCounters, 'counters', []):
+            counter.add(statement, seconds)
+
+        # Queries of other threads, like the serialized writer, don't belong to a request
+        if has_request_context() and 'query_stats' in g:
+            g.query_stats.add(statement, seconds)
+
+    @application.before_request
+    def start_request_stats():
+        g.query_stats = QueryStats()
+
+    def log_request_stats(stats, method, path):
+        summary = '{} {} made {} queries in {:.1f} ms.'.format(method, path, str(stats.count), stats.seconds * 1000)
+        if stats.count > application.config.get('QUERY_COUNT_WARNING', 100) or stats.seconds > application.config.get('QUERY_TIME_WARNING', 1.0):
+            application.logger.warning(summary + ' Slowest statements:\n' + '\n'.join(
+                '{:.1f} ms: {}'.format(seconds * 1000, statement) for seconds, statement in stats.get_slowest()))
+        else:
+            application.logger.debug(summary)
+
+    @application.after_request
+    def report_request_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+
+        if response.is_streamed:
+            # The page is rendered while it is sent, its queries are only all made when the response is closed.
+            # The headers are sent before that, so streamed responses have no X-Query-Count
+            method, path = request.method, request.path
+            response.call_on_close(lambda: log_request_stats(stats, method, path))
+            return response
+
+        log_request_stats(stats, request.method, request.path)
+        if application.debug:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time'] = '{:.1f}ms'.format(stats.seconds * 1000)
+        return response
+
+
+@contextmanager
+def query_budget(budget, name='Block'):
+    """Fails with an AssertionError when the code in the with block makes more than budget queries on this thread.
+    Needs install_query_stats to be called on the engine.
+
+    Args:
+        budget (int): Maximum amount of queries.
+        name (str): Name of the checked code, for the error message.
+
+    Returns:
+        QueryStats: Queries made so far, filled in while the block runs.
+    """
+
+    stats = QueryStats()
+    if not hasattr(BudgetCounters, 'counters'):
+        BudgetCounters.counters = []
+    BudgetCounters.counters.append(stats)
+    try:
+        yield stats
+    finally:
+        BudgetCounters.counters.remove(stats)
+
+    if stats.count > budget:
+        raise AssertionError('{} made {} queries, its budget is {}. Slowest statements:\n{}'.format(
+            name, str(stats.count), str(budget), '\n'.join(statement for seconds, statement in stats.get_slowest())))
@@ -1,14 +1,74 @@
+import threading
 from flask_sqlalchemy import SQLAlchemy
 
+
+class LazyClients(dict):
+    """Dictionary that creates some of its values the first time they are used, so API clients are only built
+    by the processes that use them, and not while the application starts.
+    """
+
+    def __init__(self, values):
+        super().__init__(values)
+        self.Factories = {}
+        self.Lock = threading.Lock()
+
+    def set_factory(self, key, factory):
+        """Sets the function that creates a value, dropping the value created by the previous function.
+
+        Args:
+            key (str): Key of the value.
+            factory (callable): Function without arguments that creates the value.
+
+        Returns:
+            None
+        """
+
+        with self.Lock:
+            self.Factories[key] = factory
+            self.pop(key, None)
+
+    def create(self, key):
+        """Creates a new value with the factory of a key, without storing it. For clients that are changed while
+        they are used, like by logging in with them, so every request gets its own.
+
+        Args:
+            key (str): Key of the value.
+
+        Returns:
+            object: The new value.
+        """
+
+        return self.Factories[key]()
+
+    def __missing__(self, key):
+        if key not in self.Factories:
+            raise KeyError(key)
+
+        with self.Lock:
+            # Another thread may have created it while this one waited
+            if not dict.__contains__(self, key):
+                self[key] = self.Factories[key]()
+            return dict.__getitem__(self, key)
+
+
 Database = SQLAlchemy()
-SharedInfo = {
+# 'reddit' is created on first use, create_app sets its factory
+SharedInfo = LazyClients({
     'alliance_id': 0,
     'util': None,
-    'reddit': None,
-}
-EveAPI = {
+    'writer': None,
+    'page_cache': None,
+})
+# 'default_user_preston', 'corp_preston' and 'full_auth_preston' are created on first use, create_app sets their factories
+EveAPI = LazyClients({
     'user_agent': "",
-    'default_user_preston': None,
-    'corp_preston': None,
-    'full_auth_preston': None
-}
+})
+
+# Permission sets per character ID, as (permission version, permission names)
+PermissionCache = {}
+
+# Application counters per corporation ID, as (expiry timestamp, counts)
+ApplicationCountCache = {}
+
+# Member corporations per alliance ID, as (expiry timestamp, (alliance, members))
+AllianceMemberCache = {}
@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy import event
+
+
+def set_sqlite_pragmas(engine, wal=True, busy_timeout=30):
+    """Prepares a SQLite engine for several workers using the database at the same time.
+    In WAL mode readers never block the writer and the writer never blocks readers, and
+    with a busy timeout a writer waits for the write lock instead of failing with "database is locked".
+
+    Args:
+        engine (Engine): SQLite engine to configure.
+        wal (bool): Switch the database to WAL journal mode if true.
+        busy_timeout (float): Seconds a connection waits for a lock before giving up.
+
+    Returns:
+        None
+    """
+
+    @event.listens_for(engine, 'connect')
+    def set_connection_pragmas(connection, connection_record):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA busy_timeout = {}'.format(str(int(busy_timeout * 1000))))
+        if wal:
+            # Safe in WAL mode, a power loss can only lose the last commits, never corrupt the database
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.close()
+
+    # The journal mode is stored in the database file, so it only needs to be set once
+    if wal:
+        with engine.connect() as connection:
+            connection.execute('PRAGMA journal_mode = WAL')
+
+
+class SerializedWriter:
+    """Runs the small writes of a worker on a single thread. Writes that are queued at the same time are
+    committed together in one transaction, so concurrent requests take the write lock once instead of each
+    waiting for it in turn.
+    """
+
+    def __init__(self, engine, batch_size=50, batch_delay=0):
+        self.Engine = engine
+        self.BatchSize = batch_size
+        self.BatchDelay = batch_delay
+        self.Queue = None
+        self.Thread = None
+        self.Pid = None
+        self.Lock = threading.Lock()
+
+    def start(self):
+        """Starts the writer thread of the current process. It is started by the first write of every process, as the
+        thread of the process that forked it (like the gunicorn master with preload_app) doesn't run in it.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        with self.Lock:
+            if self.Pid == os.getpid():
+                return
+            self.Queue = queue.Queue()
+            self.Thread = threading.Thread(target=self._run, args=(self.Queue,), name='SerializedWriter', daemon=True)
+            self.Thread.start()
+            self.Pid = os.getpid()
+
+    def submit(self, statement):
+        """Queues a write statement and waits until it is committed.
+
+        Args:
+            statement (Executable): Insert, update or delete statement.
+
+        Returns:
+            int: Amount of rows the statement changed.
+        """
+
+        if self.Pid != os.getpid():
+            self.start()
+
+        future = Future()
+        self.Queue.put((statement, future))
+        return future.result()
+
+    def _run(self, statements):
+        """Writes the queued statements in batches, forever.
+
+        Args:
+            statements (Queue): Queue of the process the thread runs in.
+
+        Returns:
+            None
+        """
+
+        while True:
+            batch = [statements.get()]
+
+            # Wait a moment for statements of other requests, so they share the commit
+            deadline = time.time() + self.BatchDelay
+            while len(batch) < self.BatchSize:
+                try:
+                    batch.append(statements.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+
+    def _write(self, batch):
+        """Writes a batch of statements in one transaction. If a statement fails, the statements are
+        written one by one, so only the failing statement reports the error.
+
+        Args:
+            batch (list<tuple(Executable, Future)>): Statements with the futures waiting for them.
+
+        Returns:
+            None
+        """
+
+        try:
+            with self.Engine.begin() as connection:
+                rowCounts = [connection.execute(statement).rowcount for statement, future in batch]
+        except Exception as e:
+            if len(batch) > 1:
+                for job in batch:
+                    self._write([job])
+            else:
+                batch[0][1].set_exception(e)
+            return
+
+        for (statement, future), rowCount in zip(batch, rowCounts):
+            future.set_result(rowCount)
@@ -0,0 +1,162 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+from auth.models import *
+from auth.shared import Database, SharedInfo
+
+# Roles handed out to synthetic members, with the permissions they grant.
+SyntheticRoles = {
+    'Director': ['corp_manager', 'read_membership', 'edit_member', 'read_applications', 'review_applications', 'parse_esi'],
+    'Recruiter': ['read_membership', 'read_applications', 'review_applications', 'parse_esi'],
+    'Member Viewer': ['read_membership'],
+}
+
+
+def generate_synthetic_alliance(alliance_id, admin_character_id, corporation_count, character_count, seed=0):
+    """Fills the database with a synthetic alliance for scale testing. Characters are spread over
+    the alliance corporations and a handful of outside corporations, roughly a third of them are alts,
+    outside characters get an application and everyone gets notes, tokens and reddit accounts at random.
+    The admin character is created as the first main of the first corporation.
+
+    Args:
+        alliance_id (int): ID of the synthetic alliance.
+        admin_character_id (int): ID of the admin character.
+        corporation_count (int): Amount of corporations in the alliance.
+        character_count (int): Amount of characters to create.
+        seed (int): Seed for the random generator, the same seed generates the same dataset.
+
+    Returns:
+        dict: ESI fixtures for the generated entities, keyed by ESI request path. Can be used as ESI_FIXTURE_FILE.
+    """
+
+    generator = random.Random(seed)
+    fixtures = {}
+    startDate = datetime(2010, 1, 1)
+
+    # Alliance.
+    alliance = Alliance(alliance_id, 'Synthetic Alliance', 'SYNTH', "http://image.eveonline.com/Alliance/{}_128.png".format(str(alliance_id)))
+    Database.session.add(alliance)
+
+    # Corporations, the outside ones are not in the alliance.
+    outsideCount = max(1, corporation_count // 10)
+    allianceCorporationIds = [98000000 + index for index in range(corporation_count)]
+    outsideCorporationIds = [98900000 + index for index in range(outsideCount)]
+    corporationMappings = []
+    for corporationId in allianceCorporationIds + outsideCorporationIds:
+        inAlliance = corporationId in allianceCorporationIds
+        corporationMappings.append({
+            'id': corporationId,
+            'name': 'Synthetic Corporation {}'.format(str(corporationId)),
+            'ticker': 'S{}'.format(str(corporationId % 100000)),
+            'logo': "http://image.eveonline.com/Corporation/{}_128.png".format(str(corporationId)),
+            'recruitment_open': inAlliance and generator.random() < 0.5,
+            'inhouse_description': '',
+            'access_token': '',
+            'refresh_token': '',
+            'alliance_id': alliance_id if inAlliance else None,
+        })
+    Database.session.bulk_insert_mappings(Corporation, corporationMappings)
+
+    # Characters, every main is followed by its alts.
+    characterMappings = []
+    mainId = None
+    characterCorporations = {}
+    nextCharacterId = 90000000
+    for index in range(character_count):
+        # Real character IDs share the synthetic range, the admin's ID is skipped so it isn't handed out twice.
+        if index == 0:
+            characterId = admin_character_id
+        else:
+            nextCharacterId += 1
+            if nextCharacterId == admin_character_id:
+                nextCharacterId += 1
+            characterId = nextCharacterId
+        if index == 0 or mainId is None or generator.random() > 0.33:
+            mainId = characterId
+
+        # Ten percent of the characters are outside the alliance, the admin never is.
+        if index > 0 and generator.random() < 0.1:
+            corporationId = generator.choice(outsideCorporationIds)
+        else:
+            corporationId = allianceCorporationIds[0] if index == 0 else generator.choice(allianceCorporationIds)
+        characterCorporations[characterId] = corporationId
+
+        hasTokens = generator.random() < 0.8
+        characterMappings.append({
+            'id': characterId,
+            'name': 'Synthetic Pilot {}'.format(str(characterId)),
+            'main_id': mainId,
+            'corp_id': corporationId,
+            'alliance_id': alliance_id if corporationId in allianceCorporationIds else None,
+            'admin_corp_id': corporationId,
+            'access_token': uuid.UUID(int=generator.getrandbits(128)).hex if hasTokens else None,
+            'refresh_token': uuid.UUID(int=generator.getrandbits(128)).hex if hasTokens else None,
+            'reddit': 'synthetic_pilot_{}'.format(str(characterId)) if generator.random() < 0.7 else None,
+            'portrait': "https://imageserver.eveonline.com/Character/{}_128.jpg".format(str(characterId)),
+            'notes': 'Synthetic note for pilot {}.'.format(str(characterId)) if generator.random() < 0.2 else '',
+        })
+    Database.session.bulk_insert_mappings(Character, characterMappings)
+
+    # Applications from outside mains to corporations with open recruitment.
+    openCorporationIds = [mapping['id'] for mapping in corporationMappings if mapping['recruitment_open']] or allianceCorporationIds
+    applicationMappings = []
+    for mapping in characterMappings:
+        if mapping['corp_id'] in outsideCorporationIds and mapping['main_id'] == mapping['id']:
+            applicationMappings.append({
+                'timestamp': startDate + timedelta(minutes=generator.randrange(60 * 24 * 365 * 8)),
+                'character_id': mapping['id'],
+                'corporation_id': generator.choice(openCorporationIds),
+                'ready_accepted': generator.random() < 0.25,
+            })
+    Database.session.bulk_insert_mappings(Application, applicationMappings)
+
+    # Roles, handed out to one in fifty alliance mains.
+    roleIds = []
+    for roleName, permissionNames in SyntheticRoles.items():
+        role = SharedInfo['util'].get_or_create_role(roleName)
+        for permissionName in permissionNames:
+            permission = SharedInfo['util'].get_or_create_permission(permissionName)
+            if permission not in role.permissions:
+                role.permissions.append(permission)
+        Database.session.flush()
+        roleIds.append(role.id)
+
+    roleConnections = [{'character_id': mapping['id'], 'role_id': generator.choice(roleIds)} for mapping in characterMappings
+                       if mapping['id'] != admin_character_id and mapping['main_id'] == mapping['id']
+                       and mapping['corp_id'] in allianceCorporationIds and generator.random() < 0.02]
+    if roleConnections:
+        Database.session.execute(roleConnection.insert(), roleConnections)
+
+    Database.session.commit()
+
+    # ESI fixtures.
+    fixtures['/latest/alliances/{}/'.format(str(alliance_id))] = {
+        'name': alliance.name, 'ticker': alliance.ticker, 'executor_corporation_id': allianceCorporationIds[0], 'date_founded': startDate.isoformat() + 'Z'}
+    fixtures['/latest/alliances/{}/icons/'.format(str(alliance_id))] = {'px64x64': alliance.logo, 'px128x128': alliance.logo}
+    fixtures['/latest/alliances/{}/corporations/'.format(str(alliance_id))] = allianceCorporationIds
+
+    corporationMembers = {}
+    for characterId, corporationId in characterCorporations.items():
+        corporationMembers.setdefault(corporationId, []).append(characterId)
+
+    for mapping in corporationMappings:
+        corporationFixture = {'name': mapping['name'], 'ticker': mapping['ticker'], 'member_count': len(corporationMembers.get(mapping['id'], []))}
+        if mapping['alliance_id']:
+            corporationFixture['alliance_id'] = mapping['alliance_id']
+        fixtures['/latest/corporations/{}/'.format(str(mapping['id']))] = corporationFixture
+        fixtures['/latest/corporations/{}/icons/'.format(str(mapping['id']))] = {'px64x64': mapping['logo'], 'px128x128': mapping['logo']}
+        fixtures['/latest/corporations/{}/members/'.format(str(mapping['id']))] = corporationMembers.get(mapping['id'], [])
+        fixtures['/latest/corporations/{}/alliancehistory/'.format(str(mapping['id']))] = [
+            {'alliance_id': mapping['alliance_id'], 'record_id': 1, 'start_date': startDate.isoformat() + 'Z'}] if mapping['alliance_id'] else []
+
+    for mapping in characterMappings:
+        characterFixture = {'name': mapping['name'], 'corporation_id': mapping['corp_id'], 'birthday': startDate.isoformat() + 'Z',
+                            'gender': 'female', 'race_id': 1, 'bloodline_id': 1}
+        if mapping['corp_id'] in allianceCorporationIds:
+            characterFixture['alliance_id'] = alliance_id
+        fixtures['/latest/characters/{}/'.format(str(mapping['id']))] = characterFixture
+        fixtures['/latest/characters/{}/portrait/'.format(str(mapping['id']))] = {'px64x64': mapping['portrait'], 'px128x128': mapping['portrait']}
+        fixtures['/latest/characters/{}/corporationhistory/'.format(str(mapping['id']))] = [
+            {'corporation_id': mapping['corp_id'], 'record_id': 1, 'start_date': startDate.isoformat() + 'Z'}]
+
+    return fixtures
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import time
+from flask import Response, current_app, get_flashed_messages, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache in a directory shared by the workers. Compiled templates are written to a temporary file and
+    moved in place, so a worker never loads a template another worker is still writing.
+    """
+
+    def dump_bytecode(self, bucket):
+        path = self._get_cache_filename(bucket)
+        temporaryPath = None
+        try:
+            descriptor, temporaryPath = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(descriptor, 'wb') as cacheFile:
+                bucket.write_bytecode(cacheFile)
+            # mkstemp makes files only its user can read, the workers may run as another user than the deploy
+            os.chmod(temporaryPath, 0o644)
+            os.replace(temporaryPath, path)
+        except OSError:
+            # Without the cache the template is compiled again by the next worker, nothing breaks
+            if temporaryPath is not None and os.path.exists(temporaryPath):
+                try:
+                    os.remove(temporaryPath)
+                except OSError:
+                    pass
+
+
+def install_template_cache(application):
+    """Stores the compiled templates in TEMPLATE_CACHE_DIRECTORY, so a template is compiled once for all workers
+    (and once per deploy with "python manage.py compile_templates") instead of once per worker.
+
+    Args:
+        application (Flask): Application to cache the templates of.
+
+    Returns:
+        None
+    """
+
+    directory = application.config.get('TEMPLATE_CACHE_DIRECTORY', 'template_cache')
+    if not directory:
+        return
+
+    directory = os.path.join(application.root_path, directory)
+    os.makedirs(directory, exist_ok=True)
+    application.jinja_env.bytecode_cache = SharedBytecodeCache(directory)
+
+
+def compile_templates(application):
+    """Compiles every template of the application into the bytecode cache.
+
+    Args:
+        application (Flask): Application to compile the templates of.
+
+    Returns:
+        list<tuple(str, float)>: Name of every template and the seconds it took to compile.
+    """
+
+    compiled = []
+    for name in application.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        start = time.perf_counter()
+        application.jinja_env.get_template(name)
+        compiled.append((name, time.perf_counter() - start))
+    return compiled
+
+
+def stream_template(template_name, **context):
+    """Renders a template like render_template, but sends the page while it is rendered, a few template chunks
+    (STREAM_BUFFER_SIZE) at a time, instead of building all of it in memory first. Values in the context that are
+    generators are only run when the template reaches them, so the top of the page is already shown by then.
+    The session is sent before the page, so the flashed messages are taken out of it before rendering starts.
+
+    Args:
+        template_name (str): Template to render.
+        context (dict): Template context.
+
+    Returns:
+        Response: Streamed response with the page.
+    """
+
+    get_flashed_messages()
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(current_app.config.get('STREAM_BUFFER_SIZE', 5))
+    return Response(stream_with_context(stream), mimetype='text/html')
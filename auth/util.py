@@ -1,16 +1,72 @@
+import base64
+import binascii
 import requests
 from auth.models import *
+from auth.esi_trace import get_trace, run_with_trace
+from auth.metrics import record_cache_lookup, record_esi_response
+from auth.page_cache import invalidate_page_cache
 from auth.shared import Database, SharedInfo
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 from flask import flash
+from sqlalchemy import DateTime, and_, literal, or_
+from urllib.parse import urlparse
+import json
 import re
+import threading
+import time
+
+# Maximum amount of IDs ESI accepts in one bulk request.
+EsiIdBatchSize = 1000
+
+# Maximum amount of IDs in one IN clause, below SQLite's parameter limit.
+DatabaseParameterBatchSize = 500
+
+# Format of timestamps in keyset pagination cursors, with microseconds so no row is skipped.
+KeysetCursorTimeFormat = '%Y-%m-%dT%H:%M:%S.%f'
 
 
 class Util:
     def __init__(self, application):
         self.Application = application
 
+        # Local ESI stand-in, used instead of ESI when a fixture file is configured
+        self.EsiFixtures = None
+        if application.config.get('ESI_FIXTURE_FILE'):
+            with open(application.config['ESI_FIXTURE_FILE']) as fixtureFile:
+                self.EsiFixtures = json.load(fixtureFile)
+            application.logger.warning('Serving ESI requests from fixture file {}.'.format(application.config['ESI_FIXTURE_FILE']))
+
+        # Responses of public ESI requests until they expire, as request link -> (expiry timestamp, response), oldest first
+        self.EsiCache = OrderedDict()
+        self.EsiCacheLock = threading.Lock()
+
+        # HTTP session of every thread, a requests session can't be shared between threads
+        self.HttpSessions = threading.local()
+
+    def _get_http_session(self):
+        """Gets the HTTP session of the current thread, which keeps its connections to ESI open between requests.
+        With gevent workers gunicorn.conf.py patches threading before the application is created, and every
+        greenlet gets its own session.
+
+        Args:
+            None
+
+        Returns:
+            requests.Session: Session of the current thread.
+        """
+
+        session = getattr(self.HttpSessions, 'session', None)
+        if session is None:
+            session = self.HttpSessions.session = requests.Session()
+            session.headers['User-Agent'] = SharedInfo['user_agent']
+        return session
+
     def make_esi_request(self, request_link):
-        """Makes an ESI request and logs / returns the necessary info.
+        """Makes an ESI request and logs / returns the necessary info. Responses of public
+        requests are cached until ESI says they expire.
 
         Args:
             request_link (str): Request link to send to ESI.
@@ -19,14 +75,228 @@ class Util:
             response: Returns the ESI response object.
         """
         self.Application.logger.debug("make_esi_request > Making ESI request: " + request_link)
-
-        esiRequest = requests.get(request_link, headers={'User-Agent': SharedInfo['user_agent']})
+        start = time.perf_counter()
+
+        if self.EsiFixtures is not None:
+            fixtureResponse = self._make_fixture_response(request_link)
+            self._record_esi_request(request_link, fixtureResponse, start, 'none')
+            return fixtureResponse
+
+        # Requests with an access token are personal, only public requests are cached
+        isCacheable = 'token=' not in request_link
+        if isCacheable:
+            cachedResponse = self._get_cached_esi_response(request_link)
+            if cachedResponse is not None:
+                self._record_esi_request(request_link, cachedResponse, start, 'hit')
+                return cachedResponse
+
+        try:
+            esiRequest = self._get_http_session().get(request_link)
+        except requests.exceptions.RequestException:
+            self._record_esi_request(request_link, None, start, 'miss' if isCacheable else 'none')
+            raise
+        self._record_esi_request(request_link, esiRequest, start, 'miss' if isCacheable else 'none')
 
         if esiRequest.status_code != 200:
                 self.Application.logger.error('make_esi_request > ESI request threw error {}'.format(str(esiRequest.status_code)))
+        elif isCacheable:
+            self._cache_esi_response(request_link, esiRequest)
+
+        return esiRequest
+
+    def _record_esi_request(self, request_link, response, start, cache):
+        """Records an ESI request in the metrics and in the ESI trace of the current request.
+
+        Args:
+            request_link (str): Request link sent to ESI.
+            response (response): ESI response object, None if the request failed.
+            start (float): time.perf_counter() when the request started.
+            cache (str): 'hit' or 'miss' for requests that can be cached, 'none' for the others.
+
+        Returns:
+            None
+        """
+
+        seconds = time.perf_counter() - start
+        if cache != 'none':
+            record_cache_lookup('esi', cache == 'hit')
+        if cache != 'hit':
+            record_esi_response(request_link, response, seconds)
+
+        trace = get_trace()
+        if trace is not None:
+            trace.add_span(request_link, response, start, seconds, cache)
+
+    def _get_cached_esi_response(self, request_link):
+        """Gets the cached response of an ESI request, if it has not expired yet.
+
+        Args:
+            request_link (str): Request link to look up.
+
+        Returns:
+            response: The cached ESI response object, None if there is none.
+        """
+
+        with self.EsiCacheLock:
+            cached = self.EsiCache.get(request_link)
+            if cached is None:
+                return None
+            if cached[0] <= time.time():
+                del self.EsiCache[request_link]
+                return None
+            self.EsiCache.move_to_end(request_link)
+            return cached[1]
+
+    def _cache_esi_response(self, request_link, response):
+        """Caches an ESI response until the time in its Expires header. The least recently used responses are dropped
+        when there are more than ESI_CACHE_SIZE.
+
+        Args:
+            request_link (str): Request link of the response.
+            response (response): ESI response object.
+
+        Returns:
+            None
+        """
+
+        try:
+            expires = parsedate_to_datetime(response.headers['Expires']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return
+        if expires <= time.time():
+            return
+
+        with self.EsiCacheLock:
+            self.EsiCache[request_link] = (expires, response)
+            self.EsiCache.move_to_end(request_link)
+            while len(self.EsiCache) > self.Application.config.get('ESI_CACHE_SIZE', 5000):
+                self.EsiCache.popitem(last=False)
+
+    def _make_fixture_response(self, request_link):
+        """Answers an ESI request from the loaded fixtures, keyed by the path of the request link.
+
+        Args:
+            request_link (str): Request link to look up.
+
+        Returns:
+            response: Response object with the fixture as body, or a 404 response if there is no fixture.
+        """
+
+        fixture = self.EsiFixtures.get(urlparse(request_link).path)
+
+        fixtureResponse = requests.Response()
+        fixtureResponse.url = request_link
+        fixtureResponse.status_code = 200 if fixture is not None else 404
+        fixtureResponse._content = json.dumps(fixture if fixture is not None else {'error': 'Not found'}).encode('utf-8')
+        return fixtureResponse
+
+    def make_esi_post_request(self, request_link, payload):
+        """Makes an ESI POST request, for bulk endpoints that take a list of IDs, and logs / returns the necessary info.
+
+        Args:
+            request_link (str): Request link to send to ESI.
+            payload (list): JSON body of the request.
+
+        Returns:
+            response: Returns the ESI response object.
+        """
+        self.Application.logger.debug("make_esi_post_request > Making ESI request: {} ({} items)".format(request_link, str(len(payload))))
+
+        start = time.perf_counter()
+
+        if self.EsiFixtures is not None:
+            fixtureResponse = self._make_fixture_post_response(request_link, payload)
+            self._record_esi_request(request_link, fixtureResponse, start, 'none')
+            return fixtureResponse
+
+        try:
+            esiRequest = self._get_http_session().post(request_link, json=payload)
+        except requests.exceptions.RequestException:
+            self._record_esi_request(request_link, None, start, 'none')
+            raise
+        self._record_esi_request(request_link, esiRequest, start, 'none')
+
+        if esiRequest.status_code != 200:
+            self.Application.logger.error('make_esi_post_request > ESI request threw error {}'.format(str(esiRequest.status_code)))
 
         return esiRequest
 
+    def _make_fixture_post_response(self, request_link, payload):
+        """Answers the bulk affiliation and names ESI requests from the loaded fixtures.
+
+        Args:
+            request_link (str): Request link to look up.
+            payload (list<int>): IDs in the request.
+
+        Returns:
+            response: Response object with the answer as body, or a 404 response if an ID has no fixture.
+        """
+
+        path = urlparse(request_link).path
+        fixtureJson = []
+        for entityId in payload:
+            entry = None
+            if path == '/latest/characters/affiliation/':
+                character = self.EsiFixtures.get('/latest/characters/{}/'.format(str(entityId)))
+                if character is not None:
+                    entry = {'character_id': entityId, 'corporation_id': character['corporation_id']}
+                    if 'alliance_id' in character:
+                        entry['alliance_id'] = character['alliance_id']
+            elif path == '/latest/universe/names/':
+                for category in ['character', 'corporation', 'alliance']:
+                    entity = self.EsiFixtures.get('/latest/{}s/{}/'.format(category, str(entityId)))
+                    if entity is not None:
+                        entry = {'id': entityId, 'name': entity['name'], 'category': category}
+                        break
+
+            # ESI rejects the whole request if one of the IDs is invalid
+            if entry is None:
+                fixtureJson = None
+                break
+            fixtureJson.append(entry)
+
+        fixtureResponse = requests.Response()
+        fixtureResponse.url = request_link
+        fixtureResponse.status_code = 200 if fixtureJson is not None else 404
+        fixtureResponse._content = json.dumps(fixtureJson if fixtureJson is not None else {'error': 'Not found'}).encode('utf-8')
+        return fixtureResponse
+
+    def make_esi_requests(self, request_links):
+        """Makes several ESI requests concurrently. Requests that raise a connection
+        error are logged and returned as None, so one failure does not abort the batch.
+
+        Args:
+            request_links (list<str>): Request links to send to ESI.
+
+        Returns:
+            dict: Request link mapped to the ESI response object, or None if the request failed.
+        """
+
+        requestLinks = list(set(request_links))
+        if not requestLinks:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(len(requestLinks), self.Application.config.get('ESI_MAX_WORKERS', 20))) as executor:
+            responses = executor.map(run_with_trace(self._try_esi_request), requestLinks)
+
+        return dict(zip(requestLinks, responses))
+
+    def _try_esi_request(self, request_link):
+        """Makes an ESI request, returning None instead of raising on connection errors.
+
+        Args:
+            request_link (str): Request link to send to ESI.
+
+        Returns:
+            response: Returns the ESI response object, or None if the request could not be made.
+        """
+
+        try:
+            return self.make_esi_request(request_link)
+        except requests.exceptions.RequestException as e:
+            self.Application.logger.error('make_esi_requests > ESI request to {} failed: {}'.format(request_link, str(e)))
+            return None
+
     def make_esi_request_with_operation_id(self, preston, operation_id, request_link):
         """Makes an esi request to an endpoint that requires a certain scope.
 
@@ -85,6 +355,7 @@ class Util:
         if corporation and corporation.id != character.corp_id:
             corporation.characters.append(character)
             character.admin_corp_id = corporation.id
+            character.alliance_id = corporation.alliance_id
             Database.session.commit()
 
     def create_character(self, character_id, main_id=None):
@@ -224,6 +495,401 @@ class Util:
         for corporation_id in allianceJson:
             self.create_corporation(corporation_id)
 
+    def bootstrap_alliance(self, alliance_id):
+        """Creates all the corporations in an alliance, and the alliances they belong to, without
+        touching rows that already exist. Metadata is fetched from ESI concurrently and everything is
+        inserted with a single commit. Corporations that could not be fetched are skipped and returned,
+        so running the bootstrap again resumes where the previous run failed.
+
+        Args:
+            alliance_id (int): Alliance ID of the alliance to bootstrap.
+
+        Returns:
+            list<int>: IDs of the corporations that could not be created, or None if the alliance was not found.
+        """
+
+        allianceCorporations = self.make_esi_request("https://esi.tech.ccp.is/latest/alliances/{}/corporations/".format(str(alliance_id)))
+        allianceJson = allianceCorporations.json() if allianceCorporations.status_code == 200 else None
+
+        # Log and return if the alliance does not exist
+        if not allianceJson:
+            self.Application.logger.warning("bootstrap_alliance > Alliance with ID {} not found. Returning...".format(str(alliance_id)))
+            return None
+
+        corporations = self.create_corporations(allianceJson)
+
+        failedCorporationIds = [corporationId for corporationId in allianceJson if corporationId not in corporations]
+        if failedCorporationIds:
+            self.Application.logger.warning("bootstrap_alliance > Could not create corporations with IDs {}. Run the bootstrap again to retry.".format(
+                ", ".join(str(corporationId) for corporationId in failedCorporationIds)))
+
+        return failedCorporationIds
+
+    def create_characters(self, character_ids, affiliations=None, commit=True):
+        """Creates or updates characters in bulk. Existing characters are prefetched with one query,
+        the corporation of every character is fetched with the bulk affiliation endpoint, names of new
+        characters with the bulk names endpoint, and everything is written in one transaction. Existing
+        characters that changed corporation get their corporation updated, like update_character_corporation.
+
+        Args:
+            character_ids (iterable<int>): Character IDs of the characters to create or update.
+            affiliations (dict): Optional affiliations from get_character_affiliations, fetched if not given.
+            commit (bool): Commit the transaction if true, otherwise leave it to the caller.
+
+        Returns:
+            dict: Character ID mapped to the Character object, for every character that exists after the upsert.
+        """
+
+        characterIds = set(character_ids)
+        characters = {character.id: character for character in self._query_by_ids(Character, characterIds)}
+
+        if affiliations is None:
+            statusCode, affiliations = self.get_character_affiliations(characterIds)
+            if statusCode != 200:
+                self.Application.logger.error("create_characters > Could not retrieve character affiliations, error {}.".format(str(statusCode)))
+                return characters
+
+        # Names are only needed for characters that don't exist yet
+        names = self.get_names([characterId for characterId in characterIds if characterId not in characters])
+
+        # Create the corporations and alliances of all characters in the same transaction
+        corporations = self.create_corporations({affiliation['corporation_id'] for affiliation in affiliations.values()}, commit=False)
+        alliances = self.create_alliances({affiliation['alliance_id'] for affiliation in affiliations.values() if 'alliance_id' in affiliation}, commit=False)
+
+        createdCount = 0
+        movedCount = 0
+        for characterId in characterIds:
+            affiliation = affiliations.get(characterId)
+            if affiliation is None:
+                self.Application.logger.warning("create_characters > Character with ID {} not found. Skipping...".format(str(characterId)))
+                continue
+
+            character = characters.get(characterId)
+            if character is None:
+                if characterId not in names:
+                    self.Application.logger.warning("create_characters > Character with ID {} has no name. Skipping...".format(str(characterId)))
+                    continue
+
+                character = Character(characterId, names[characterId], characterId, "https://imageserver.eveonline.com/Character/{}_128.jpg".format(str(characterId)))
+                Database.session.add(character)
+                characters[characterId] = character
+                createdCount += 1
+            elif character.corp_id != affiliation['corporation_id']:
+                movedCount += 1
+
+            corporation = corporations.get(affiliation['corporation_id'])
+            if not corporation:
+                continue
+
+            # Update the alliance of the corporation if it changed
+            allianceId = affiliation.get('alliance_id')
+            if corporation.alliance_id != allianceId and (allianceId is None or allianceId in alliances):
+                corporation.alliance_id = allianceId
+
+            # Update the corporation if it changed
+            if corporation.id != character.corp_id:
+                character.corporation = corporation
+                character.admin_corp_id = corporation.id
+            character.alliance_id = corporation.alliance_id
+
+        if commit:
+            Database.session.commit()
+
+        self.Application.logger.info("create_characters > Created {} characters, {} existing characters changed corporation.".format(
+            str(createdCount), str(movedCount)))
+        return characters
+
+    def create_corporations(self, corp_ids, commit=True):
+        """Creates corporations in bulk. Existing corporations are prefetched with one query, missing
+        ones are fetched from ESI concurrently, together with their alliances, and written in one transaction.
+
+        Args:
+            corp_ids (iterable<int>): Corporation IDs of the corporations to create.
+            commit (bool): Commit the transaction if true, otherwise leave it to the caller.
+
+        Returns:
+            dict: Corporation ID mapped to the Corporation object, for every corporation that exists after the call.
+        """
+
+        corporationIds = set(corp_ids)
+        corporations = {corporation.id: corporation for corporation in self._query_by_ids(Corporation, corporationIds)}
+
+        corporationLinks = {corporationId: "https://esi.tech.ccp.is/latest/corporations/{}/?datasource=tranquility".format(str(corporationId))
+                            for corporationId in corporationIds if corporationId not in corporations}
+        corporationPayloads = self.make_esi_requests(corporationLinks.values())
+
+        corporationJsons = {}
+        for corporationId, link in corporationLinks.items():
+            payload = corporationPayloads[link]
+            if payload is None or payload.status_code != 200:
+                self.Application.logger.warning("create_corporations > Corporation with ID {} not found. Skipping...".format(str(corporationId)))
+                continue
+            corporationJsons[corporationId] = payload.json()
+
+        # Create the alliances of the new corporations in the same transaction
+        alliances = self.create_alliances({corporationJson['alliance_id'] for corporationJson in corporationJsons.values() if 'alliance_id' in corporationJson},
+                                          commit=False)
+
+        for corporationId, corporationJson in corporationJsons.items():
+            # A corporation whose alliance could not be created is retried on the next call
+            if 'alliance_id' in corporationJson and corporationJson['alliance_id'] not in alliances:
+                self.Application.logger.warning("create_corporations > Alliance of corporation with ID {} not found. Skipping...".format(str(corporationId)))
+                continue
+
+            corporation = Corporation(corporationId, corporationJson['name'], corporationJson['ticker'],
+                                      "http://image.eveonline.com/Corporation/{}_128.png".format(str(corporationId)))
+            corporation.alliance_id = corporationJson.get('alliance_id')
+            Database.session.add(corporation)
+            corporations[corporationId] = corporation
+
+        if commit:
+            Database.session.commit()
+
+        existingCount = len(corporationIds) - len(corporationLinks)
+        self.Application.logger.info("create_corporations > Created {} corporations, {} already existed.".format(
+            str(len(corporations) - existingCount), str(existingCount)))
+        return corporations
+
+    def create_alliances(self, alliance_ids, commit=True):
+        """Creates alliances in bulk. Existing alliances are prefetched with one query, missing
+        ones are fetched from ESI concurrently and written in one transaction.
+
+        Args:
+            alliance_ids (iterable<int>): Alliance IDs of the alliances to create.
+            commit (bool): Commit the transaction if true, otherwise leave it to the caller.
+
+        Returns:
+            dict: Alliance ID mapped to the Alliance object, for every alliance that exists after the call.
+        """
+
+        allianceIds = set(alliance_ids)
+        alliances = {alliance.id: alliance for alliance in self._query_by_ids(Alliance, allianceIds)}
+
+        allianceLinks = {allianceId: "https://esi.tech.ccp.is/latest/alliances/{}/".format(str(allianceId))
+                         for allianceId in allianceIds if allianceId not in alliances}
+        alliancePayloads = self.make_esi_requests(allianceLinks.values())
+
+        for allianceId, link in allianceLinks.items():
+            payload = alliancePayloads[link]
+            if payload is None or payload.status_code != 200:
+                self.Application.logger.warning("create_alliances > Alliance with ID {} not found. Skipping...".format(str(allianceId)))
+                continue
+
+            allianceJson = payload.json()
+            alliance = Alliance(allianceId, allianceJson['name'], allianceJson['ticker'],
+                                "http://image.eveonline.com/Alliance/{}_128.png".format(str(allianceId)))
+            Database.session.add(alliance)
+            alliances[allianceId] = alliance
+
+        if commit:
+            Database.session.commit()
+
+        return alliances
+
+    def refresh_character_alliances(self, commit=True):
+        """Copies the alliance of every character's corporation onto the character with a single update.
+        Should be called after corporations changed alliance outside of create_characters.
+
+        Args:
+            commit (bool): Commit the transaction if true, otherwise leave it to the caller.
+
+        Returns:
+            None
+        """
+
+        allianceIds = Database.session.query(Corporation.alliance_id).filter(Corporation.id == Character.corp_id).as_scalar()
+        Character.query.update({Character.alliance_id: allianceIds}, synchronize_session=False)
+
+        if commit:
+            Database.session.commit()
+
+    def get_character_affiliations(self, character_ids):
+        """Gets the corporation and alliance of characters with the bulk affiliation endpoint.
+
+        Args:
+            character_ids (iterable<int>): Character IDs to get the affiliations of.
+
+        Returns:
+            tuple(int, dict): Status code of the failed request or 200, and the character ID mapped to its affiliation.
+        """
+
+        characterIds = list(character_ids)
+        affiliations = {}
+        for start in range(0, len(characterIds), EsiIdBatchSize):
+            affiliationPayload = self.make_esi_post_request("https://esi.tech.ccp.is/latest/characters/affiliation/?datasource=tranquility",
+                                                            characterIds[start:start + EsiIdBatchSize])
+            if affiliationPayload.status_code != 200:
+                return affiliationPayload.status_code, affiliations
+
+            for affiliation in affiliationPayload.json():
+                affiliations[affiliation['character_id']] = affiliation
+
+        return 200, affiliations
+
+    def get_names(self, ids):
+        """Gets the names of characters, corporations, alliances or other entities with the bulk names endpoint.
+
+        Args:
+            ids (iterable<int>): IDs to get the names of.
+
+        Returns:
+            dict: ID mapped to its name. IDs that could not be resolved are left out.
+        """
+
+        entityIds = list(ids)
+        names = {}
+        for start in range(0, len(entityIds), EsiIdBatchSize):
+            namesPayload = self.make_esi_post_request("https://esi.tech.ccp.is/latest/universe/names/?datasource=tranquility", entityIds[start:start + EsiIdBatchSize])
+            if namesPayload.status_code != 200:
+                continue
+
+            for entity in namesPayload.json():
+                names[entity['id']] = entity['name']
+
+        return names
+
+    def _query_by_ids(self, model, ids):
+        """Gets all rows of a model with the given primary keys, in batches that stay below the database parameter limit.
+
+        Args:
+            model (Database.Model): Model to query.
+            ids (iterable<int>): Primary keys to get.
+
+        Returns:
+            list<Database.Model>: Rows that exist.
+        """
+
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), DatabaseParameterBatchSize):
+            rows.extend(model.query.filter(model.id.in_(ids[start:start + DatabaseParameterBatchSize])).all())
+        return rows
+
+    def update_row(self, row, values):
+        """Changes columns of one row and commits the change. With the serialized writer enabled the change is
+        written by the writer thread, together with the changes of other requests, instead of by this session.
+
+        Args:
+            row (Database.Model): Row to change, it must not have other pending changes.
+            values (dict): Column names mapped to their new values.
+
+        Returns:
+            None
+        """
+
+        if SharedInfo['writer'] is None:
+            for name, value in values.items():
+                setattr(row, name, value)
+            Database.session.commit()
+            return
+
+        table = row.__table__
+        SharedInfo['writer'].submit(table.update().where(table.c.id == row.id).values(values))
+
+        # The row was changed outside of this session, load it again on the next access
+        Database.session.expire(row)
+        invalidate_page_cache([type(row).__name__])
+
+    def get_keyset_page(self, query, keys, after=None, descending=False, page_size=100):
+        """Gets one page of a query with keyset pagination. The rows are ordered on the keys and a page continues
+        after the sort key values of the last row of the previous page, which the cursor carries. It costs the same
+        no matter how deep the page is, and no row is skipped or repeated when rows are added or removed in between,
+        the last row of the previous page included. An after that isn't a cursor of these keys raises ValueError.
+
+        Args:
+            query (Query): Query to page.
+            keys (list): Column expressions to order on, ending on the id column so the order is unique.
+            after (str): Cursor of the previous page, None for the first page.
+            descending (bool): Order descending if true.
+            page_size (int): Maximum amount of rows on the page.
+
+        Returns:
+            tuple(list, str): Rows of the page and the cursor to pass as after to get the next page, None if this is the last page.
+        """
+
+        if after is not None:
+            # (k1 > v1) or (k1 = v1 and k2 > v2) or ..., since not every database supports row values
+            values = [literal(value, key.type) for key, value in zip(keys, self._decode_keyset_cursor(after, keys))]
+            clauses = []
+            for index, key in enumerate(keys):
+                equals = [keys[previous] == values[previous] for previous in range(index)]
+                clauses.append(and_(*(equals + [key < values[index] if descending else key > values[index]])))
+            query = query.filter(or_(*clauses))
+
+        # The key values are selected along with the rows so the cursor doesn't need another query
+        rows = query.add_columns(*keys).order_by(*[key.desc() if descending else key for key in keys]).limit(page_size + 1).all()
+        rowWidth = len(rows[0]) - len(keys) if rows else 0
+        nextAfter = self._encode_keyset_cursor(rows[page_size - 1][rowWidth:]) if len(rows) > page_size else None
+
+        return [row[0] if rowWidth == 1 else tuple(row[:rowWidth]) for row in rows[:page_size]], nextAfter
+
+    def _encode_keyset_cursor(self, values):
+        """Encodes the sort key values of a row as a cursor for get_keyset_page.
+
+        Args:
+            values (list): Sort key values of the row.
+
+        Returns:
+            str: URL safe cursor.
+        """
+
+        values = [value.strftime(KeysetCursorTimeFormat) if isinstance(value, datetime) else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    def _decode_keyset_cursor(self, cursor, keys):
+        """Decodes a cursor made by _encode_keyset_cursor back into sort key values. Raises ValueError if the
+        cursor can't be decoded or doesn't match the keys.
+
+        Args:
+            cursor (str): Cursor to decode.
+            keys (list): Column expressions the cursor was made for.
+
+        Returns:
+            list: Sort key values, one for each key.
+        """
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        except (TypeError, UnicodeDecodeError, binascii.Error) as error:
+            raise ValueError('Invalid cursor: {}'.format(str(error)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError('Invalid cursor: expected {} values.'.format(str(len(keys))))
+
+        return [datetime.strptime(value, KeysetCursorTimeFormat) if isinstance(key.type, DateTime) and value is not None else value
+                for key, value in zip(keys, values)]
+
+    def get_or_create_role(self, role_name):
+        """Gets a role by name, creating it if it does not exist yet. The role is not committed.
+
+        Args:
+            role_name (str): Name of the role.
+
+        Returns:
+            Role: Existing or newly created role.
+        """
+
+        role = Role.query.filter_by(name=role_name).first()
+        if not role:
+            role = Role(role_name)
+            Database.session.add(role)
+        return role
+
+    def get_or_create_permission(self, permission_name):
+        """Gets a permission by name, creating it if it does not exist yet. The permission is not committed.
+
+        Args:
+            permission_name (str): Name of the permission.
+
+        Returns:
+            Permission: Existing or newly created permission.
+        """
+
+        permission = Permission.query.filter_by(name=permission_name).first()
+        if not permission:
+            permission = Permission(permission_name)
+            Database.session.add(permission)
+        return permission
+
     def remove_role(self, role_name, executing_user_name="System", html_flash=False):
         """Removes a role based on the role name.
 
@@ -243,6 +909,7 @@ class Util:
         # This should always be the case though
         if role:
             if not role.has_permission("admin"):
+                role.invalidate_permissions()
                 Database.session.delete(role)
                 Database.session.commit()
                 if html_flash:
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Measures how many audits the application answers per second when many are requested at the same time,
+for every worker profile of gunicorn.conf.py. Every profile gets a fresh gunicorn, the same pages are requested
+from several client threads and the throughput and latency are printed per profile.
+
+Audits need a logged in user with the parse_esi permission: copy the session cookie of such a user from the
+browser and pass it with --cookie, and pass the audit URLs (everything after the host) with --paths.
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def start_gunicorn(profile, port, workers, config_file):
+    """Starts gunicorn with a worker profile and waits until it answers.
+
+    Args:
+        profile (str): AUTH_WORKER_PROFILE of gunicorn.conf.py.
+        port (int): Port to listen on.
+        workers (int): Amount of workers.
+        config_file (str): Config file of the application, empty for the default.
+
+    Returns:
+        subprocess.Popen: The gunicorn process.
+    """
+
+    environment = dict(os.environ, AUTH_WORKER_PROFILE=profile, AUTH_BIND='127.0.0.1:{}'.format(str(port)), AUTH_WORKERS=str(workers))
+    application = 'auth:create_app({})'.format(repr(os.path.abspath(config_file)) if config_file else '')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', application], cwd=Root, env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('gunicorn with the {} profile exited with {}.'.format(profile, str(process.returncode)))
+        try:
+            urllib.request.urlopen('http://127.0.0.1:{}/'.format(str(port)), timeout=1)
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+
+    process.kill()
+    raise SystemExit('gunicorn with the {} profile did not start.'.format(profile))
+
+
+def run_load(port, paths, cookie, clients, requests_per_client):
+    """Requests the pages from several threads at the same time.
+
+    Args:
+        port (int): Port gunicorn listens on.
+        paths (list<str>): Paths to request, in turn.
+        cookie (str): Session cookie sent with the requests.
+        clients (int): Amount of client threads.
+        requests_per_client (int): Amount of requests every thread makes.
+
+    Returns:
+        tuple(float, list<float>, int): Seconds the load took, latency of every answered request and amount of errors.
+    """
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run_client(index):
+        for requestIndex in range(requests_per_client):
+            path = paths[(index + requestIndex) % len(paths)]
+            request = urllib.request.Request('http://127.0.0.1:{}{}'.format(str(port), path), headers={'Cookie': 'session=' + cookie} if cookie else {})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=600) as response:
+                    response.read()
+                    failed = response.status != 200
+            except (urllib.error.URLError, OSError):
+                failed = True
+            with lock:
+                if failed:
+                    errors[0] += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=run_client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, errors[0]
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Benchmarks concurrent audit throughput with every gunicorn worker profile.')
+    Parser.add_argument('--paths', nargs='+', default=['/'], help='Paths to request, like audit URLs (default: /).')
+    Parser.add_argument('--cookie', default='', help='Value of the session cookie of a user that may see the paths.')
+    Parser.add_argument('--profiles', nargs='+', default=['sync', 'gthread', 'gevent'], help='Worker profiles to benchmark (default: sync gthread gevent).')
+    Parser.add_argument('--workers', type=int, default=2, help='Amount of gunicorn workers (default: 2).')
+    Parser.add_argument('--clients', type=int, default=16, help='Amount of concurrent clients (default: 16).')
+    Parser.add_argument('--requests', type=int, default=4, help='Amount of requests per client (default: 4).')
+    Parser.add_argument('--port', type=int, default=3100, help='Port gunicorn listens on (default: 3100).')
+    Parser.add_argument('--config', default='', help='Config file of the application, like one serving ESI fixtures (default: auth/config.cfg).')
+    Arguments = Parser.parse_args()
+
+    print('{:<10} {:>10} {:>14} {:>14} {:>8}'.format('profile', 'pages/s', 'median (ms)', 'p95 (ms)', 'errors'))
+    for Profile in Arguments.profiles:
+        Process = start_gunicorn(Profile, Arguments.port, Arguments.workers, Arguments.config)
+        try:
+            Seconds, Latencies, Errors = run_load(Arguments.port, Arguments.paths, Arguments.cookie, Arguments.clients, Arguments.requests)
+        finally:
+            Process.send_signal(signal.SIGTERM)
+            Process.wait()
+
+        Latencies.sort()
+        print('{:<10} {:>10.1f} {:>14.0f} {:>14.0f} {:>8}'.format(
+            Profile, len(Latencies) / Seconds, 1000 * statistics.median(Latencies) if Latencies else 0,
+            1000 * Latencies[int(0.95 * (len(Latencies) - 1))] if Latencies else 0, Errors))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measures how long the first render of a worker takes, when its templates have to be compiled first.
+Every run is a new process, like a worker after a deploy, with one of three template caches:
+
+    none         No bytecode cache, every worker compiles every template it uses.
+    cold         An empty cache, like the first worker after a deploy without "manage.py compile_templates".
+    precompiled  A cache filled by compile_templates, like every worker after a deploy with it.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Run by every measured process, prints the timings as JSON
+RenderScript = '''
+import json, sys, time
+from flask import render_template
+from auth.app import create_app
+from auth.shared import EveAPI
+from auth.templating import SharedBytecodeCache
+application = create_app()
+application.jinja_env.bytecode_cache = SharedBytecodeCache(sys.argv[1]) if sys.argv[1] else None
+# The login URL is given to every template, create its client before measuring
+EveAPI['default_user_preston']
+
+with application.test_request_context('/'):
+    start = time.perf_counter()
+    render_template('error_404.html')
+    page = time.perf_counter() - start
+
+start = time.perf_counter()
+for name in application.jinja_env.list_templates(filter_func=lambda name: name.startswith('esi_parser/')):
+    application.jinja_env.get_template(name)
+audits = time.perf_counter() - start
+print(json.dumps({'first_page': page, 'audit_templates': audits}))
+'''
+
+
+def measure_render(cache_directory):
+    """Renders the first page in a new interpreter.
+
+    Args:
+        cache_directory (str): Directory of the bytecode cache, empty for no cache.
+
+    Returns:
+        dict: Seconds of the first render of a page and of loading all audit templates.
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    output = subprocess.run([sys.executable, '-c', RenderScript, cache_directory], cwd=root,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    # The application may print to stdout too, the timings are on the last line
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Benchmarks the first render of a worker with and without the template cache.')
+    Parser.add_argument('--runs', type=int, default=5, help='Amount of processes per cache mode (default: 5).')
+    Arguments = Parser.parse_args()
+
+    print('{:<12} {:>18} {:>22}'.format('cache', 'first page (ms)', 'audit templates (ms)'))
+    for Mode in ['none', 'cold', 'precompiled']:
+        Timings = []
+        for Index in range(Arguments.runs):
+            Directory = tempfile.mkdtemp() if Mode != 'none' else ''
+            if Mode == 'precompiled':
+                measure_render(Directory)
+            Timings.append(measure_render(Directory))
+            if Directory:
+                shutil.rmtree(Directory)
+
+        print('{:<12} {:>18.1f} {:>22.1f}'.format(Mode, 1000 * statistics.median(timing['first_page'] for timing in Timings),
+                                                  1000 * statistics.median(timing['audit_templates'] for timing in Timings)))
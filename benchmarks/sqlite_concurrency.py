@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Measures the read and write throughput of several workers sharing one SQLite database, like gunicorn
+workers do, with the default SQLite settings and with the SQLite production mode of auth/sqlite.py.
+
+Every worker runs a few threads that read a random character or change the notes of one and commit,
+the same small writes the HR pages make.
+"""
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, exc, select
+
+# Load auth/sqlite.py on its own, importing the auth package would start the whole application
+SqliteSpec = importlib.util.spec_from_file_location('auth_sqlite', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'auth', 'sqlite.py'))
+AuthSqlite = importlib.util.module_from_spec(SqliteSpec)
+SqliteSpec.loader.exec_module(AuthSqlite)
+
+Metadata = MetaData()
+Characters = Table('Characters', Metadata,
+                   Column('id', Integer, primary_key=True),
+                   Column('name', String),
+                   Column('notes', String))
+
+# Benchmarked modes, as (WAL journal, busy timeout in seconds, serialized writer). The default mode is what
+# the application did before: rollback journal and the five second timeout of the sqlite3 module.
+Modes = {
+    'default': (False, None, False),
+    'wal': (True, 30, False),
+    'wal+writer': (True, 30, True),
+}
+
+
+def create_database(path, row_count):
+    """Creates the benchmark database.
+
+    Args:
+        path (str): Path of the database file.
+        row_count (int): Amount of characters to create.
+
+    Returns:
+        None
+    """
+
+    engine = create_engine('sqlite:///' + path)
+    Metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Characters.insert(), [{'id': index, 'name': 'Pilot {}'.format(str(index)), 'notes': ''} for index in range(row_count)])
+    engine.dispose()
+
+
+def run_worker(path, mode, thread_count, seconds, write_ratio, row_count, results):
+    """Runs one worker, reading and writing from several threads until the time is up.
+
+    Args:
+        path (str): Path of the database file.
+        mode (str): Key of Modes.
+        thread_count (int): Amount of threads in the worker.
+        seconds (float): Duration of the benchmark.
+        write_ratio (float): Fraction of the operations that are writes.
+        row_count (int): Amount of characters in the database.
+        results (multiprocessing.Queue): Queue the counts of the worker are put on.
+
+    Returns:
+        None
+    """
+
+    wal, busyTimeout, serializedWriter = Modes[mode]
+    engine = create_engine('sqlite:///' + path)
+    if busyTimeout is not None:
+        AuthSqlite.set_sqlite_pragmas(engine, wal, busyTimeout)
+    writer = AuthSqlite.SerializedWriter(engine) if serializedWriter else None
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0, 'write_seconds': 0.0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def run_thread():
+        generator = random.Random()
+        reads = writes = errors = 0
+        writeSeconds = 0.0
+        while time.time() < deadline:
+            characterId = generator.randrange(row_count)
+            try:
+                if generator.random() < write_ratio:
+                    statement = Characters.update().where(Characters.c.id == characterId).values(notes='Note {}'.format(str(generator.random())))
+                    start = time.time()
+                    if writer:
+                        writer.submit(statement)
+                    else:
+                        with engine.begin() as connection:
+                            connection.execute(statement)
+                    writeSeconds += time.time() - start
+                    writes += 1
+                else:
+                    with engine.connect() as connection:
+                        connection.execute(select([Characters]).where(Characters.c.id == characterId)).fetchall()
+                    reads += 1
+            except exc.OperationalError:
+                # "database is locked"
+                errors += 1
+
+        with lock:
+            counts['reads'] += reads
+            counts['writes'] += writes
+            counts['errors'] += errors
+            counts['write_seconds'] += writeSeconds
+
+    threads = [threading.Thread(target=run_thread) for index in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results.put(counts)
+
+
+def run_mode(mode, arguments):
+    """Benchmarks one mode on a fresh database.
+
+    Args:
+        mode (str): Key of Modes.
+        arguments (Namespace): Command line arguments.
+
+    Returns:
+        dict: Summed counts of all workers.
+    """
+
+    directory = tempfile.mkdtemp(dir=arguments.directory)
+    path = os.path.join(directory, 'benchmark.db')
+    create_database(path, arguments.rows)
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(path, mode, arguments.threads, arguments.seconds, arguments.write_ratio, arguments.rows, results))
+               for index in range(arguments.workers)]
+    for worker in workers:
+        worker.start()
+    counts = [results.get() for worker in workers]
+    for worker in workers:
+        worker.join()
+
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+    return {key: sum(count[key] for count in counts) for key in counts[0]}
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Benchmarks concurrent SQLite reads and writes with and without the SQLite production mode.')
+    Parser.add_argument('--workers', type=int, default=4, help='Amount of worker processes (default: 4).')
+    Parser.add_argument('--threads', type=int, default=4, help='Amount of threads per worker (default: 4).')
+    Parser.add_argument('--seconds', type=float, default=10, help='Duration of every mode (default: 10).')
+    Parser.add_argument('--write-ratio', type=float, default=0.2, help='Fraction of the operations that are writes (default: 0.2).')
+    Parser.add_argument('--rows', type=int, default=20000, help='Amount of characters in the database (default: 20000).')
+    Parser.add_argument('--directory', default=None,
+                        help='Directory the database is created in, use one on the production disk since commits wait for it (default: system temp directory).')
+    Parser.add_argument('--modes', nargs='+', choices=list(Modes), default=list(Modes), help='Modes to benchmark (default: all).')
+    Arguments = Parser.parse_args()
+
+    print('{:<12} {:>10} {:>10} {:>10} {:>16}'.format('mode', 'reads/s', 'writes/s', 'errors', 'avg write (ms)'))
+    for Mode in Arguments.modes:
+        Counts = run_mode(Mode, Arguments)
+        print('{:<12} {:>10.0f} {:>10.0f} {:>10} {:>16.1f}'.format(
+            Mode, Counts['reads'] / Arguments.seconds, Counts['writes'] / Arguments.seconds, Counts['errors'],
+            1000 * Counts['write_seconds'] / Counts['writes'] if Counts['writes'] else 0))
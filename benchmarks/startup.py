@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Measures how long a worker takes to boot, from a fresh interpreter to an application created by
+auth.app.create_app, like a gunicorn worker does. Every run is a new process, so nothing is imported yet.
+
+With --clients the ESI and Reddit clients are created too, like the first requests of a worker do.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Run by every measured process, prints the timings as JSON
+BootScript = '''
+import json, sys, time
+start = time.perf_counter()
+from auth.app import create_app
+imported = time.perf_counter()
+application = create_app()
+created = time.perf_counter()
+if {clients}:
+    from auth.shared import EveAPI, SharedInfo
+    for key in ['default_user_preston', 'corp_preston', 'full_auth_preston']:
+        EveAPI[key]
+    SharedInfo['reddit']
+clients = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'create_app': created - imported, 'clients': clients - created, 'total': clients - start}}))
+'''
+
+
+def measure_boot(create_clients):
+    """Boots the application in a new interpreter.
+
+    Args:
+        create_clients (bool): True to create the ESI and Reddit clients after the application.
+
+    Returns:
+        dict: Seconds spent importing, in create_app, creating the clients and in total.
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    output = subprocess.run([sys.executable, '-c', BootScript.format(clients=str(create_clients))], cwd=root,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    # The application may print to stdout too, the timings are on the last line
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Benchmarks the time a worker takes to import and create the application.')
+    Parser.add_argument('--runs', type=int, default=10, help='Amount of processes booted (default: 10).')
+    Parser.add_argument('--clients', action='store_true', help='Also create the ESI and Reddit clients, like the first requests do.')
+    Arguments = Parser.parse_args()
+
+    Timings = [measure_boot(Arguments.clients) for index in range(Arguments.runs)]
+
+    print('{:<12} {:>12} {:>12}'.format('step', 'median (ms)', 'max (ms)'))
+    for Step in ['import', 'create_app', 'clients', 'total']:
+        Values = [timing[Step] for timing in Timings]
+        print('{:<12} {:>12.1f} {:>12.1f}'.format(Step, 1000 * statistics.median(Values), 1000 * max(Values)))
@@ -1,37 +1,74 @@
 #!/usr/bin/env python
+import argparse
+import json
+from flask_migrate import stamp
 from auth.shared import SharedInfo
-from auth.app import Database, FlaskApplication
+from auth.app import Database, create_app
 from auth.models import *
+from auth.synthetic import generate_synthetic_alliance
 
-Database.drop_all()
-Database.create_all()
+DefaultPermissions = ['admin', 'corp_manager', 'read_membership', 'edit_member', 'read_applications', 'review_applications', 'parse_esi']
 
-# Create all corps in the alliance
-SharedInfo['util'].create_all_corporations_in_alliance(FlaskApplication.config['ALLIANCE_ID'])
+Parser = argparse.ArgumentParser(description='Creates the Apate database and fills it with the alliance corporations and the admin account.')
+Parser.add_argument('--bootstrap', action='store_true',
+                    help='Keep existing data and only add what is missing. Safe to run again to resume a bootstrap that partially failed.')
+Parser.add_argument('--synthetic', action='store_true',
+                    help='Fill the database with a synthetic alliance instead of the real one, for scale testing.')
+Parser.add_argument('--corporations', type=int, default=50, help='Amount of synthetic corporations (default: 50).')
+Parser.add_argument('--characters', type=int, default=20000, help='Amount of synthetic characters (default: 20000).')
+Parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic dataset (default: 0).')
+Parser.add_argument('--fixtures', default='esi_fixtures.json', help='File the synthetic ESI fixtures are written to (default: esi_fixtures.json).')
+Arguments = Parser.parse_args()
+FlaskApplication = create_app()
+
+if Arguments.synthetic and Arguments.bootstrap:
+    Parser.error('--synthetic always starts from an empty database and cannot be combined with --bootstrap.')
+
+if not Arguments.bootstrap:
+    Database.drop_all()
+    Database.create_all()
+    # A fresh database already has the latest schema, mark it so migrations start from there
+    with FlaskApplication.app_context():
+        stamp()
+else:
+    Database.create_all()
+
+if Arguments.synthetic:
+    # Create a synthetic alliance and the fixtures the local ESI stand-in needs to serve it
+    Fixtures = generate_synthetic_alliance(FlaskApplication.config['ALLIANCE_ID'], FlaskApplication.config['ADMIN_CHARACTER_ID'],
+                                           Arguments.corporations, Arguments.characters, Arguments.seed)
+    with open(Arguments.fixtures, 'w') as FixtureFile:
+        json.dump(Fixtures, FixtureFile)
+    print('Wrote ESI fixtures to {}. Set ESI_FIXTURE_FILE to serve them instead of ESI.'.format(Arguments.fixtures))
+    FailedCorporationIds = []
+else:
+    # Create all corps in the alliance
+    FailedCorporationIds = SharedInfo['util'].bootstrap_alliance(FlaskApplication.config['ALLIANCE_ID'])
+    if FailedCorporationIds is None:
+        raise SystemExit('Alliance with ID {} could not be found.'.format(FlaskApplication.config['ALLIANCE_ID']))
 
 # Make admin
 Admin = SharedInfo['util'].create_character(FlaskApplication.config['ADMIN_CHARACTER_ID'])
+if Admin is None:
+    raise SystemExit('Admin character with ID {} could not be created.'.format(FlaskApplication.config['ADMIN_CHARACTER_ID']))
 
 # Make admin role
-AdminRole = Role('Admin')
-Admin.roles.append(AdminRole)
-
-# Make permissions
-AdminPermission = Permission('admin')
-CorpManagerPermission = Permission('corp_manager')
-ReadMembershipPermission = Permission('read_membership')
-EditMemberPermission = Permission('edit_member')
-ReadApplicationsPermission = Permission('read_applications')
-ReviewApplicationsPermission = Permission('review_applications')
-ParseESIPermission = Permission('parse_esi')
-
-# Link permissions
-AdminRole.permissions.append(AdminPermission)
-AdminRole.permissions.append(CorpManagerPermission)
-AdminRole.permissions.append(ReadMembershipPermission)
-AdminRole.permissions.append(EditMemberPermission)
-AdminRole.permissions.append(ReadApplicationsPermission)
-AdminRole.permissions.append(ReviewApplicationsPermission)
-AdminRole.permissions.append(ParseESIPermission)
+AdminRole = SharedInfo['util'].get_or_create_role('Admin')
+if AdminRole not in Admin.roles:
+    Admin.roles.append(AdminRole)
+    Admin.invalidate_permissions()
+
+# Make and link permissions
+for PermissionName in DefaultPermissions:
+    DefaultPermission = SharedInfo['util'].get_or_create_permission(PermissionName)
+    if DefaultPermission not in AdminRole.permissions:
+        AdminRole.permissions.append(DefaultPermission)
+AdminRole.invalidate_permissions()
+
+# Make sure every character follows the alliance of its corporation
+SharedInfo['util'].refresh_character_alliances(commit=False)
 
 Database.session.commit()
+
+if FailedCorporationIds:
+    raise SystemExit('{} corporations could not be created. Run again with --bootstrap to retry them.'.format(str(len(FailedCorporationIds))))
@@ -0,0 +1,52 @@
+"""gunicorn settings of the application, used by gunicorn_run.sh.
+
+The audit pages spend most of their time waiting for ESI, so a worker should keep answering other requests
+while one of its requests waits. AUTH_WORKER_PROFILE picks how:
+
+    gthread  Threaded workers (default). Every worker handles AUTH_THREADS requests at the same time.
+    gevent   Cooperative workers, every request is a greenlet. Needs gevent (pip install gevent).
+    sync     One request per worker at a time, like before.
+
+AUTH_WORKERS sets the amount of workers. With SQLite, turn on the SQLite production mode (SQLITE_WAL) so the
+requests of all threads can use the database at the same time, with other databases make SQLALCHEMY_POOL_SIZE
+at least AUTH_THREADS.
+"""
+import multiprocessing
+import os
+
+# Worker class and amount of requests one worker handles at the same time, per profile
+WorkerProfiles = {
+    'gthread': ('gthread', int(os.environ.get('AUTH_THREADS', 8))),
+    'gevent': ('gevent', int(os.environ.get('AUTH_WORKER_CONNECTIONS', 100))),
+    'sync': ('sync', 1),
+}
+
+WorkerProfile = os.environ.get('AUTH_WORKER_PROFILE', 'gthread')
+if WorkerProfile not in WorkerProfiles:
+    raise RuntimeError('Unknown AUTH_WORKER_PROFILE {}, use one of {}.'.format(WorkerProfile, ', '.join(sorted(WorkerProfiles))))
+
+# The master preloads the application, so it has to be patched before anything creates a lock, thread local or
+# socket. Patching only in the workers would leave the application with real threading primitives
+if WorkerProfile == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = os.environ.get('AUTH_BIND', '127.0.0.1:3000')
+workers = int(os.environ.get('AUTH_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 9)))
+worker_class, concurrency = WorkerProfiles[WorkerProfile]
+if worker_class == 'gevent':
+    worker_connections = concurrency
+else:
+    threads = concurrency
+# Audits of characters with many contacts take minutes
+timeout = 300
+graceful_timeout = 30
+# The master creates the application once and the workers share its memory. The log, metrics and SQLite writer
+# threads are started by every worker when it first needs them
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Connections opened by the master while creating the application must not be shared by the workers
+    from auth.shared import Database
+    Database.engine.dispose()
@@ -1,2 +1,3 @@
 #!/bin/bash
-gunicorn -t 300 -b 127.0.0.1:3000 auth:FlaskApplication
+# Worker settings are in gunicorn.conf.py, pick the worker type with AUTH_WORKER_PROFILE (gthread, gevent or sync)
+gunicorn -c gunicorn.conf.py 'auth:create_app()'
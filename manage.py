@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+import os
+from flask import url_for
+from flask_migrate import MigrateCommand
+from flask_script import Manager
+from auth.app import Database, create_app
+from auth.assets import build_static_assets, remove_built_assets
+from auth.models import *
+from auth.hr.members import MainSearchKeys, get_main_search_query
+from auth.hr.applications import ApplicationSortKeys
+from auth.query_stats import query_budget
+from auth.templating import compile_templates as compile_all_templates
+
+FlaskApplication = create_app()
+ScriptManager = Manager(FlaskApplication)
+ScriptManager.add_command('db', MigrateCommand)
+
+# Query budgets of the key views, as (endpoint, URL values, maximum amount of queries). The budgets don't depend
+# on the size of the database, a view going over its budget makes a query per row somewhere.
+QueryBudgets = [
+    ('landing', {}, 8),
+    ('hr.view_corp_members', {}, 8),
+    ('hr.view_member', {'member_id': FlaskApplication.config['ADMIN_CHARACTER_ID']}, 16),
+    ('admin.index', {}, 16),
+]
+
+
+def get_hot_queries():
+    """Builds the hot lookups of the application, with the index each of them should use.
+
+    Args:
+        None
+
+    Returns:
+        list<tuple(str, Query, str)>: Name, query and expected index name of every lookup.
+    """
+
+    character = Character(0, '', 0, '')
+    role = Role('')
+    role.id = 0
+    return [
+        ('Character.get_alts', Character.query.filter_by(main_id=0), 'ix_Characters_main_id'),
+        ('Corporation members', Character.query.filter_by(corp_id=0), 'ix_Characters_corp_id'),
+        ('Alliance members', Character.query.filter(Character.alliance_id == 0), 'ix_Characters_alliance_id'),
+        ('Corporation applications', Application.query.filter_by(corporation_id=0), 'ix_Applications_corporation_id'),
+        ('Character application', Application.query.filter_by(character_id=0), 'ix_Applications_character_id'),
+        ('Role by name', Role.query.filter_by(name=''), 'sqlite_autoindex_Roles_1'),
+        ('Permission by name', Permission.query.filter_by(name=''), 'ix_Permissions_name'),
+        ('Character.get_permissions (roles)', character.get_permission_names_query(), 'uq_RolesConnection_character_id_role_id'),
+        ('Character.get_permissions (permissions)', character.get_permission_names_query(), 'uq_PermissionConnection_role_id_permission_id'),
+        ('Role.invalidate_permissions', Character.query.filter(Character.id.in_(role.get_character_ids_query())), 'ix_RolesConnection_role_id'),
+        ('Application queue by date', Application.query.filter_by(corporation_id=0).order_by(*ApplicationSortKeys['timestamp']).limit(1),
+         'ix_Applications_corporation_id_timestamp'),
+        ('Application queue by status', Application.query.filter_by(corporation_id=0).order_by(*ApplicationSortKeys['status']).limit(1),
+         'ix_Applications_corporation_id_ready_accepted_timestamp'),
+        ('Main search', get_main_search_query('a').order_by(*MainSearchKeys), 'ix_Characters_alliance_id_name_lower'),
+    ]
+
+
+@ScriptManager.command
+def check_query_plans():
+    """Checks with EXPLAIN QUERY PLAN that the hot lookups use their indexes (SQLite only)."""
+
+    if Database.engine.dialect.name != 'sqlite':
+        print('Query plan checks are only available for SQLite.')
+        return
+
+    failedCount = 0
+    for name, query, indexName in get_hot_queries():
+        statement = query.statement.compile(dialect=Database.engine.dialect)
+        parameters = tuple(statement.params[parameter] for parameter in statement.positiontup)
+        plan = [row[-1] for row in Database.engine.execute('EXPLAIN QUERY PLAN ' + str(statement), parameters)]
+
+        usesIndex = any(indexName in detail for detail in plan)
+        failedCount += 0 if usesIndex else 1
+        print('{} {}: {}'.format('OK  ' if usesIndex else 'FAIL', name, ' | '.join(plan)))
+
+    if failedCount:
+        raise SystemExit('{} lookups do not use their index. Run "python manage.py db upgrade".'.format(str(failedCount)))
+
+
+@ScriptManager.command
+def check_query_budgets():
+    """Requests the key views as the admin and checks that none of them goes over its query budget."""
+
+    client = FlaskApplication.test_client()
+    with client.session_transaction() as session:
+        # Flask-Login 0.4 and 0.5 keep the logged in user under different keys
+        session['user_id'] = session['_user_id'] = str(FlaskApplication.config['ADMIN_CHARACTER_ID'])
+        session['_fresh'] = True
+
+    failedCount = 0
+    for endpoint, values, budget in QueryBudgets:
+        with FlaskApplication.test_request_context():
+            url = url_for(endpoint, **values)
+
+        try:
+            with query_budget(budget, endpoint) as stats:
+                response = client.get(url)
+        except AssertionError as e:
+            failedCount += 1
+            print('FAIL {} ({}): {}'.format(endpoint, url, str(e)))
+            continue
+
+        # A redirect (to the login, or away from a view the admin may not see) makes almost no queries
+        if response.status_code != 200:
+            failedCount += 1
+            print('FAIL {} ({}): status {}, check ADMIN_CHARACTER_ID and that the admin is in the alliance'.format(endpoint, url, str(response.status_code)))
+            continue
+        print('OK   {} ({}): {} of {} queries'.format(endpoint, url, str(stats.count), str(budget)))
+
+    if failedCount:
+        raise SystemExit('{} views go over their query budget or could not be checked.'.format(str(failedCount)))
+
+
+@ScriptManager.command
+def build_assets(clean=False):
+    """Builds the fingerprinted and compressed static files, restart the workers afterwards to serve them."""
+
+    assetDirectory = os.path.join(FlaskApplication.root_path, FlaskApplication.config.get('ASSET_DIRECTORY', 'static_build'))
+    if clean:
+        remove_built_assets(assetDirectory)
+
+    built = build_static_assets(FlaskApplication.static_folder, assetDirectory)
+    for asset in built:
+        if asset['name'].endswith(('.css', '.woff', '.woff2', '.ttf')):
+            print('{:<60} {:>9} {}'.format(asset['hashed_name'], str(asset['sizes']['identity']),
+                                           ' '.join('{} {}'.format(encoding, str(size)) for encoding, size in sorted(asset['sizes'].items()) if encoding != 'identity')))
+    print('Built {} files in {}.'.format(str(len(built)), assetDirectory))
+
+
+@ScriptManager.command
+def compile_templates(clean=False):
+    """Compiles every template into the template cache, so the first page a worker renders after a deploy is not slower."""
+
+    bytecodeCache = FlaskApplication.jinja_env.bytecode_cache
+    if bytecodeCache is None:
+        raise SystemExit('There is no template cache, set TEMPLATE_CACHE_DIRECTORY.')
+    if clean:
+        bytecodeCache.clear()
+
+    compiled = compile_all_templates(FlaskApplication)
+    for name, seconds in compiled:
+        print('{:<45} {:>8.1f} ms'.format(name, 1000 * seconds))
+    print('Compiled {} templates into {} in {:.1f} ms.'.format(str(len(compiled)), bytecodeCache.directory, 1000 * sum(seconds for name, seconds in compiled)))
+
+
+if __name__ == '__main__':
+    ScriptManager.run()
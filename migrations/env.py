@@ -0,0 +1,98 @@
+from __future__ import with_statement
+from alembic import context
+from logging.config import fileConfig
+import logging
+
+# this is the Alembic Config object, which provides
+# access to the values within the .ini file in use.
+config = context.config
+
+# Interpret the config file for Python logging.
+# This line sets up loggers basically.
+fileConfig(config.config_file_name)
+logger = logging.getLogger('alembic.env')
+
+# Use the engine of the application, so relative SQLite paths resolve
+# the same way they do for Flask-SQLAlchemy.
+from flask import current_app
+Database = current_app.extensions['migrate'].db
+config.set_main_option('sqlalchemy.url', str(Database.engine.url).replace('%', '%%'))
+target_metadata = Database.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Leaves expression indexes out of autogenerate. They can not be reflected, so they would be
+    added again by every new revision. They are created by hand in their revision instead.
+
+    Args:
+        object (SchemaItem): Schema item that is compared.
+        name (str): Name of the schema item.
+        type_ (str): Type of the schema item.
+        reflected (bool): True if the item was reflected from the database.
+        compare_to (SchemaItem): Item it is compared to, None if there is none.
+
+    Returns:
+        bool: True if the item should be compared.
+    """
+    if type_ == 'index' and not reflected and any(not hasattr(expression, 'table') for expression in object.expressions):
+        return False
+    return True
+
+
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    This configures the context with just a URL
+    and not an Engine, though an Engine is acceptable
+    here as well.  By skipping the Engine creation
+    we don't even need a DBAPI to be available.
+
+    Calls to context.execute() here emit the given string to the
+    script output.
+
+    """
+    url = config.get_main_option("sqlalchemy.url")
+    context.configure(url=url, target_metadata=target_metadata, literal_binds=True)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    In this scenario we need to create an Engine
+    and associate a connection with the context.
+
+    """
+
+    # this callback is used to prevent an auto-migration from being generated
+    # when there are no changes to the schema
+    # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
+    def process_revision_directives(context, revision, directives):
+        if getattr(config.cmd_opts, 'autogenerate', False):
+            script = directives[0]
+            if script.upgrade_ops.is_empty():
+                directives[:] = []
+                logger.info('No changes in schema detected.')
+
+    connection = Database.engine.connect()
+    context.configure(connection=connection,
+                      target_metadata=target_metadata,
+                      process_revision_directives=process_revision_directives,
+                      include_object=include_object,
+                      # SQLite can only alter tables by recreating them
+                      render_as_batch=connection.dialect.name == 'sqlite',
+                      **current_app.extensions['migrate'].configure_args)
+
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        connection.close()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
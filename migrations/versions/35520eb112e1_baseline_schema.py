@@ -0,0 +1,89 @@
+"""Baseline schema, as created by create_database.py before migrations existed.
+
+Revision ID: 35520eb112e1
+Revises:
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '35520eb112e1'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Alliances',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('ticker', sa.String(), nullable=False),
+                    sa.Column('logo', sa.String(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('Corporations',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('ticker', sa.String(), nullable=False),
+                    sa.Column('logo', sa.String(), nullable=False),
+                    sa.Column('recruitment_open', sa.Boolean(), nullable=True),
+                    sa.Column('inhouse_description', sa.String(), nullable=True),
+                    sa.Column('access_token', sa.String(), nullable=True),
+                    sa.Column('refresh_token', sa.String(), nullable=True),
+                    sa.Column('alliance_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['alliance_id'], ['Alliances.id']),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('Characters',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(), nullable=True),
+                    sa.Column('main_id', sa.Integer(), nullable=True),
+                    sa.Column('corp_id', sa.Integer(), nullable=True),
+                    sa.Column('admin_corp_id', sa.Integer(), nullable=True),
+                    sa.Column('access_token', sa.String(), nullable=True),
+                    sa.Column('refresh_token', sa.String(), nullable=True),
+                    sa.Column('reddit', sa.String(), nullable=True),
+                    sa.Column('portrait', sa.String(), nullable=True),
+                    sa.Column('notes', sa.String(), nullable=True),
+                    sa.ForeignKeyConstraint(['corp_id'], ['Corporations.id']),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('Permissions',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('Roles',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('name'))
+    op.create_table('Applications',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('timestamp', sa.DateTime(), nullable=True),
+                    sa.Column('character_id', sa.Integer(), nullable=True),
+                    sa.Column('corporation_id', sa.Integer(), nullable=False),
+                    sa.Column('ready_accepted', sa.Boolean(), nullable=True),
+                    sa.ForeignKeyConstraint(['character_id'], ['Characters.id']),
+                    sa.ForeignKeyConstraint(['corporation_id'], ['Corporations.id']),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('PermissionConnection',
+                    sa.Column('role_id', sa.Integer(), nullable=True),
+                    sa.Column('permission_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['permission_id'], ['Permissions.id']),
+                    sa.ForeignKeyConstraint(['role_id'], ['Roles.id']))
+    op.create_table('RolesConnection',
+                    sa.Column('character_id', sa.Integer(), nullable=True),
+                    sa.Column('role_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['character_id'], ['Characters.id']),
+                    sa.ForeignKeyConstraint(['role_id'], ['Roles.id']))
+
+
+def downgrade():
+    op.drop_table('RolesConnection')
+    op.drop_table('PermissionConnection')
+    op.drop_table('Applications')
+    op.drop_table('Roles')
+    op.drop_table('Permissions')
+    op.drop_table('Characters')
+    op.drop_table('Corporations')
+    op.drop_table('Alliances')
@@ -0,0 +1,36 @@
+"""Make the application status required and index the application queue.
+
+Revision ID: 3f6a9e1d5b27
+Revises: 8d1c2b7e4a90
+Create Date: 2026-10-19 20:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a9e1d5b27'
+down_revision = '8d1c2b7e4a90'
+branch_labels = None
+depends_on = None
+
+applications = sa.table('Applications',
+                        sa.column('ready_accepted', sa.Boolean))
+
+
+def upgrade():
+    # Applications without a status are being processed, the queue can only page on a status that is never null
+    op.execute(applications.update().where(applications.c.ready_accepted.is_(None)).values(ready_accepted=False))
+
+    with op.batch_alter_table('Applications') as batch_op:
+        batch_op.alter_column('ready_accepted', existing_type=sa.Boolean(), nullable=False)
+        batch_op.create_index('ix_Applications_corporation_id_timestamp', ['corporation_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_Applications_corporation_id_ready_accepted_timestamp', ['corporation_id', 'ready_accepted', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Applications') as batch_op:
+        batch_op.drop_index('ix_Applications_corporation_id_ready_accepted_timestamp')
+        batch_op.drop_index('ix_Applications_corporation_id_timestamp')
+        batch_op.alter_column('ready_accepted', existing_type=sa.Boolean(), nullable=True)
@@ -0,0 +1,24 @@
+"""Add the case insensitive name index used by the main search.
+
+Revision ID: 8d1c2b7e4a90
+Revises: c50973163324
+Create Date: 2026-10-19 19:50:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1c2b7e4a90'
+down_revision = 'c50973163324'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression indexes are not supported by op.create_index on every backend, so create it by hand
+    op.execute('CREATE INDEX "ix_Characters_alliance_id_name_lower" ON "Characters" (alliance_id, lower(name))')
+
+
+def downgrade():
+    op.execute('DROP INDEX "ix_Characters_alliance_id_name_lower"')
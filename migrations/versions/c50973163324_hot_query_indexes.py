@@ -0,0 +1,64 @@
+"""Add indexes and uniqueness constraints for the hot lookups.
+
+Revision ID: c50973163324
+Revises: f20cf3aeeedf
+Create Date: 2026-10-19 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c50973163324'
+down_revision = 'f20cf3aeeedf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+
+    # Merge permissions with the same name into the one with the lowest ID, they would break the unique index
+    duplicateNames = connection.execute(sa.text('SELECT name, MIN(id) FROM "Permissions" GROUP BY name HAVING COUNT(*) > 1')).fetchall()
+    for name, keepId in duplicateNames:
+        parameters = {'name': name, 'keep_id': keepId}
+        connection.execute(sa.text('UPDATE "PermissionConnection" SET permission_id = :keep_id WHERE permission_id IN '
+                                   '(SELECT id FROM "Permissions" WHERE name = :name AND id != :keep_id)'), parameters)
+        connection.execute(sa.text('DELETE FROM "Permissions" WHERE name = :name AND id != :keep_id'), parameters)
+
+    # Remove duplicate role and permission links, the link tables have no ID so every duplicated link is replaced by one row
+    for table, firstColumn, secondColumn in [('PermissionConnection', 'role_id', 'permission_id'), ('RolesConnection', 'character_id', 'role_id')]:
+        duplicateLinks = connection.execute(sa.text(
+            'SELECT {first}, {second} FROM "{table}" WHERE {first} IS NOT NULL AND {second} IS NOT NULL '
+            'GROUP BY {first}, {second} HAVING COUNT(*) > 1'.format(table=table, first=firstColumn, second=secondColumn))).fetchall()
+        for firstId, secondId in duplicateLinks:
+            parameters = {'first_id': firstId, 'second_id': secondId}
+            connection.execute(sa.text('DELETE FROM "{table}" WHERE {first} = :first_id AND {second} = :second_id'.format(
+                table=table, first=firstColumn, second=secondColumn)), parameters)
+            connection.execute(sa.text('INSERT INTO "{table}" ({first}, {second}) VALUES (:first_id, :second_id)'.format(
+                table=table, first=firstColumn, second=secondColumn)), parameters)
+
+    op.create_index('ix_Characters_main_id', 'Characters', ['main_id'], unique=False)
+    op.create_index('ix_Characters_corp_id', 'Characters', ['corp_id'], unique=False)
+    op.create_index('ix_Characters_alliance_id', 'Characters', ['alliance_id'], unique=False)
+    op.create_index('ix_Applications_character_id', 'Applications', ['character_id'], unique=False)
+    op.create_index('ix_Applications_corporation_id', 'Applications', ['corporation_id'], unique=False)
+    op.create_index('ix_Permissions_name', 'Permissions', ['name'], unique=True)
+    op.create_index('uq_PermissionConnection_role_id_permission_id', 'PermissionConnection', ['role_id', 'permission_id'], unique=True)
+    op.create_index('ix_PermissionConnection_permission_id', 'PermissionConnection', ['permission_id'], unique=False)
+    op.create_index('uq_RolesConnection_character_id_role_id', 'RolesConnection', ['character_id', 'role_id'], unique=True)
+    op.create_index('ix_RolesConnection_role_id', 'RolesConnection', ['role_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_RolesConnection_role_id', table_name='RolesConnection')
+    op.drop_index('uq_RolesConnection_character_id_role_id', table_name='RolesConnection')
+    op.drop_index('ix_PermissionConnection_permission_id', table_name='PermissionConnection')
+    op.drop_index('uq_PermissionConnection_role_id_permission_id', table_name='PermissionConnection')
+    op.drop_index('ix_Permissions_name', table_name='Permissions')
+    op.drop_index('ix_Applications_corporation_id', table_name='Applications')
+    op.drop_index('ix_Applications_character_id', table_name='Applications')
+    op.drop_index('ix_Characters_alliance_id', table_name='Characters')
+    op.drop_index('ix_Characters_corp_id', table_name='Characters')
+    op.drop_index('ix_Characters_main_id', table_name='Characters')
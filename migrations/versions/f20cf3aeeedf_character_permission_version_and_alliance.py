@@ -0,0 +1,50 @@
+"""Add the permission version and the denormalized alliance to characters.
+
+Revision ID: f20cf3aeeedf
+Revises: 35520eb112e1
+Create Date: 2026-10-19 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import uuid
+
+
+# revision identifiers, used by Alembic.
+revision = 'f20cf3aeeedf'
+down_revision = '35520eb112e1'
+branch_labels = None
+depends_on = None
+
+characters = sa.table('Characters',
+                      sa.column('id', sa.Integer),
+                      sa.column('corp_id', sa.Integer),
+                      sa.column('alliance_id', sa.Integer),
+                      sa.column('permission_version', sa.String))
+corporations = sa.table('Corporations',
+                        sa.column('id', sa.Integer),
+                        sa.column('alliance_id', sa.Integer))
+
+
+def upgrade():
+    with op.batch_alter_table('Characters') as batch_op:
+        batch_op.add_column(sa.Column('permission_version', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('alliance_id', sa.Integer(), nullable=True))
+
+    # Every character gets its own random permission version
+    connection = op.get_bind()
+    for characterId, in connection.execute(sa.select([characters.c.id])).fetchall():
+        connection.execute(characters.update().where(characters.c.id == characterId).values(permission_version=uuid.uuid4().hex))
+
+    # Copy the alliance of every character's corporation
+    connection.execute(characters.update().values(
+        alliance_id=sa.select([corporations.c.alliance_id]).where(corporations.c.id == characters.c.corp_id).as_scalar()))
+
+    with op.batch_alter_table('Characters') as batch_op:
+        batch_op.alter_column('permission_version', existing_type=sa.String(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Characters') as batch_op:
+        batch_op.drop_column('alliance_id')
+        batch_op.drop_column('permission_version')